@@ -0,0 +1,244 @@
+/*
+ * Renders a source page of a static report written with
+ * --virtual-scroll.  The page's .js file calls loadSourceData with the
+ * highlighted lines of the source file and its records (see
+ * write_virtual_source_file_html in static.py), and only the rows
+ * within OVERSCAN pixels of the viewport are ever in the DOM.
+ *
+ * Every row is a whole number of lines of LINE_HEIGHT pixels, so the
+ * position of each row is known without rendering it.
+ */
+(function () {
+  'use strict';
+
+  // The height of each line of a row, in pixels; see sourceview.css
+  var LINE_HEIGHT = 20;
+
+  // How far above and below the viewport to render rows, in pixels
+  var OVERSCAN = 1000;
+
+  // Messages with more lines than this start out collapsed
+  var MAX_MESSAGE_LINES = 7;
+
+  var data;
+  var view;
+  var header;
+
+  // rows[i] is -n for line n of the source, or else the index of a
+  // record in data.records
+  var rows = [];
+
+  // rowOfLine[n] is the index in rows of line n of the source
+  var rowOfLine = [];
+
+  // The lines of the message of each record
+  var messageLines = [];
+
+  // offsets[i] is the number of lines above rows[i], and
+  // offsets[rows.length] the number of lines in all
+  var offsets;
+
+  // Mapping of record index to true for expanded messages
+  var expanded = {};
+
+  // The [first, last] rows in the DOM, or null
+  var rendered = null;
+
+  // The line named by the location's #line-N fragment, if any
+  var targetLine = 0;
+
+  function buildRows() {
+    var byLine = {};
+    data.records.forEach(function (record, i) {
+      (byLine[record[0]] = byLine[record[0]] || []).push(i);
+      messageLines.push(data.strings[record[5]].split('\n'));
+    });
+    for (var n = 1; n <= data.lines.length; n++) {
+      rowOfLine[n] = rows.length;
+      rows.push(-n);
+      (byLine[n] || []).forEach(function (i) { rows.push(i); });
+    }
+  }
+
+  function isCollapsible(i) {
+    return messageLines[i].length > MAX_MESSAGE_LINES;
+  }
+
+  // Get the height in lines of a row
+  function getHeight(row) {
+    if (row < 0) {
+      return 1;
+    }
+    var numLines = messageLines[row].length;
+    if (isCollapsible(row)) {
+      // The toggle takes a line of its own once expanded
+      numLines = expanded[row] ? numLines + 1 : 1;
+    }
+    return Math.max(numLines, data.records[row][6].length, 1);
+  }
+
+  function layout() {
+    offsets = new Float64Array(rows.length + 1);
+    for (var i = 0; i < rows.length; i++) {
+      offsets[i + 1] = offsets[i] + getHeight(rows[i]);
+    }
+    view.style.height = offsets[rows.length] * LINE_HEIGHT + 'px';
+    rendered = null;
+  }
+
+  // Get the index of the row y lines from the top
+  function findRow(y) {
+    var lo = 0;
+    var hi = rows.length - 1;
+    while (lo < hi) {
+      var mid = (lo + hi + 1) >> 1;
+      if (offsets[mid] <= y) {
+        lo = mid;
+      } else {
+        hi = mid - 1;
+      }
+    }
+    return lo;
+  }
+
+  function cell(className, content) {
+    return '<div class="' + className + '">' + content + '</div>';
+  }
+
+  function getMessageHtml(row) {
+    var record = data.records[row];
+    var lines = messageLines[row];
+    // Column numbers are 1-based
+    var indent = new Array(Math.max(record[1], 1)).join(' ');
+    var caret = indent + '<span style="color:green;">^</span>';
+    if (!isCollapsible(row)) {
+      return caret + lines.join('\n' + indent);
+    }
+    var toggle = ('<a href="#" class="sv-toggle" data-record="' + row + '">'
+                  + 'Toggle messages <span class="badge badge-secondary">'
+                  + lines.length + '</span></a>');
+    if (!expanded[row]) {
+      return caret + toggle;
+    }
+    return toggle + '\n' + caret + lines.join('\n' + indent);
+  }
+
+  function renderRow(i) {
+    var row = rows[i];
+    var className = 'sv-row' + (i % 2 ? '' : ' sv-stripe');
+    if (row === -targetLine) {
+      className += ' sv-target';
+    }
+    var html = ('<div class="' + className + '" style="top:'
+                + offsets[i] * LINE_HEIGHT + 'px;height:'
+                + (offsets[i + 1] - offsets[i]) * LINE_HEIGHT + 'px">');
+    if (row < 0) {
+      return (html
+              + cell('sv-line', -row)
+              + cell('sv-count', '')
+              + cell('sv-pass', '')
+              + cell('sv-source highlight',
+                     '<pre>' + data.lines[-row - 1] + '</pre>')
+              + cell('sv-chain', '')
+              + '</div>');
+    }
+    var record = data.records[row];
+    var result = '';
+    if (record[3] === 'success' || record[3] === 'failure') {
+      result = ' sv-' + record[3];
+    }
+    var chain = record[6].map(function (id) {
+      return '<div>' + data.strings[id] + '</div>';
+    });
+    return (html
+            + cell('sv-line', '')
+            + cell('sv-count', record[2])
+            + cell('sv-pass' + result, data.strings[record[4]])
+            + cell('sv-source', '<pre>' + getMessageHtml(row) + '</pre>')
+            + cell('sv-chain', chain.join(''))
+            + '</div>');
+  }
+
+  function render() {
+    if (!rows.length) {
+      return;
+    }
+    var top = -view.getBoundingClientRect().top;
+    var first = findRow(Math.max(top - OVERSCAN, 0) / LINE_HEIGHT);
+    var last = findRow((top + window.innerHeight + OVERSCAN) / LINE_HEIGHT);
+    if (rendered && rendered[0] === first && rendered[1] === last) {
+      return;
+    }
+    rendered = [first, last];
+    var html = [];
+    for (var i = first; i <= last; i++) {
+      html.push(renderRow(i));
+    }
+    view.innerHTML = html.join('');
+  }
+
+  var renderPending = false;
+  function scheduleRender() {
+    if (!renderPending) {
+      renderPending = true;
+      window.requestAnimationFrame(function () {
+        renderPending = false;
+        render();
+      });
+    }
+  }
+
+  // Scroll to the line named by the location's #line-N fragment, as the
+  // browser would if the rows were all there
+  function showTargetLine() {
+    var match = /^#line-(\d+)$/.exec(window.location.hash);
+    if (!match || rowOfLine[+match[1]] === undefined) {
+      return;
+    }
+    targetLine = +match[1];
+    rendered = null;
+    var viewTop = view.getBoundingClientRect().top + window.pageYOffset;
+    window.scrollTo(window.pageXOffset,
+                    viewTop + offsets[rowOfLine[targetLine]] * LINE_HEIGHT
+                    - header.offsetHeight);
+    render();
+  }
+
+  function makeHeader() {
+    header = document.createElement('div');
+    header.className = 'sv-header';
+    header.innerHTML = (cell('sv-line', 'Line')
+                        + cell('sv-count', 'Hotness')
+                        + cell('sv-pass', 'Pass')
+                        + cell('sv-source', 'Source')
+                        + cell('sv-chain', 'Function / Inlining Chain'));
+    view.parentNode.insertBefore(header, view);
+  }
+
+  window.loadSourceData = function (sourceData) {
+    data = sourceData;
+    view = document.getElementById('source-view');
+    document.documentElement.style.setProperty('--sv-source-width',
+                                               data.width);
+    makeHeader();
+    buildRows();
+    layout();
+    render();
+    showTargetLine();
+
+    window.addEventListener('scroll', scheduleRender);
+    window.addEventListener('resize', scheduleRender);
+    window.addEventListener('hashchange', showTargetLine);
+    view.addEventListener('click', function (event) {
+      var toggle = event.target.closest('.sv-toggle');
+      if (!toggle) {
+        return;
+      }
+      event.preventDefault();
+      var row = +toggle.getAttribute('data-record');
+      expanded[row] = !expanded[row];
+      layout();
+      render();
+    });
+  };
+})();
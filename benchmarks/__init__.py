@@ -0,0 +1,13 @@
+"""
+Benchmarks for gcc-opt-viewer.
+
+Run from the top of the source tree, e.g.:
+
+  python -m benchmarks.bench_memory
+
+The main phases can be timed together on a synthetic build, and the
+results kept as a baseline for later runs to be compared with:
+
+  python -m benchmarks.bench_suite --output baseline.json
+  python -m benchmarks.bench_suite --baseline baseline.json
+"""
@@ -0,0 +1,136 @@
+"""
+Compare the memory used by the __slots__-based record model in optrecord
+with the previous __dict__-based one, on a synthetic translation unit.
+
+  python -m benchmarks.bench_memory [NUM_RECORDS]
+"""
+import sys
+import tracemalloc
+
+from optrecord import TranslationUnit
+from benchmarks.synthetic import make_tu
+
+############################################################################
+# The record model as it was before __slots__ and sharing of locations.
+
+class LegacyTranslationUnit:
+    def __init__(self, filename, json_obj, size):
+        self.filename = filename
+        self.pass_by_id = {}
+        self.size = size
+        metadata, passes, records = json_obj
+        self.passes = [LegacyPass(obj, self) for obj in passes]
+        self.records = [LegacyRecord(obj, self, 0) for obj in records]
+
+class LegacyPass:
+    def __init__(self, json_obj, tu):
+        self.id_ = json_obj['id']
+        self.name = json_obj['name']
+        self.num = json_obj['num']
+        self.optgroups = set(json_obj['optgroups'])
+        self.type = json_obj['type']
+        tu.pass_by_id[self.id_] = self
+        self.children = [LegacyPass(child, tu)
+                         for child in json_obj.get('children', [])]
+
+def legacy_optional_json_field(cls, jsonobj, field):
+    if field not in jsonobj:
+        return None
+    return cls(jsonobj[field])
+
+class LegacyImplLocation:
+    def __init__(self, json_obj):
+        self.file = json_obj['file']
+        self.line = json_obj['line']
+        self.function = json_obj['function']
+
+class LegacyLocation:
+    def __init__(self, json_obj):
+        self.file = json_obj['file']
+        self.line = json_obj['line']
+        self.column = json_obj['column']
+
+class LegacyCount:
+    def __init__(self, json_obj):
+        self.quality = json_obj['quality']
+        self.value = int(json_obj['value'])
+
+class LegacyRecord:
+    def __init__(self, json_obj, tu, depth):
+        self.kind = json_obj['kind']
+        if 'pass' in json_obj:
+            self.pass_ = tu.pass_by_id[json_obj['pass']]
+        else:
+            self.pass_ = None
+        self.function = json_obj.get('function', None)
+        self.impl_location = legacy_optional_json_field(LegacyImplLocation,
+                                                        json_obj, 'impl_location')
+        self.message = [legacy_item_from_json(obj) for obj in json_obj['message']]
+        self.count = legacy_optional_json_field(LegacyCount, json_obj, 'count')
+        self.location = legacy_optional_json_field(LegacyLocation, json_obj,
+                                                   'location')
+        if 'inlining_chain' in json_obj:
+            self.inlining_chain = [LegacyInliningNode(obj)
+                                   for obj in json_obj['inlining_chain']]
+        else:
+            self.inlining_chain = None
+        self.depth = depth
+        self.children = [LegacyRecord(child, tu, depth + 1)
+                         for child in json_obj.get('children', [])]
+
+class LegacyInliningNode:
+    def __init__(self, json_obj):
+        self.fndecl = json_obj['fndecl']
+        self.site = legacy_optional_json_field(LegacyLocation, json_obj, 'site')
+
+class LegacyItem:
+    def __init__(self, json_obj, field):
+        setattr(self, field, json_obj[field])
+        self.location = legacy_optional_json_field(LegacyLocation, json_obj,
+                                                   'location')
+
+def legacy_item_from_json(json_obj):
+    if isinstance(json_obj, str):
+        return json_obj
+    for field in ('expr', 'stmt', 'symtab_node'):
+        if field in json_obj:
+            return LegacyItem(json_obj, field)
+    raise ValueError('unrecognized item: %r' % json_obj)
+
+############################################################################
+
+def measure(cls, json_obj):
+    """
+    Build a TU from json_obj using cls, returning the number of bytes
+    still allocated afterwards.
+    """
+    tracemalloc.start()
+    try:
+        tu = cls('synthetic.opt-record.json.gz', json_obj, 0)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del tu
+    return current
+
+def count_records(json_objs):
+    return sum(1 + count_records(obj.get('children', []))
+               for obj in json_objs)
+
+def main(argv):
+    num_records = int(argv[0]) if argv else 100000
+    json_obj = make_tu(num_records)
+    total = count_records(json_obj[2])
+
+    print('%i top-level records, %i records in total' % (num_records, total))
+    results = []
+    for name, cls in (('legacy', LegacyTranslationUnit),
+                      ('optrecord', TranslationUnit)):
+        size = measure(cls, json_obj)
+        results.append(size)
+        print('%-10s %12i bytes  %8.1f bytes/record'
+              % (name, size, size / total))
+    print('ratio: %.2f' % (results[0] / results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
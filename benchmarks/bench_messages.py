@@ -0,0 +1,112 @@
+"""
+Compare the single-pass message renderer (utils.render_message_html)
+with the previous recursive one on deeply nested synthetic scopes,
+checking that their output is identical.
+
+  python -m benchmarks.bench_messages [DEPTH [NOTES_PER_SCOPE]]
+"""
+import html
+import random
+import sys
+import time
+
+from optrecord import Record, Expr, Stmt, SymtabNode
+from utils import render_message_html
+
+def url_from_location(loc):
+    return '%s#line-%i' % (loc.file, loc.line)
+
+def legacy_get_html_for_message(record):
+    """get_html_for_message as it was, re-indenting at every level"""
+    html_for_message = ''
+    for item in record.message:
+        if isinstance(item, str):
+            html_for_message += html.escape(str(item))
+        else:
+            if isinstance(item, Expr):
+                html_for_item = '<code>%s</code>' % html.escape(item.expr)
+            elif isinstance(item, Stmt):
+                html_for_item = '<code>%s</code>' % html.escape(item.stmt)
+            elif isinstance(item, SymtabNode):
+                html_for_item = '<code>%s</code>' % html.escape(item.node)
+            else:
+                raise TypeError('unknown message item: %r' % item)
+            if item.location:
+                html_for_item = ('<a href="%s">%s</a>'
+                                 % (url_from_location (item.location), html_for_item))
+            html_for_message += html_for_item
+
+    if record.children:
+        for child in record.children:
+            for line in legacy_get_html_for_message(child).splitlines():
+                html_for_message += '\n  ' + line
+    return html_for_message
+
+def make_note(i):
+    return {'kind': 'note',
+            'message': ['note %i: ' % i,
+                        {'expr': 'x_%i' % i,
+                         'location': {'file': 'a.c', 'line': i, 'column': 1}},
+                        ' not vectorized'],
+            'children': []}
+
+def make_deep_scope(depth, notes_per_scope):
+    """
+    Make the JSON for a chain of depth nested scopes, each also holding
+    notes_per_scope notes.
+    """
+    obj = {'kind': 'scope', 'message': ['innermost scope'], 'children': []}
+    for level in range(depth):
+        obj = {'kind': 'scope',
+               'message': ['scope at depth %i' % (depth - level - 1)],
+               'children': ([make_note(i) for i in range(notes_per_scope)]
+                            + [obj])}
+    return obj
+
+# Messages exercising the corner cases of str.splitlines
+AWKWARD_MESSAGES = [[], [''], ['a'], ['a\n'], ['\n'], ['a\r'], ['\r\n'],
+                    ['a\nb'], ['\x85'], ['a\u2028b'], ['\x0c'],
+                    [{'stmt': 'x\n'}], ['a\n\n']]
+
+def make_random_tree(rng, depth):
+    return {'kind': 'scope',
+            'message': rng.choice(AWKWARD_MESSAGES),
+            'children': [make_random_tree(rng, depth + 1)
+                         for _ in range(rng.randint(0, 3) if depth < 4 else 0)]}
+
+def check_equivalence(num_trees=2000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(num_trees):
+        record = Record(make_random_tree(rng, 0), None, 0)
+        expected = legacy_get_html_for_message(record)
+        actual = render_message_html(record, url_from_location)
+        if actual != expected:
+            raise AssertionError('%r != %r' % (actual, expected))
+
+def timeit(fn, record):
+    start = time.perf_counter()
+    result = fn(record)
+    return time.perf_counter() - start, result
+
+def main(argv):
+    max_depth = int(argv[0]) if argv else 64
+    notes_per_scope = int(argv[1]) if len(argv) > 1 else 32
+
+    check_equivalence()
+    print('equivalence check passed')
+
+    depth = 4
+    while depth <= max_depth:
+        record = Record(make_deep_scope(depth, notes_per_scope), None, 0)
+        legacy_time, expected = timeit(legacy_get_html_for_message, record)
+        new_time, actual = timeit(
+            lambda r: render_message_html(r, url_from_location), record)
+        assert actual == expected
+        print('depth %4i: %8i bytes  legacy %8.4fs  single-pass %8.4fs'
+              '  (%.1fx)'
+              % (depth, len(actual), legacy_time, new_time,
+                 legacy_time / new_time))
+        depth *= 2
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,286 @@
+"""
+Time the main phases of gcc-opt-viewer on a synthetic build (see
+benchmarks.synthetic), reporting the wall time, peak RSS and records
+per second of each as JSON, and optionally comparing them with a
+baseline from an earlier run.
+
+  python -m benchmarks.bench_suite [--build-dir DIR] [--output FILE]
+                                   [--baseline FILE] [BENCHMARK ...]
+
+Each benchmark runs in a fresh interpreter, so that its peak RSS is its
+own; that includes loading whatever records the phase needs.  The wall
+time is the best of --repeat runs of the phase itself.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # e.g. on Windows, where peak RSS isn't reported
+    resource = None
+
+from benchmarks.synthetic import (add_build_arguments, get_build_config,
+                                  load_build_config, write_build)
+
+# Bump this whenever the meaning of the results changes, so that they
+# aren't compared with a baseline from before
+RESULTS_VERSION = 1
+
+# The requests timed by the server_routes benchmark
+SERVER_ROUTES = ['/',
+                 '/records',
+                 '/records?sort=location',
+                 '/pass/vect',
+                 '/api/records?limit=1000',
+                 '/sourcefile/src/file_0.c']
+
+def get_peak_rss():
+    """Get the peak resident set size of this process in bytes, if known"""
+    if not resource:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+def load_tus(build_dir, jobs):
+    from utils import find_records
+    return find_records(build_dir, jobs)
+
+def load_report_inputs(build_dir, jobs):
+    """Get the filtered TUs and highest count, as the static report does"""
+    from recordfilter import DEFAULT_FILTER
+    from static import analyze_counts
+    from utils import find_records
+    tus = find_records(build_dir, jobs, record_filter=DEFAULT_FILTER)
+    stats = analyze_counts(tus)
+    return stats.apply(tus), stats.highest_count
+
+def count_records(tus):
+    return sum(tu.count_all_records() for tu in tus)
+
+# Each benchmark takes (build_dir, out_dir, jobs), does any setup, and
+# returns (fn, number of records), where fn runs the phase being timed.
+
+def bench_from_filename(build_dir, out_dir, jobs):
+    from optrecord import TranslationUnit
+    from utils import find_record_files
+    filenames = find_record_files(build_dir)
+    def fn():
+        return [TranslationUnit.from_filename(filename)
+                for filename in filenames]
+    return fn, count_records(fn())
+
+def bench_find_records(build_dir, out_dir, jobs):
+    def fn():
+        return load_tus(build_dir, jobs)
+    return fn, count_records(fn())
+
+def bench_iter_all_records(build_dir, out_dir, jobs):
+    tus = load_tus(build_dir, jobs)
+    def fn():
+        for tu in tus:
+            for record in tu.iter_all_records():
+                pass
+    return fn, count_records(tus)
+
+def bench_server_routes(build_dir, out_dir, jobs):
+    import server
+    tus = load_tus(build_dir, jobs)
+    server.set_tus(tus)
+    server.app.build_dir = build_dir
+    client = server.app.test_client()
+    def fn():
+        for route in SERVER_ROUTES:
+            response = client.get(route)
+            if response.status_code != 200:
+                raise RuntimeError('%s: HTTP %i' % (route, response.status_code))
+    return fn, count_records(tus)
+
+def bench_make_index_html(build_dir, out_dir, jobs):
+    from static import make_index_html
+    tus, highest_count = load_report_inputs(build_dir, jobs)
+    def fn():
+        make_index_html(out_dir, tus, highest_count)
+    return fn, count_records(tus)
+
+def bench_make_per_source_file_html(build_dir, out_dir, jobs):
+    from static import make_per_source_file_html
+    tus, highest_count = load_report_inputs(build_dir, jobs)
+    def fn():
+        make_per_source_file_html(build_dir, out_dir, tus, highest_count,
+                                  jobs)
+    return fn, count_records(tus)
+
+def bench_make_outline(build_dir, out_dir, jobs):
+    from static import make_outline
+    tus, _ = load_report_inputs(build_dir, jobs)
+    def fn():
+        make_outline(build_dir, out_dir, tus)
+    return fn, count_records(tus)
+
+BENCHMARKS = {
+    'from_filename': bench_from_filename,
+    'find_records': bench_find_records,
+    'iter_all_records': bench_iter_all_records,
+    'server_routes': bench_server_routes,
+    'make_index_html': bench_make_index_html,
+    'make_per_source_file_html': bench_make_per_source_file_html,
+    'make_outline': bench_make_outline,
+}
+
+def run_benchmark(name, build_dir, jobs, repeat):
+    """Run the benchmark called name in this process, returning its results"""
+    out_dir = tempfile.mkdtemp(prefix='opt-viewer-bench-')
+    try:
+        # Keep the phases' progress messages out of the results
+        with contextlib.redirect_stdout(sys.stderr):
+            fn, num_records = BENCHMARKS[name](build_dir, out_dir, jobs)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(out_dir)
+    wall_time = min(times)
+    return {'wall_time': wall_time,
+            'times': times,
+            'peak_rss': get_peak_rss(),
+            'records': num_records,
+            'records_per_sec': num_records / wall_time if wall_time else None}
+
+def run_in_subprocess(name, build_dir, jobs, repeat):
+    """Run the benchmark called name in a fresh interpreter"""
+    # Run from the top of the source tree, as the modules expect
+    top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite',
+                             '--run-one', name, '--build-dir', build_dir,
+                             '--jobs', str(jobs), '--repeat', str(repeat)],
+                            cwd=top_dir, stdout=subprocess.PIPE,
+                            check=True).stdout
+    return json.loads(output)
+
+def compare(results, baseline, threshold):
+    """
+    Print (to stderr) how results compare with baseline, returning the
+    names of the benchmarks whose wall time or peak RSS grew by more
+    than threshold (a fraction).
+    """
+    if baseline.get('version') != RESULTS_VERSION:
+        print('baseline is from an incompatible version of the benchmarks',
+              file=sys.stderr)
+        return []
+    if baseline.get('config') != results['config']:
+        print('warning: the baseline was run on a different build:',
+              file=sys.stderr)
+        print('  baseline: %s' % json.dumps(baseline.get('config')),
+              file=sys.stderr)
+        print('  this run: %s' % json.dumps(results['config']),
+              file=sys.stderr)
+
+    regressions = []
+    print('%-28s %10s %10s %7s %9s %9s %7s'
+          % ('benchmark', 'base (s)', 'now (s)', 'time', 'base RSS',
+             'now RSS', 'RSS'), file=sys.stderr)
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        time_ratio = result['wall_time'] / base['wall_time']
+        if result['peak_rss'] and base['peak_rss']:
+            rss_ratio = result['peak_rss'] / base['peak_rss']
+        else:
+            rss_ratio = None
+        regressed = (time_ratio > 1 + threshold
+                     or (rss_ratio and rss_ratio > 1 + threshold))
+        if regressed:
+            regressions.append(name)
+        print('%-28s %10.3f %10.3f %6.2fx %8iM %8iM %7s%s'
+              % (name, base['wall_time'], result['wall_time'], time_ratio,
+                 (base['peak_rss'] or 0) >> 20, (result['peak_rss'] or 0) >> 20,
+                 '%.2fx' % rss_ratio if rss_ratio else '-',
+                 '  REGRESSED' if regressed else ''), file=sys.stderr)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_suite',
+                                     description='Benchmark gcc-opt-viewer on a synthetic build.')
+    parser.add_argument('benchmarks', metavar='BENCHMARK', nargs='*',
+                        help='The benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--build-dir', dest='build_dir', metavar='DIR', type=str,
+                        help='The build to benchmark on, which is generated there if DIR does not exist (default: a temporary build)')
+    add_build_arguments(parser)
+    parser.add_argument('--jobs', '-j', dest='jobs', metavar='N', type=int, default=1,
+                        help='The number of worker processes for the phases to use')
+    parser.add_argument('--repeat', dest='repeat', metavar='N', type=int, default=3,
+                        help='The number of times to run each phase, keeping the best time (default: 3)')
+    parser.add_argument('--output', dest='output', metavar='FILE', type=str,
+                        help='The file to write the results to as JSON (default: stdout)')
+    parser.add_argument('--baseline', dest='baseline', metavar='FILE', type=str,
+                        help='Results from an earlier run to compare with, exiting with status 1 on a regression')
+    parser.add_argument('--threshold', dest='threshold', metavar='FRACTION', type=float, default=0.1,
+                        help='How much slower or bigger a benchmark must get to count as a regression (default: 0.1)')
+    parser.add_argument('--run-one', dest='run_one', metavar='BENCHMARK', choices=BENCHMARKS,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        json.dump(run_benchmark(args.run_one, args.build_dir, args.jobs,
+                                args.repeat),
+                  sys.stdout)
+        return 0
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %r' % name)
+    names = args.benchmarks or list(BENCHMARKS)
+
+    tmp_dir = None
+    build_dir = args.build_dir
+    if not build_dir:
+        tmp_dir = build_dir = tempfile.mkdtemp(prefix='opt-viewer-build-')
+    try:
+        if tmp_dir or not os.path.exists(build_dir):
+            print('writing synthetic build to %s' % build_dir, file=sys.stderr)
+            write_build(build_dir, jobs=args.jobs, **get_build_config(args))
+        results = {'version': RESULTS_VERSION,
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'config': load_build_config(build_dir),
+                   'jobs': args.jobs,
+                   'results': {}}
+        for name in names:
+            print('running %s' % name, file=sys.stderr)
+            results['results'][name] = run_in_subprocess(
+                name, os.path.abspath(build_dir), args.jobs, args.repeat)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+"""
+Generation of synthetic optimization records, in the form written by
+GCC's -fsave-optimization-record.
+
+A whole build tree of them (with the source files they refer to) can be
+written with:
+
+  python -m benchmarks.synthetic OUT_DIR [--tus N] [--records N] ...
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import json
+import os
+import random
+import sys
+
+KINDS = ['success', 'failure', 'note', 'scope']
+QUALITIES = ['precise', 'adjusted', 'guessed', 'guessed_global0']
+
+# The distributions from which counts can be drawn: 'uniform' over
+# [0, 2**20), 'pareto' (a few hot records and a long tail of cold ones,
+# as in real profiles), or 'none' for a build without profile data
+COUNT_DISTRIBUTIONS = ('uniform', 'pareto', 'none')
+
+NUM_SOURCE_LINES = 1000
+
+# The file in which write_build records how a build was generated
+CONFIG_FILENAME = 'synthetic.json'
+
+def make_passes():
+    return [{'id': '0x%x' % (i + 1), 'name': name, 'num': i + 1,
+             'optgroups': optgroups, 'type': 'gimple'}
+            for i, (name, optgroups) in enumerate([
+                ('vect', ['loop', 'vec']),
+                ('slp', ['vec']),
+                ('inline', ['inline']),
+                ('unroll', ['loop']),
+                ('ivopts', ['loop']),
+            ])]
+
+def make_location(rng, src_files, num_lines=NUM_SOURCE_LINES):
+    return {'file': rng.choice(src_files),
+            'line': rng.randint(1, num_lines),
+            'column': rng.randint(1, 40)}
+
+def make_count(rng, counts):
+    if counts == 'pareto':
+        value = min(int(rng.paretovariate(1.1) * 16), 1 << 40)
+    else:
+        value = rng.randint(0, 1 << 20)
+    return {'quality': rng.choice(QUALITIES), 'value': value}
+
+def make_record(rng, passes, src_files, depth, max_depth,
+                inlining_chain_length=2, counts='uniform'):
+    kind = 'scope' if depth < max_depth and rng.random() < 0.2 else rng.choice(KINDS[:3])
+    location = make_location(rng, src_files)
+    obj = {'kind': kind,
+           'pass': rng.choice(passes)['id'],
+           'function': 'fn_%i' % rng.randint(0, 200),
+           'impl_location': {'file': '../../src/gcc/tree-vect-loop.c',
+                             'line': rng.randint(1, 9000),
+                             'function': 'vect_analyze_loop'},
+           'message': ['analyzing loop at ',
+                       {'expr': 'i_%i' % rng.randint(0, 50),
+                        'location': location},
+                       ' with ',
+                       {'stmt': 'x_%i = y_%i + 1;' % (rng.randint(0, 50),
+                                                      rng.randint(0, 50))}],
+           'location': location}
+    if counts != 'none' and rng.random() < 0.8:
+        obj['count'] = make_count(rng, counts)
+    if inlining_chain_length and rng.random() < 0.3:
+        obj['inlining_chain'] = [{'fndecl': obj['function']}]
+        for i in range(1, inlining_chain_length):
+            obj['inlining_chain'].append(
+                {'fndecl': 'caller' if i == 1 else 'caller_%i' % i,
+                 'site': make_location(rng, src_files)})
+    if kind == 'scope':
+        obj['children'] = [make_record(rng, passes, src_files, depth + 1,
+                                       max_depth, inlining_chain_length,
+                                       counts)
+                           for _ in range(rng.randint(1, 4))]
+    return obj
+
+def get_src_files(num_src_files):
+    return ['src/file_%i.c' % i for i in range(num_src_files)]
+
+def make_tu(num_records, num_src_files=20, max_depth=2, seed=0,
+            inlining_chain_length=2, counts='uniform'):
+    """
+    Make the JSON object for a translation unit with num_records
+    top-level records.
+    """
+    rng = random.Random(seed)
+    passes = make_passes()
+    src_files = get_src_files(num_src_files)
+    metadata = {'format': '1',
+                'generator': {'name': 'GNU C17', 'pkgversion': '(GCC) ',
+                              'version': '13.2.0',
+                              'target': 'x86_64-pc-linux-gnu'}}
+    records = [make_record(rng, passes, src_files, 0, max_depth,
+                           inlining_chain_length, counts)
+               for _ in range(num_records)]
+    return [metadata, passes, records]
+
+def write_tu(path, num_records, num_src_files, max_depth, seed,
+             inlining_chain_length, counts):
+    """
+    Write a translation unit made by make_tu to path, as GCC would.
+    This is a module-level function so that it can be run in a worker
+    process.
+    """
+    json_obj = make_tu(num_records, num_src_files, max_depth, seed,
+                       inlining_chain_length, counts)
+    with gzip.open(path, 'wt', compresslevel=1) as f:
+        json.dump(json_obj, f)
+    return path
+
+def write_source_file(path, num_lines=NUM_SOURCE_LINES):
+    with open(path, 'w') as f:
+        for i in range(num_lines):
+            f.write('  x_%i = y_%i + %i; /* synthetic */\n' % (i, i, i))
+
+def write_build(out_dir, num_tus=10, num_records=1000, num_src_files=20,
+                max_depth=2, inlining_chain_length=2, counts='uniform',
+                seed=0, jobs=1):
+    """
+    Write a synthetic build to out_dir: num_tus .opt-record.json.gz files
+    below out_dir/obj, each with num_records top-level records, and the
+    num_src_files source files below out_dir/src that they refer to.
+
+    The same arguments always give the same build.  They are recorded in
+    out_dir/CONFIG_FILENAME.
+    """
+    os.makedirs(os.path.join(out_dir, 'obj'), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, 'src'), exist_ok=True)
+    for src_file in get_src_files(num_src_files):
+        write_source_file(os.path.join(out_dir, src_file))
+
+    paths = [os.path.join(out_dir, 'obj', 'tu_%i.c.opt-record.json.gz' % i)
+             for i in range(num_tus)]
+    args = (paths,
+            [num_records] * num_tus,
+            [num_src_files] * num_tus,
+            [max_depth] * num_tus,
+            [seed * num_tus + i for i in range(num_tus)],
+            [inlining_chain_length] * num_tus,
+            [counts] * num_tus)
+    if jobs > 1 and num_tus > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(write_tu, *args))
+    else:
+        list(map(write_tu, *args))
+
+    with open(os.path.join(out_dir, CONFIG_FILENAME), 'w') as f:
+        json.dump({'num_tus': num_tus,
+                   'num_records': num_records,
+                   'num_src_files': num_src_files,
+                   'max_depth': max_depth,
+                   'inlining_chain_length': inlining_chain_length,
+                   'counts': counts,
+                   'seed': seed},
+                  f, indent=1, sort_keys=True)
+
+def load_build_config(build_dir):
+    """
+    Get the write_build arguments of the build in build_dir, or None if
+    it wasn't written by write_build.
+    """
+    try:
+        with open(os.path.join(build_dir, CONFIG_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def add_build_arguments(parser):
+    parser.add_argument('--tus', dest='num_tus', metavar='N', type=int, default=10,
+                        help='The number of .opt-record.json.gz files (default: 10)')
+    parser.add_argument('--records', dest='num_records', metavar='N', type=int, default=1000,
+                        help='The number of top-level records in each file (default: 1000)')
+    parser.add_argument('--source-files', dest='num_src_files', metavar='N', type=int, default=20,
+                        help='The number of source files that the records refer to (default: 20)')
+    parser.add_argument('--depth', dest='max_depth', metavar='N', type=int, default=2,
+                        help='The maximum nesting depth of scopes (default: 2)')
+    parser.add_argument('--inlining-chain', dest='inlining_chain_length', metavar='N', type=int, default=2,
+                        help='The length of the inlining chains given to some records, or 0 for none (default: 2)')
+    parser.add_argument('--counts', dest='counts', choices=COUNT_DISTRIBUTIONS, default='uniform',
+                        help='The distribution of the execution counts of records (default: uniform)')
+    parser.add_argument('--seed', dest='seed', metavar='N', type=int, default=0,
+                        help='The seed for the random choices (default: 0)')
+
+def get_build_config(args):
+    """Get the write_build keyword arguments given by args"""
+    return {'num_tus': args.num_tus,
+            'num_records': args.num_records,
+            'num_src_files': args.num_src_files,
+            'max_depth': args.max_depth,
+            'inlining_chain_length': args.inlining_chain_length,
+            'counts': args.counts,
+            'seed': args.seed}
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic',
+                                     description='Write a synthetic build with optimization records.')
+    parser.add_argument('out_dir', metavar='OUT_DIR', type=str,
+                        help='The directory to write the build to')
+    add_build_arguments(parser)
+    parser.add_argument('--jobs', '-j', dest='jobs', metavar='N', type=int, default=1,
+                        help='The number of worker processes to use')
+    args = parser.parse_args(argv)
+    write_build(args.out_dir, jobs=args.jobs, **get_build_config(args))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
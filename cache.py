@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+
+# Bump this whenever the classes in optrecord change in a way that
+# affects their pickled form, to invalidate existing cache entries.
+CACHE_VERSION = 1
+
+def hash_file(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class RecordCache:
+    """
+    An on-disk cache of parsed TranslationUnit instances.
+
+    Each entry is a pickle file holding a key describing the
+    .opt-record.json.gz file it was built from (path, size, mtime and
+    optionally a hash of its content), followed by the TranslationUnit
+    itself, so that a stale entry can be detected by unpickling just
+    the key.
+    """
+    def __init__(self, cache_dir, use_hash=False):
+        self.cache_dir = cache_dir
+        self.use_hash = use_hash
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, filename, record_filter=None):
+        """
+        Get the key describing the current state of filename, or None
+        if it can't be read.  The TranslationUnit of a file loaded with
+        a record_filter (a recordfilter.RecordFilter) is stored under a
+        key of its own.
+        """
+        try:
+            st = os.stat(filename)
+            key = {'version': CACHE_VERSION,
+                   'path': os.path.abspath(filename),
+                   'size': st.st_size,
+                   'mtime': st.st_mtime_ns}
+            if self.use_hash:
+                key['sha256'] = hash_file(filename)
+            if record_filter and not record_filter.is_empty():
+                key['filter'] = record_filter.hash
+        except OSError:
+            return None
+        return key
+
+    def get_entry_path(self, filename, suffix='.pickle', filter_hash=None):
+        """
+        Get the path of the entry for filename.  Entries built with a
+        filter (of hash filter_hash) are kept apart from unfiltered ones,
+        so that loads with different filters don't evict each other.
+        """
+        digest = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+        name = digest.hexdigest()
+        if filter_hash:
+            name += '.' + filter_hash[:16]
+        return os.path.join(self.cache_dir, name + suffix)
+
+    def load(self, filename, key):
+        """
+        Get the cached TranslationUnit for filename, or None if there
+        isn't one matching key.
+        """
+        try:
+            path = self.get_entry_path(filename,
+                                       filter_hash=key.get('filter'))
+            with open(path, 'rb') as f:
+                if pickle.load(f) != key:
+                    return None
+                tu = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, IndexError, TypeError, ValueError):
+            # Corrupt or from an incompatible version; it will be
+            # overwritten when the file is reparsed.
+            return None
+        tu.filename = filename
+        return tu
+
+    def store(self, filename, key, tu):
+        """
+        Store tu as the entry for filename.  The entry is written to a
+        temporary file and renamed into place, so that concurrent
+        readers and writers never see a partial entry.
+        """
+        path = self.get_entry_path(filename, filter_hash=key.get('filter'))
+        tmp_path = '%s.%i.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(tu, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    # Only .gz files are written without the brotli package
+    brotli = None
+
+from profiling import profiled
+from utils import log
+
+# The ways in which generate_static_report can compress its output:
+# 'siblings' writes a .gz (and .br) file alongside each page, and 'only'
+# keeps just the compressed files.
+COMPRESS_MODES = ('siblings', 'only')
+
+# The extensions of the output files that are compressed
+COMPRESSED_EXTENSIONS = ('.html', '.css', '.js', '.txt')
+
+# The size of the chunks in which files are read and compressed
+CHUNK_SIZE = 1 << 20
+
+GZIP_LEVEL = 9
+
+# Brotli's top quality (11) is several times slower for a few percent
+# smaller files, which isn't worth it for reports of thousands of pages
+BROTLI_QUALITY = 9
+
+def get_suffixes():
+    """Get the suffixes of the compressed files written for each page"""
+    if brotli:
+        return ['.gz', '.br']
+    return ['.gz']
+
+def get_page_paths(path):
+    """Get the paths of path and of all of its possible compressed forms"""
+    return [path, path + '.gz', path + '.br']
+
+def page_exists(path, compress=None):
+    """
+    Does the page at path exist in the form in which the compress mode
+    writes it?
+    """
+    if compress == 'only':
+        return all(os.path.exists(path + suffix) for suffix in get_suffixes())
+    return os.path.exists(path)
+
+def remove_page(path):
+    """Remove the page at path, and any compressed forms of it"""
+    for page_path in get_page_paths(path):
+        if os.path.exists(page_path):
+            os.remove(page_path)
+
+def write_gzip(path, out):
+    with open(path, 'rb') as f:
+        # mtime=0 so that the same page always compresses to the same file
+        with gzip.GzipFile(filename='', mode='wb', fileobj=out,
+                           compresslevel=GZIP_LEVEL, mtime=0) as gz:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                gz.write(chunk)
+
+def write_brotli(path, out):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            out.write(compressor.process(chunk))
+    out.write(compressor.finish())
+
+WRITERS = {'.gz': write_gzip, '.br': write_brotli}
+
+def is_compressed(path, suffix, st):
+    """
+    Is path + suffix the compressed form of path as it is now?
+
+    Each compressed file is given the mtime of the file it was
+    compressed from, so it's stale once the page has been rewritten.
+    """
+    try:
+        return os.stat(path + suffix).st_mtime_ns == st.st_mtime_ns
+    except OSError:
+        return False
+
+def compress_file(path, keep_original=True):
+    """
+    Write the compressed forms of path that are missing or out of date,
+    streaming it through each compressor a chunk at a time, and remove
+    path itself unless keep_original.
+
+    Return the total size of the files written.  This is a module-level
+    function so that it can be run in a worker thread; zlib and brotli
+    release the GIL while compressing.
+    """
+    st = os.stat(path)
+    size = 0
+    for suffix in get_suffixes():
+        if is_compressed(path, suffix, st):
+            continue
+        tmp_path = path + suffix + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            WRITERS[suffix](path, out)
+        size += os.path.getsize(tmp_path)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, path + suffix)
+    if not keep_original:
+        os.remove(path)
+    return size
+
+def remove_stale_compressed(out_dir):
+    """
+    Remove any compressed pages in out_dir from a previous run whose
+    pages have since been rewritten without compression, so that they
+    aren't served in place of the new pages.
+    """
+    for filename in os.listdir(out_dir):
+        path, suffix = os.path.splitext(os.path.join(out_dir, filename))
+        if suffix not in WRITERS or not path.endswith(COMPRESSED_EXTENSIONS):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not is_compressed(path, suffix, st):
+            os.remove(path + suffix)
+
+@profiled('compress')
+def compress_output(out_dir, compress, jobs=1):
+    """
+    Compress the pages of a static report in out_dir as given by the
+    compress mode (one of COMPRESS_MODES), in up to jobs threads.
+
+    Pages left as they were by an incremental run keep their compressed
+    forms from the previous run.
+    """
+    log('compress_output')
+    keep_original = (compress == 'siblings')
+    paths = sorted(os.path.join(out_dir, filename)
+                   for filename in os.listdir(out_dir)
+                   if filename.endswith(COMPRESSED_EXTENSIONS))
+    if jobs > 1 and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            sizes = list(executor.map(compress_file, paths,
+                                      [keep_original] * len(paths)))
+    else:
+        sizes = [compress_file(path, keep_original) for path in paths]
+    log(' %i pages, wrote %i bytes of %s files'
+        % (len(paths), sum(sizes), '/'.join(get_suffixes())))
@@ -0,0 +1,255 @@
+from collections import Counter
+
+def has_imprecise_count(record):
+    """Does record have a count which isn't precise?"""
+    return record.count is not None and not record.count.is_precise()
+
+def has_precise_count_or_none(record):
+    return not has_imprecise_count(record)
+
+def get_bucket(value):
+    """
+    Get the histogram bucket of a count: 0 for 0, and otherwise n for
+    values from 2**(n-1) to 2**n - 1.
+    """
+    return value.bit_length()
+
+class TranslationUnitCounts:
+    """The numbers and highest counts of the records of a TranslationUnit"""
+    __slots__ = ('num_toplevel', 'num_all', 'num_imprecise_toplevel',
+                 'num_imprecise_all', 'max_count')
+
+    def __init__(self):
+        self.num_toplevel = 0
+        self.num_all = 0
+        # The top-level records with imprecise counts, and the number of
+        # records (including nested ones) below and including them
+        self.num_imprecise_toplevel = 0
+        self.num_imprecise_all = 0
+        # The highest count of any record, nested or not
+        self.max_count = 0
+
+class CountStats:
+    """
+    Statistics of the counts of the records of a list of
+    TranslationUnits, gathered in a single pass over them:
+
+      histograms: mapping of quality (None for records without a count)
+        to a Counter of get_bucket(value) to number of records
+      max_by_quality: mapping of quality to the highest count
+      max_count: the highest count of any record
+      by_tu: mapping of filename to TranslationUnitCounts
+      any_precise: do any top-level records have precise counts?
+      highest_count: the highest count of the top-level records that are
+        kept (see below), by which hotness is normalized
+
+    As in GCC's own reports, if any top-level records have precise
+    counts, those with imprecise ones (and their descendants) are left
+    out; apply gets views of the TranslationUnits without them.
+    """
+    def __init__(self, tus):
+        self.histograms = {}
+        self.max_by_quality = Counter()
+        self.max_count = 0
+        self.by_tu = {}
+        self.any_precise = False
+        self.num_records = 0
+        # The highest counts of the top-level records with precise
+        # counts, and of all of them
+        self.max_precise_toplevel = 0
+        self.max_toplevel = 0
+
+        max_precise_toplevel = 0
+        max_toplevel = 0
+        for tu in tus:
+            counts = self.by_tu[tu.filename] = TranslationUnitCounts()
+            for record in tu.records:
+                imprecise = has_imprecise_count(record)
+                if record.count:
+                    value = record.count.value
+                    if value > max_toplevel:
+                        max_toplevel = value
+                    if not imprecise:
+                        self.any_precise = True
+                        if value > max_precise_toplevel:
+                            max_precise_toplevel = value
+                num_all = self._add_tree(record, counts)
+                counts.num_toplevel += 1
+                counts.num_all += num_all
+                if imprecise:
+                    counts.num_imprecise_toplevel += 1
+                    counts.num_imprecise_all += num_all
+            self.num_records += counts.num_all
+        self.max_precise_toplevel = max_precise_toplevel
+        self.max_toplevel = max_toplevel
+
+    @property
+    def highest_count(self):
+        if self.any_precise:
+            return self.max_precise_toplevel
+        return self.max_toplevel
+
+    @staticmethod
+    def merge(stats_list):
+        """
+        Get the CountStats of the TranslationUnits of each of stats_list
+        together, without walking their records again.
+        """
+        self = CountStats([])
+        for stats in stats_list:
+            for quality, histogram in stats.histograms.items():
+                self.histograms.setdefault(quality, Counter()).update(histogram)
+            for quality, value in stats.max_by_quality.items():
+                if value > self.max_by_quality[quality]:
+                    self.max_by_quality[quality] = value
+            self.max_count = max(self.max_count, stats.max_count)
+            self.by_tu.update(stats.by_tu)
+            self.any_precise = self.any_precise or stats.any_precise
+            self.num_records += stats.num_records
+            self.max_precise_toplevel = max(self.max_precise_toplevel,
+                                            stats.max_precise_toplevel)
+            self.max_toplevel = max(self.max_toplevel, stats.max_toplevel)
+        return self
+
+    def _add_tree(self, record, counts):
+        """
+        Add record and its descendants to the histograms and maxima,
+        returning their number.
+        """
+        num_records = 0
+        stack = [record]
+        while stack:
+            r = stack.pop()
+            num_records += 1
+            count = r.count
+            if count:
+                quality = count.quality
+                value = count.value
+                if value > counts.max_count:
+                    counts.max_count = value
+                if value > self.max_by_quality[quality]:
+                    self.max_by_quality[quality] = value
+            else:
+                quality = None
+                value = 0
+            histogram = self.histograms.get(quality)
+            if histogram is None:
+                histogram = self.histograms[quality] = Counter()
+            histogram[get_bucket(value)] += 1
+            stack.extend(r.children)
+        if counts.max_count > self.max_count:
+            self.max_count = counts.max_count
+        return num_records
+
+    @property
+    def num_excluded(self):
+        """The number of top-level records left out of the report"""
+        if not self.any_precise:
+            return 0
+        return self.num_imprecise_toplevel
+
+    @property
+    def num_imprecise_toplevel(self):
+        """The number of top-level records with imprecise counts"""
+        return sum(counts.num_imprecise_toplevel
+                   for counts in self.by_tu.values())
+
+    def get_num_records(self, quality):
+        """Get the number of records with the given quality of count"""
+        return sum(self.histograms.get(quality, {}).values())
+
+    def apply(self, tus, any_precise=None):
+        """
+        Get the TranslationUnits of tus as the report sees them: tus
+        itself if nothing is left out, and otherwise a
+        TranslationUnitView of each.  If any_precise is given, it is
+        used in place of self.any_precise, e.g. for the stats of some of
+        the TUs of a build.
+        """
+        if any_precise is None:
+            any_precise = self.any_precise
+        if not any_precise or not self.num_imprecise_toplevel:
+            return tus
+        return [TranslationUnitView(tu, has_precise_count_or_none,
+                                    self.by_tu[tu.filename])
+                for tu in tus]
+
+    def format_summary(self):
+        """Get the statistics as lines of text"""
+        lines = ['  %i records: %i with precise counts, %i with other counts,'
+                 ' %i without'
+                 % (self.num_records,
+                    self.get_num_records('precise')
+                    + self.get_num_records('adjusted'),
+                    sum(self.get_num_records(quality)
+                        for quality in self.histograms
+                        if quality not in (None, 'precise', 'adjusted')),
+                    self.get_num_records(None))]
+        for quality in sorted(self.max_by_quality):
+            lines.append('  %s: %i records, highest count %i'
+                         % (quality, self.get_num_records(quality),
+                            self.max_by_quality[quality]))
+        if self.num_excluded:
+            lines.append('  purged %i non-precise records' % self.num_excluded)
+        return lines
+
+    def to_json(self):
+        return {'records': self.num_records,
+                'max_count': self.max_count,
+                'highest_count': self.highest_count,
+                'any_precise': self.any_precise,
+                'excluded': self.num_excluded,
+                'histograms': {str(quality): dict(histogram)
+                               for quality, histogram
+                               in self.histograms.items()},
+                'max_by_quality': dict(self.max_by_quality),
+                'max_by_tu': {filename: counts.max_count
+                              for filename, counts in self.by_tu.items()}}
+
+class RecordsView:
+    """
+    The top-level records of a TranslationUnit accepted by keep, as a
+    sized iterable rather than a copy of the list.
+    """
+    def __init__(self, records, keep, num_records):
+        self.records = records
+        self.keep = keep
+        self.num_records = num_records
+
+    def __iter__(self):
+        return filter(self.keep, self.records)
+
+    def __len__(self):
+        return self.num_records
+
+class TranslationUnitView:
+    """
+    A TranslationUnit without the top-level records (and their
+    descendants) left out by a CountStats, with the same interface.
+    """
+    def __init__(self, tu, keep, counts):
+        self.tu = tu
+        self.records = RecordsView(tu.records, keep,
+                                   counts.num_toplevel
+                                   - counts.num_imprecise_toplevel)
+        self.num_all = counts.num_all - counts.num_imprecise_all
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the view itself
+        if name == 'tu':
+            raise AttributeError(name)
+        return getattr(self.tu, name)
+
+    def __repr__(self):
+        return 'TranslationUnitView(%r)' % self.tu
+
+    def iter_all_records(self):
+        for r in self.records:
+            yield r
+            yield from r.iter_all_descendants()
+
+    def count_toplevel_records(self):
+        return len(self.records)
+
+    def count_all_records(self):
+        return self.num_all
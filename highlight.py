@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import os
+import threading
+
+import pygments
+import pygments.formatters
+import pygments.lexers
+import pygments.util
+
+# Mapping of file extension (or whole basename, for files without one)
+# to lexer class
+_lexer_classes = {}
+
+def get_lexer(filename, code):
+    """
+    Get a pygments lexer for filename.
+
+    The lexer is chosen from the filename alone where possible, and the
+    choice is remembered per extension, since guessing from the content
+    of the file is slow.
+    """
+    basename = os.path.basename(filename)
+    ext = os.path.splitext(basename)[1].lower() or basename
+    cls = _lexer_classes.get(ext)
+    if cls is None:
+        try:
+            cls = type(pygments.lexers.get_lexer_for_filename(filename))
+        except pygments.util.ClassNotFound:
+            try:
+                return pygments.lexers.guess_lexer_for_filename(filename, code)
+            except pygments.util.ClassNotFound:
+                return pygments.lexers.TextLexer()
+        _lexer_classes[ext] = cls
+    return cls()
+
+def highlight_lines(code, lexer, formatter):
+    """
+    Use pygments to convert code to HTML, returning a list with one
+    string of HTML per line of code.
+    """
+    code_as_html = pygments.highlight(code, lexer, formatter)
+
+    EXPECTED_START = '<div class="highlight"><pre>'
+    assert code_as_html.startswith(EXPECTED_START)
+    code_as_html = code_as_html[len(EXPECTED_START):-1]
+
+    EXPECTED_END = '</pre></div>'
+    assert code_as_html.endswith(EXPECTED_END)
+    code_as_html = code_as_html[0:-len(EXPECTED_END)]
+
+    return code_as_html.splitlines()
+
+class HighlightCache:
+    """
+    A size-bounded LRU cache of highlighted source files, as lists of
+    lines of HTML, keyed by path and mtime.
+    """
+    def __init__(self, formatter, max_bytes=64 << 20, make_line=str):
+        self.formatter = formatter
+        self.max_bytes = max_bytes
+        self.make_line = make_line
+
+        self.lock = threading.Lock()
+        # Mapping of path to (mtime, list of lines, size in bytes),
+        # least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_lines(self, path, filename):
+        """
+        Get the highlighted lines of the file at path, using filename to
+        pick the lexer.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == mtime:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path) as f:
+            code = f.read()
+        lines = [self.make_line(line)
+                 for line in highlight_lines(code, get_lexer(filename, code),
+                                             self.formatter)]
+        size = sum(len(line) for line in lines)
+
+        with self.lock:
+            old_entry = self.entries.pop(path, None)
+            if old_entry:
+                self.size -= old_entry[2]
+            self.entries[path] = (mtime, lines, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+        return lines
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self.entries),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes}
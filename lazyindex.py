@@ -0,0 +1,538 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+from itertools import islice
+import json
+import os
+import threading
+
+from countstats import CountStats
+from optrecord import Location
+from recordindex import RecordIndex, merge_function
+from utils import find_record_files, load_translation_units, log
+
+# Bump this whenever the content of summaries changes, to rebuild them
+SUMMARY_VERSION = 2
+
+# The default bound on the total decompressed size of the .json.gz files
+# whose TranslationUnits are held in memory at once
+DEFAULT_MAX_BYTES = 1 << 30
+
+def get_summary_path(filename, cache=None, record_filter=None):
+    """
+    Get the path of the summary of filename: in cache's directory if
+    there is a cache, and otherwise alongside filename.  Summaries built
+    with a record_filter get a path of their own.
+    """
+    filter_hash = None
+    if record_filter and not record_filter.is_empty():
+        filter_hash = record_filter.hash
+    if cache:
+        return cache.get_entry_path(filename, '.summary.json', filter_hash)
+    if filename.endswith('.json.gz'):
+        filename = filename[:-len('.json.gz')]
+    if filter_hash:
+        filename += '.' + filter_hash[:16]
+    return filename + '.summary.json'
+
+def get_file_key(filename, record_filter=None):
+    """
+    Get a key describing the current state of filename, and the
+    record_filter (if any) its summary was built with, or None
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    key = [SUMMARY_VERSION, st.st_size, st.st_mtime_ns]
+    if record_filter and not record_filter.is_empty():
+        key.append(record_filter.hash)
+    return key
+
+def location_to_json(loc):
+    if not loc:
+        return None
+    return [loc.file, loc.line, loc.column]
+
+def location_from_json(json_obj):
+    if not json_obj:
+        return None
+    file_, line, column = json_obj
+    return Location({'file': file_, 'line': line, 'column': column})
+
+def summarize_index(tu, index):
+    """Get the JSON of the summary of tu, given index, a RecordIndex of it"""
+    return {'size': tu.size,
+            'num_toplevel': index.count_top_level,
+            'num_records': index.count_all,
+            'passes': index.passes,
+            'functions': [[f.name, f.sourcefile, f.hotness,
+                           location_to_json(f.peak_location)]
+                          for f in index.functions_by_name.values()],
+            'files': {sourcefile: dict(stats)
+                      for sourcefile, stats in index.file_stats.items()}}
+
+class TranslationUnitSummary:
+    """
+    What the index page needs to know about a TranslationUnit, small
+    enough to be loaded for every TU at startup.
+
+    If some of the TU's top-level records have imprecise counts, precise
+    is the summary of the TU without them (see countstats.CountStats),
+    and otherwise None.
+    """
+    def __init__(self, filename, json_obj):
+        self.filename = filename
+        self.size = json_obj['size']
+        self.num_toplevel = json_obj['num_toplevel']
+        self.num_records = json_obj['num_records']
+        # List of [passname, num top-level records, num overall records]
+        self.passes = json_obj['passes']
+        # List of [name, sourcefile, hotness, peak location], in the
+        # order in which the functions are first seen
+        self.functions = json_obj['functions']
+        # Mapping of source file to mapping of kind to number of records
+        self.files = json_obj['files']
+        self.passnames = set(p[0] for p in self.passes)
+        self.function_names = set(f[0] for f in self.functions)
+        # Do any of the TU's top-level records have precise counts?
+        self.any_precise = json_obj.get('any_precise', False)
+        self.precise = None
+        if json_obj.get('precise'):
+            self.precise = TranslationUnitSummary(filename,
+                                                  json_obj['precise'])
+
+    @staticmethod
+    def from_translation_unit(tu, stats):
+        """Summarize tu, given stats, its CountStats"""
+        json_obj = summarize_index(tu, RecordIndex([tu]))
+        json_obj['any_precise'] = stats.any_precise
+        if stats.num_imprecise_toplevel:
+            json_obj['precise'] = summarize_index(
+                tu, RecordIndex(stats.apply([tu], True)))
+        return TranslationUnitSummary(tu.filename, json_obj)
+
+    def to_json(self):
+        json_obj = {'size': self.size,
+                    'num_toplevel': self.num_toplevel,
+                    'num_records': self.num_records,
+                    'passes': self.passes,
+                    'functions': self.functions,
+                    'files': self.files,
+                    'any_precise': self.any_precise}
+        if self.precise:
+            json_obj['precise'] = self.precise.to_json()
+        return json_obj
+
+    def get_view(self, any_precise):
+        """
+        Get the summary of the TU as served, given whether any top-level
+        records of the build have precise counts
+        """
+        if any_precise and self.precise:
+            return self.precise
+        return self
+
+    def __repr__(self):
+        return 'TranslationUnitSummary(%r)' % self.filename
+
+    def may_match(self, query):
+        """Might any of the TU's records match query (a RecordQuery)?"""
+        if query.passname is not None and query.passname not in self.passnames:
+            return False
+        if (query.function is not None
+                and query.function not in self.function_names):
+            return False
+        if query.sourcefile is not None and query.sourcefile not in self.files:
+            return False
+        return True
+
+def load_summary(filename, cache=None, record_filter=None):
+    """Get the summary of filename, or None if it's missing or stale"""
+    key = get_file_key(filename, record_filter)
+    try:
+        with open(get_summary_path(filename, cache, record_filter)) as f:
+            json_obj = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if key is None or json_obj.get('key') != key:
+        return None
+    try:
+        return TranslationUnitSummary(filename, json_obj)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def store_summary(summary, key, cache=None, record_filter=None):
+    path = get_summary_path(summary.filename, cache, record_filter)
+    tmp_path = '%s.%i.tmp' % (path, os.getpid())
+    json_obj = summary.to_json()
+    json_obj['key'] = key
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(json_obj, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        # e.g. a read-only build directory; the summary will be rebuilt
+        # next time
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_merge_key(sort, record):
+    """
+    Get the key by which record is ordered by sort (one of
+    recordindex.SORT_ORDERS), for merging pages from different TUs.
+    """
+    hotness = -record.count.value if record.count else 0
+    if sort == 'location':
+        loc = record.location
+        if not loc:
+            return (0, '', 0, 0, hotness)
+        return (1, loc.file, loc.line, loc.column, hotness)
+    if sort == 'pass':
+        if not record.pass_:
+            return (0, '', hotness)
+        return (1, record.pass_.name, hotness)
+    if sort == 'kind':
+        return (record.kind, hotness)
+    return hotness
+
+class LazyIndex:
+    """
+    The interface of recordindex.RecordIndex for the .json.gz files in a
+    build directory, parsing each one only when a request needs its
+    records.
+
+    At startup, only a TranslationUnitSummary is loaded for each file,
+    which is enough for the index page; summaries that are missing or
+    stale are rebuilt by a background thread.  The TUs that have been
+    parsed are held (each with a RecordIndex of its own) in an LRU cache
+    bounded by max_bytes of decompressed JSON.  Only the records kept by
+    record_filter (a recordfilter.RecordFilter, if any) are loaded.
+
+    As in the static report, if any top-level records have precise
+    counts, those with other counts are left out (see
+    countstats.CountStats).  Whether any do is known from the summaries;
+    until every TU has been summarized, it is decided by those that
+    have been, and TUs parsed before it changes are parsed again.
+    """
+    def __init__(self, build_dir, jobs=1, cache=None,
+                 max_bytes=DEFAULT_MAX_BYTES, record_filter=None):
+        log('LazyIndex: %r' % build_dir)
+        self.jobs = jobs
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.record_filter = record_filter
+
+        self.filenames = find_record_files(build_dir)
+        self.lock = threading.Lock()
+        self.summaries = {}
+        for filename in self.filenames:
+            summary = load_summary(filename, cache, record_filter)
+            if summary:
+                self.summaries[filename] = summary
+        log(' %i of %i summaries are up to date'
+            % (len(self.summaries), len(self.filenames)))
+
+        # The aggregates over self.summaries, rebuilt when it changes
+        self._aggregates = None
+
+        # Mapping of filename to (RecordIndex, size, any_precise as of
+        # its loading), least recently used first, and of filename to
+        # the lock held while loading it
+        self.loaded = OrderedDict()
+        self.loaded_size = 0
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+        # Mapping of (top, coverage) to the triage.TriageReport of the
+        # records, filled in by the server and emptied by update
+        self.triage_reports = {}
+
+        missing = [filename for filename in self.filenames
+                   if filename not in self.summaries]
+        if missing:
+            self.summarizer = threading.Thread(target=self._summarize,
+                                               args=(missing,), daemon=True)
+            self.summarizer.start()
+
+    def update(self, changed, removed):
+        """
+        Forget what is known about the TUs in changed and removed (lists
+        of filenames), adding any new ones in changed; for use as a
+        watcher.Watcher's on_change.  The changed TUs are summarized
+        again in the background.
+        """
+        with self.lock:
+            for filename in changed + removed:
+                self.summaries.pop(filename, None)
+                entry = self.loaded.pop(filename, None)
+                if entry:
+                    self.loaded_size -= entry[1]
+            self.filenames = sorted(set(self.filenames).union(changed)
+                                    .difference(removed))
+            self._aggregates = None
+            self.triage_reports = {}
+        if changed:
+            threading.Thread(target=self._summarize, args=(changed,),
+                             daemon=True).start()
+
+    def _summarize(self, filenames):
+        """Build the summaries of filenames, a batch at a time"""
+        executor = None
+        if self.jobs > 1 and len(filenames) > 1:
+            executor = ProcessPoolExecutor(max_workers=self.jobs)
+        try:
+            batch_size = max(self.jobs, 1) * 4
+            for start in range(0, len(filenames), batch_size):
+                for tu in load_translation_units(
+                        filenames[start:start + batch_size], self.cache,
+                        executor, self.record_filter):
+                    with self.lock:
+                        if tu.filename in self.summaries:
+                            continue
+                    self._add_summary(tu, CountStats([tu]))
+        finally:
+            if executor:
+                executor.shutdown()
+        log(' summarized %i files' % len(filenames))
+
+    def _add_summary(self, tu, stats):
+        key = get_file_key(tu.filename, self.record_filter)
+        summary = TranslationUnitSummary.from_translation_unit(tu, stats)
+        store_summary(summary, key, self.cache, self.record_filter)
+        with self.lock:
+            self.summaries[tu.filename] = summary
+            self._aggregates = None
+
+    ########################################################################
+    # Aggregates over the summaries, for the index page
+
+    def _get_aggregates(self):
+        with self.lock:
+            aggregates = self._aggregates
+            summaries = [self.summaries[filename]
+                         for filename in self.filenames
+                         if filename in self.summaries]
+        if aggregates is None:
+            any_precise = any(summary.any_precise for summary in summaries)
+            aggregates = self._aggregate([summary.get_view(any_precise)
+                                          for summary in summaries])
+            aggregates['any_precise'] = any_precise
+            with self.lock:
+                self._aggregates = aggregates
+        return aggregates
+
+    @staticmethod
+    def _aggregate(summaries):
+        functions = {}
+        passes = {}
+        file_stats = {}
+        for summary in summaries:
+            for name, sourcefile, hotness, peak_location in summary.functions:
+                merge_function(functions, name, sourcefile, hotness,
+                               summary.filename,
+                               location_from_json(peak_location))
+            for passname, num_toplevel, num_records in summary.passes:
+                counts = passes.setdefault(passname, [passname, 0, 0])
+                counts[1] += num_toplevel
+                counts[2] += num_records
+            for sourcefile, stats in summary.files.items():
+                file_stats.setdefault(sourcefile, Counter()).update(stats)
+
+        tu_stats = [(summary, summary.num_toplevel, summary.num_records)
+                    for summary in summaries]
+        return {
+            'tus': summaries,
+            'tu_stats': tu_stats,
+            'functions': sorted(functions.values(), key=lambda f: f.hotness,
+                                reverse=True),
+            'passes': sorted(passes.values(), key=lambda p: p[0] or ''),
+            'file_stats': file_stats,
+            'sourcefiles': sorted(file_stats.items()),
+            'total_size': sum(summary.size for summary in summaries),
+            'count_top_level': sum(stats[1] for stats in tu_stats),
+            'count_all': sum(stats[2] for stats in tu_stats)}
+
+    tus = property(lambda self: self._get_aggregates()['tus'])
+    tu_stats = property(lambda self: self._get_aggregates()['tu_stats'])
+    functions = property(lambda self: self._get_aggregates()['functions'])
+    passes = property(lambda self: self._get_aggregates()['passes'])
+    sourcefiles = property(lambda self: self._get_aggregates()['sourcefiles'])
+    total_size = property(lambda self: self._get_aggregates()['total_size'])
+    count_top_level = property(
+        lambda self: self._get_aggregates()['count_top_level'])
+    count_all = property(lambda self: self._get_aggregates()['count_all'])
+    any_precise = property(lambda self: self._get_aggregates()['any_precise'])
+
+    ########################################################################
+    # Parsed TranslationUnits
+
+    def get_tu_index(self, filename):
+        """
+        Get a RecordIndex of the TranslationUnit for filename, parsing it
+        if it isn't in memory, or None if it can't be read.
+        """
+        any_precise = self.any_precise
+        with self.lock:
+            entry = self.loaded.get(filename)
+            if entry and entry[2] != any_precise:
+                # Loaded with other records left out
+                del self.loaded[filename]
+                self.loaded_size -= entry[1]
+                entry = None
+            if entry:
+                self.loaded.move_to_end(filename)
+                self.hits += 1
+                return entry[0]
+            # Only one thread parses any given file
+            loading = self.loading.setdefault(filename, threading.Lock())
+
+        with loading:
+            with self.lock:
+                entry = self.loaded.get(filename)
+                if entry and entry[2] == any_precise:
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            try:
+                index = self._load(filename)
+            finally:
+                with self.lock:
+                    self.loading.pop(filename, None)
+        return index
+
+    def _load(self, filename):
+        tus = load_translation_units([filename], self.cache,
+                                     record_filter=self.record_filter)
+        if not tus:
+            return None
+        tu = tus[0]
+        stats = CountStats(tus)
+        with self.lock:
+            have_summary = filename in self.summaries
+        if not have_summary:
+            self._add_summary(tu, stats)
+        any_precise = self.any_precise
+        index = RecordIndex(stats.apply(tus, any_precise))
+
+        with self.lock:
+            entry = self.loaded.pop(filename, None)
+            if entry:
+                self.loaded_size -= entry[1]
+            self.loaded[filename] = (index, tu.size, any_precise)
+            self.loaded_size += tu.size
+            while self.loaded_size > self.max_bytes and len(self.loaded) > 1:
+                _, (_, evicted_size, _) = self.loaded.popitem(last=False)
+                self.loaded_size -= evicted_size
+        return index
+
+    def iter_candidates(self, query=None, sourcefile=None):
+        """
+        Yield the filenames of the TUs which might have records matching
+        query and/or located in sourcefile.  TUs without a summary yet
+        might match anything.
+        """
+        with self.lock:
+            summaries = dict(self.summaries)
+        for filename in self.filenames:
+            summary = summaries.get(filename)
+            if summary is None:
+                yield filename
+            elif query is not None and not summary.may_match(query):
+                continue
+            elif sourcefile is not None and sourcefile not in summary.files:
+                continue
+            else:
+                yield filename
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'loaded': len(self.loaded),
+                    'bytes': self.loaded_size,
+                    'max_bytes': self.max_bytes,
+                    'summaries': len(self.summaries),
+                    'files': len(self.filenames)}
+
+    ########################################################################
+    # The RecordIndex interface
+
+    def get_records_by_line(self, sourcefile):
+        """
+        Get a mapping of line number to list of records for sourcefile.
+        """
+        by_line = {}
+        for filename in self.iter_candidates(sourcefile=sourcefile):
+            index = self.get_tu_index(filename)
+            if index is None:
+                continue
+            for line, records in index.get_records_by_line(sourcefile).items():
+                by_line.setdefault(line, []).extend(records)
+        return by_line
+
+    def get_file_stats(self, sourcefile):
+        """
+        Get a Counter of the kinds of the records in sourcefile
+        (e.g. 'success', 'failure', 'note').
+        """
+        return self._get_aggregates()['file_stats'].get(sourcefile, Counter())
+
+    def iter_toplevel_records(self):
+        """
+        Yield the top-level records of each TU in turn, parsing each one
+        that isn't in memory.
+        """
+        for filename in self.filenames:
+            index = self.get_tu_index(filename)
+            if index is not None:
+                yield from index.iter_toplevel_records()
+
+    def search(self, query, offset, limit):
+        """
+        Get a page of the records matching query (a
+        searchindex.SearchQuery), hottest first, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+
+        Each TU is searched (parsing it, and indexing it on its first
+        search, if it isn't in memory), and the pages merged.
+        """
+        total = 0
+        pages = []
+        for tu_pos, filename in enumerate(self.filenames):
+            index = self.get_tu_index(filename)
+            if index is None:
+                continue
+            num_records, records = index.search(query, 0, offset + limit)
+            total += num_records
+            pages.append([(get_merge_key('hotness', r), tu_pos, i, r)
+                          for i, r in enumerate(records)])
+        merged = heapq.merge(*pages, key=lambda entry: entry[:3])
+        return total, [entry[3]
+                       for entry in islice(merged, offset, offset + limit)]
+
+    def query(self, query, offset, limit):
+        """
+        Get a page of records matching query, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+
+        Each candidate TU is queried for its first offset + limit
+        matching records, and these are merged in query's sort order.
+        Unfiltered queries thus parse every TU.
+        """
+        total = 0
+        pages = []
+        for tu_pos, filename in enumerate(self.iter_candidates(query)):
+            index = self.get_tu_index(filename)
+            if index is None:
+                continue
+            num_records, records = index.query(query, 0, offset + limit)
+            total += num_records
+            pages.append([(get_merge_key(query.sort, r), tu_pos, i, r)
+                          for i, r in enumerate(records)])
+        merged = heapq.merge(*pages, key=lambda entry: entry[:3])
+        return total, [entry[3]
+                       for entry in islice(merged, offset, offset + limit)]
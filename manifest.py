@@ -0,0 +1,95 @@
+import json
+import os
+
+from cache import hash_file
+from compress import page_exists, remove_page
+
+# Bump this whenever the HTML generated for a page changes for the same
+# inputs, so that an incremental run rewrites every page.
+MANIFEST_VERSION = 5
+
+MANIFEST_FILENAME = 'manifest.json'
+
+class Manifest:
+    """
+    A record, kept in the output directory of a static report, of the
+    inputs that each page was generated from: the .opt-record.json.gz
+    files and source files (with content hashes), and any other
+    parameters such as the highest count used to normalize hotness.
+
+    An incremental run only rewrites the pages whose inputs differ from
+    those recorded by the previous run.  compress is the mode in which
+    the pages are compressed (see compress.COMPRESS_MODES), if at all.
+    record_filter is the recordfilter.RecordFilter with which the
+    records were loaded, which is an input of every page.
+    """
+    def __init__(self, out_dir, compress=None, record_filter=None):
+        self.out_dir = out_dir
+        self.compress = compress
+        self.filter_hash = record_filter.hash if record_filter else None
+        self.path = os.path.join(out_dir, MANIFEST_FILENAME)
+
+        # Mapping of page filename (relative to out_dir) to inputs, as
+        # loaded from the previous run, and as recorded by this one
+        self.old_pages = {}
+        self.pages = {}
+
+        # Mapping of path to content hash, or None if unreadable
+        self.hashes = {}
+
+        try:
+            with open(self.path) as f:
+                obj = json.load(f)
+        except (OSError, ValueError):
+            return
+        if obj.get('version') == MANIFEST_VERSION:
+            self.old_pages = obj['pages']
+
+    def get_hash(self, path):
+        if path not in self.hashes:
+            try:
+                self.hashes[path] = hash_file(path)
+            except OSError:
+                self.hashes[path] = None
+        return self.hashes[path]
+
+    def get_inputs(self, record_files, source_files=(), **params):
+        """
+        Get the inputs of a page generated from the given files and
+        params (which must be JSON-serializable), in the form in which
+        they are stored in the manifest.
+        """
+        return {'records': {path: self.get_hash(path)
+                            for path in sorted(record_files)},
+                'sources': {path: self.get_hash(path)
+                            for path in sorted(source_files)},
+                'filter': self.filter_hash,
+                'params': params}
+
+    def is_up_to_date(self, page, inputs):
+        """
+        Was page generated from inputs by the previous run, and is it
+        still there?
+        """
+        return (self.old_pages.get(page) == inputs
+                and page_exists(os.path.join(self.out_dir, page),
+                                self.compress))
+
+    def add_page(self, page, inputs):
+        """Record that page is now generated from inputs."""
+        self.pages[page] = inputs
+
+    def save(self):
+        """
+        Write the manifest, removing any pages from the previous run
+        that no longer have any inputs.
+        """
+        for page in self.old_pages:
+            if page not in self.pages:
+                remove_page(os.path.join(self.out_dir, page))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'pages': self.pages},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -1,24 +1,202 @@
 #!/usr/bin/python3
 # TODO: license
 import argparse
+import sys
 
-from static import generate_static_report
+from cache import RecordCache
+from compress import COMPRESS_MODES
+from lazyindex import LazyIndex
+import profiling
+from recordfilter import DEFAULT_FILTER, RecordFilter
+from recorddb import RecordDatabase, import_records
+from recorddiff import (DEFAULT_PARTITIONS, DEFAULT_TOP, diff_builds,
+                        format_report)
+from static import generate_static_report, generate_static_report_from_db
+import triage
 from utils import find_records, log
+from watcher import IndexReloader, Watcher
 
-parser = argparse.ArgumentParser(description="Parse the output of GCC's -fsave-optimization-record.")
-parser.add_argument('build_dir', metavar='BUILD_DIR', type=str,
-                    help='The directory in which to look for .json.gz files')
-parser.add_argument('--output-dir', dest='output_dir', metavar='OUTPUT_DIR', type=str, required=False,
-                    help='The directory to which to write .html output')
-args = parser.parse_args()
-
-if args.output_dir:
-    # Static HTML
-    generate_static_report(args.build_dir, args.output_dir)
-else:
-    # Dynamic HTML
-    tus = find_records(args.build_dir)
-    import server
-    server.app.tus = tus
-    server.app.build_dir = args.build_dir
-    server.app.run()
+def add_cache_arguments(parser):
+    parser.add_argument('--jobs', '-j', dest='jobs', metavar='N', type=int, default=1,
+                        help='The number of worker processes to use for loading .json.gz files')
+    parser.add_argument('--cache-dir', dest='cache_dir', metavar='CACHE_DIR', type=str, required=False,
+                        help='The directory in which to cache parsed .json.gz files between runs')
+    parser.add_argument('--cache-hash', dest='cache_hash', action='store_true',
+                        help='Also compare content hashes (not just sizes and mtimes) when checking the cache')
+
+def get_cache(args):
+    if args.cache_dir:
+        return RecordCache(args.cache_dir, args.cache_hash)
+    return None
+
+def write_profile(args):
+    if args.profile:
+        report = profiling.profiler.write_report(args.profile)
+        for line in profiling.format_summary(report):
+            log(line)
+
+def main_import(argv):
+    parser = argparse.ArgumentParser(prog='opt-viewer.py import',
+                                     description="Load the output of GCC's -fsave-optimization-record into an SQLite database.")
+    parser.add_argument('build_dir', metavar='BUILD_DIR', type=str,
+                        help='The directory in which to look for .json.gz files')
+    parser.add_argument('--db', dest='db', metavar='DB', type=str, required=True,
+                        help='The database to load the records into (created if necessary)')
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    db = RecordDatabase(args.db, create=True)
+    import_records(db, args.build_dir, args.jobs, get_cache(args))
+    db.close()
+
+def main_diff(argv):
+    parser = argparse.ArgumentParser(prog='opt-viewer.py diff',
+                                     description="Compare the optimization records of two builds, listing the successes and failures gained and lost, hottest first.")
+    parser.add_argument('old_build_dir', metavar='OLD_BUILD', type=str,
+                        help='The directory in which to look for the .json.gz files of the old build')
+    parser.add_argument('new_build_dir', metavar='NEW_BUILD', type=str,
+                        help='The directory in which to look for the .json.gz files of the new build')
+    add_cache_arguments(parser)
+    parser.add_argument('--partitions', dest='partitions', metavar='N', type=int, default=DEFAULT_PARTITIONS,
+                        help='The number of partitions to spill the records of each build to; raise it to use less memory on very large builds (default: %i)' % DEFAULT_PARTITIONS)
+    parser.add_argument('--top', dest='top', metavar='N', type=int, default=DEFAULT_TOP,
+                        help='The number of changes of each sort to list (default: %i)' % DEFAULT_TOP)
+    parser.add_argument('--output', dest='output', metavar='FILE', type=str, required=False,
+                        help='Also write every change to FILE, as lines of JSON')
+    args = parser.parse_args(argv)
+    if args.partitions < 1:
+        parser.error('--partitions must be at least 1')
+
+    output = open(args.output, 'w') if args.output else None
+    try:
+        report = diff_builds(args.old_build_dir, args.new_build_dir,
+                             args.jobs, get_cache(args), args.partitions,
+                             args.top, output)
+    finally:
+        if output:
+            output.close()
+    for line in format_report(report):
+        log(line)
+
+def main():
+    if sys.argv[1:2] == ['import']:
+        return main_import(sys.argv[2:])
+    if sys.argv[1:2] == ['diff']:
+        return main_diff(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Parse the output of GCC's -fsave-optimization-record.")
+    parser.add_argument('build_dir', metavar='BUILD_DIR', type=str,
+                        help='The directory in which to look for .json.gz files')
+    parser.add_argument('--output-dir', dest='output_dir', metavar='OUTPUT_DIR', type=str, required=False,
+                        help='The directory to which to write .html output')
+    add_cache_arguments(parser)
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='Only rewrite the pages of an existing --output-dir whose inputs have changed')
+    parser.add_argument('--compress', dest='compress', choices=COMPRESS_MODES, required=False,
+                        help='Also write precompressed .gz (and, if the brotli module is installed, .br) copies of each page of --output-dir ("siblings"), or only the compressed copies ("only")')
+    parser.add_argument('--virtual-scroll', dest='virtual_scroll', action='store_true',
+                        help='Write the source pages of --output-dir as small pages which only render the rows in view, loading the source and records from a .js file alongside')
+    parser.add_argument('--triage-top', dest='triage_top', metavar='N', type=int, default=triage.DEFAULT_TOP,
+                        help='The number of failures, loops and functions to rank in triage.html of --output-dir (default: %i)' % triage.DEFAULT_TOP)
+    parser.add_argument('--triage-coverage', dest='triage_coverage', metavar='FRACTION', type=float, default=triage.DEFAULT_COVERAGE,
+                        help='Cut the rankings of triage.html off once they cover this share of the total count of the failures, e.g. 0.95 (default: %g)' % triage.DEFAULT_COVERAGE)
+    parser.add_argument('--profile', dest='profile', metavar='FILE', type=str, required=False,
+                        help='Time each phase of writing --output-dir, and each .json.gz file loaded and source page written, writing a report to FILE as JSON')
+    parser.add_argument('--profile-phase', dest='profile_phase', metavar='PHASE', choices=profiling.PHASES, required=False,
+                        help='With --profile, also capture this phase (one of %s) as given by --profile-capture' % ', '.join(profiling.PHASES))
+    parser.add_argument('--profile-capture', dest='profile_capture', choices=profiling.CAPTURE_MODES, default='cprofile',
+                        help='How to capture --profile-phase: cProfile statistics written to FILE.prof, or the top allocation sites from tracemalloc (default: cprofile)')
+    parser.add_argument('--filter', dest='filter', metavar='FILE', type=str, required=False,
+                        help='Only load the records kept by the JSON filter spec in FILE, which includes or excludes them by source file glob, pass, optgroup, kind, function regex and minimum count, and limits their depth (default: for --output-dir, leave out those in pgen.c and of the slp, fre, pre, profile, cunroll, cunrolli and ivcanon passes; when serving, keep them all)')
+    parser.add_argument('--db', dest='db', metavar='DB', type=str, required=False,
+                        help='Read the records from a database written by "opt-viewer.py import"; BUILD_DIR is then only used to find source files')
+    parser.add_argument('--lazy', dest='lazy', action='store_true',
+                        help='When serving, only parse .json.gz files when a page needs their records')
+    parser.add_argument('--lazy-memory', dest='lazy_memory', metavar='MB', type=int, default=1024,
+                        help='With --lazy, the total decompressed size of the .json.gz files to keep in memory (default: 1024)')
+    parser.add_argument('--watch', dest='watch', action='store_true',
+                        help='When serving, reload .json.gz files under BUILD_DIR as they are added, changed or removed')
+    args = parser.parse_args()
+    if args.db and args.incremental:
+        parser.error('--incremental can not be used with --db')
+    if args.compress and not args.output_dir:
+        parser.error('--compress can only be used with --output-dir')
+    if args.virtual_scroll and not args.output_dir:
+        parser.error('--virtual-scroll can only be used with --output-dir')
+    if args.triage_top < 1:
+        parser.error('--triage-top must be at least 1')
+    if not 0 <= args.triage_coverage <= 1:
+        parser.error('--triage-coverage must be between 0 and 1')
+    if args.profile and not args.output_dir:
+        parser.error('--profile can only be used with --output-dir')
+    if args.profile_phase and not args.profile:
+        parser.error('--profile-phase requires --profile')
+    if args.lazy and (args.db or args.output_dir):
+        parser.error('--lazy can only be used when serving from BUILD_DIR')
+    if args.watch and (args.db or args.output_dir):
+        parser.error('--watch can only be used when serving from BUILD_DIR')
+
+    record_filter = None
+    if args.filter:
+        try:
+            record_filter = RecordFilter.from_file(args.filter)
+        except (OSError, ValueError) as e:
+            parser.error('--filter: %s' % e)
+        if args.db and record_filter.max_depth is not None:
+            parser.error('--filter: max_depth can not be used with --db')
+        if args.db and not args.output_dir:
+            parser.error('--filter can not be used when serving from --db')
+
+    cache = get_cache(args)
+
+    if args.profile:
+        profiling.enable(args.profile_phase, args.profile_capture)
+
+    if args.db:
+        db = RecordDatabase(args.db)
+        if args.output_dir:
+            generate_static_report_from_db(db, args.build_dir, args.output_dir,
+                                           args.jobs, args.compress,
+                                           args.virtual_scroll, args.triage_top,
+                                           args.triage_coverage,
+                                           record_filter or DEFAULT_FILTER)
+            write_profile(args)
+        else:
+            import server
+            server.set_database(db)
+            server.app.build_dir = args.build_dir
+            server.app.run()
+    elif args.output_dir:
+        # Static HTML
+        generate_static_report(args.build_dir, args.output_dir, args.jobs, cache,
+                               args.incremental, args.compress,
+                               args.virtual_scroll, args.triage_top,
+                               args.triage_coverage,
+                               record_filter or DEFAULT_FILTER)
+        write_profile(args)
+    elif args.lazy:
+        import server
+        index = LazyIndex(args.build_dir, args.jobs, cache,
+                          args.lazy_memory << 20, record_filter)
+        server.set_index(index)
+        if args.watch:
+            Watcher(args.build_dir, index.update).start()
+        server.app.build_dir = args.build_dir
+        server.app.run()
+    else:
+        # Dynamic HTML
+        tus = find_records(args.build_dir, args.jobs, cache, record_filter)
+        import server
+        if args.watch:
+            reloader = IndexReloader(tus, server.set_index, args.jobs, cache,
+                                     record_filter)
+            Watcher(args.build_dir, reloader.on_change).start()
+        else:
+            server.set_tus(tus)
+        server.app.build_dir = args.build_dir
+        server.app.run()
+
+# The worker processes used by --jobs re-import this script on platforms
+# that spawn rather than fork them (e.g. Windows), so guard the entrypoint.
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,41 @@
+import codecs
 import gzip
 import json
+import re
+from sys import intern
 
 class TranslationUnit:
     """Top-level class for containing optimization records"""
     @staticmethod
-    def from_filename(filename):
+    def from_filename(filename, record_filter=None):
         with gzip.open(filename) as f:
-            content = f.read()
-            size = len(content)
-        s = content.decode('utf-8')
-        root_obj = json.loads(s)
-        return TranslationUnit(filename, root_obj, size)
+            return TranslationUnit.from_stream(filename, f,
+                                               record_filter=record_filter)
+
+    @staticmethod
+    def from_stream(filename, f, json_decoder=None, record_filter=None):
+        """
+        Build a TranslationUnit from binary file object f, parsing each
+        top-level record as it is read rather than loading the whole
+        JSON document first.  json_decoder is as for JSONStreamReader.
+        If record_filter (a recordfilter.RecordFilter) is given, only the
+        records it keeps are built.
+        """
+        reader = JSONStreamReader(f, json_decoder)
+
+        # Expect a 3-tuple
+        reader.expect('[')
+        metadata = reader.read_value()
+        reader.expect(',')
+        passes = reader.read_value()
+        reader.expect(',')
+
+        tu = TranslationUnit(filename, [metadata, passes, []], 0)
+        tu.records = tu.build_records(reader.iter_array(), record_filter)
+        reader.expect(']')
+        reader.expect_end()
+        tu.size = reader.size
+        return tu
 
     def __init__(self, filename, json_obj, size):
         self.filename = filename
@@ -23,12 +48,40 @@ class TranslationUnit:
         self.format = metadata['format']
         self.generator = Generator(metadata['generator'])
         self.passes = [Pass(obj, self) for obj in passes]
-        self.records = [Record(obj, self, 0) for obj in records]
+        self._shared = None
+        self.records = self.build_records(records)
 
     def __repr__(self):
         return ('TranslationUnit(%r, %r, %r, %r)'
                 % (self.filename, self.generator, self.passes, self.records))
 
+    def build_records(self, json_objs, record_filter=None):
+        """
+        Build top-level Records from json_objs, sharing equal Location
+        and ImplLocation instances between them, and skipping those
+        rejected by record_filter (if any).
+        """
+        if record_filter and not record_filter.is_empty():
+            json_objs = record_filter.iter_kept(json_objs, self)
+        self._shared = {}
+        try:
+            return [Record(obj, self, 0) for obj in json_objs]
+        finally:
+            self._shared = None
+
+    def get_shared(self, cls, json_obj):
+        """
+        Get a cls instance (Location or ImplLocation) for json_obj,
+        reusing an equal one built earlier in build_records if there is one.
+        """
+        if self._shared is None:
+            return cls(json_obj)
+        key = cls.key(json_obj)
+        obj = self._shared.get(key)
+        if obj is None:
+            obj = self._shared[key] = cls(json_obj)
+        return obj
+
     def iter_all_records(self):
         for r in self.records:
             yield r
@@ -73,12 +126,32 @@ def from_optional_json_field(cls, jsonobj, field):
         return None
     return cls(jsonobj[field])
 
+def shared_optional_json_field(cls, jsonobj, field, tu):
+    if field not in jsonobj:
+        return None
+    if tu is None:
+        return cls(jsonobj[field])
+    return tu.get_shared(cls, jsonobj[field])
+
+# The classes below are instantiated for every record, so they use
+# __slots__ rather than a per-instance __dict__, and intern the strings
+# that repeat across records.  Location and ImplLocation instances may be
+# shared between records (see TranslationUnit.get_shared), so treat them
+# as immutable.
+
 class ImplLocation:
     """An implementation location (within the compiler itself)"""
+    __slots__ = ('file', 'line', 'function')
+
     def __init__(self, json_obj):
-        self.file = json_obj['file']
+        self.file = intern(json_obj['file'])
         self.line = json_obj['line']
-        self.function = json_obj['function']
+        self.function = intern(json_obj['function'])
+
+    @staticmethod
+    def key(json_obj):
+        return (ImplLocation, json_obj['file'], json_obj['line'],
+                json_obj['function'])
 
     def __str__(self):
         return '%s:%i: %r' % (self.file, self.line, self.function)
@@ -89,11 +162,18 @@ class ImplLocation:
 
 class Location:
     """A source location"""
+    __slots__ = ('file', 'line', 'column')
+
     def __init__(self, json_obj):
-        self.file = json_obj['file']
+        self.file = intern(json_obj['file'])
         self.line = json_obj['line']
         self.column = json_obj['column']
 
+    @staticmethod
+    def key(json_obj):
+        return (Location, json_obj['file'], json_obj['line'],
+                json_obj['column'])
+
     def __str__(self):
         return '%s:%i:%i' % (self.file, self.line, self.column)
 
@@ -103,8 +183,10 @@ class Location:
 
 class Count:
     """An execution count"""
+    __slots__ = ('quality', 'value')
+
     def __init__(self, json_obj):
-        self.quality = json_obj['quality']
+        self.quality = intern(json_obj['quality'])
         self.value = int(json_obj['value'])
 
     def __repr__(self):
@@ -116,20 +198,27 @@ class Count:
 
 class Record:
     """A optimization record: success/failure/note"""
+    __slots__ = ('kind', 'pass_', 'function', 'impl_location', 'message',
+                 'count', 'location', 'inlining_chain', 'depth', 'children')
+
     def __init__(self, json_obj, tu, depth):
-        self.kind = json_obj['kind']
+        self.kind = intern(json_obj['kind'])
         if 'pass' in json_obj:
             self.pass_ = tu.pass_by_id[json_obj['pass']]
         else:
             self.pass_ = None
-        self.function = json_obj.get('function', None)
-        self.impl_location = from_optional_json_field(ImplLocation, json_obj,
-                                                      'impl_location')
-        self.message = [Item.from_json(obj) for obj in json_obj['message']]
+        if 'function' in json_obj:
+            self.function = intern(json_obj['function'])
+        else:
+            self.function = None
+        self.impl_location = shared_optional_json_field(ImplLocation, json_obj,
+                                                        'impl_location', tu)
+        self.message = [Item.from_json(obj, tu) for obj in json_obj['message']]
         self.count = from_optional_json_field(Count, json_obj, 'count')
-        self.location = from_optional_json_field(Location, json_obj, 'location')
+        self.location = shared_optional_json_field(Location, json_obj,
+                                                   'location', tu)
         if 'inlining_chain' in json_obj:
-            self.inlining_chain = [InliningNode(obj)
+            self.inlining_chain = [InliningNode(obj, tu)
                                    for obj in json_obj['inlining_chain']]
         else:
             self.inlining_chain = None
@@ -157,9 +246,11 @@ class Record:
 
 class InliningNode:
     """A node within an inlining chain"""
-    def __init__(self, json_obj):
-        self.fndecl = json_obj['fndecl']
-        self.site = from_optional_json_field(Location, json_obj, 'site')
+    __slots__ = ('fndecl', 'site')
+
+    def __init__(self, json_obj, tu=None):
+        self.fndecl = intern(json_obj['fndecl'])
+        self.site = shared_optional_json_field(Location, json_obj, 'site', tu)
 
     def __repr__(self):
         return ('InliningNode(%r, %r)'
@@ -167,24 +258,29 @@ class InliningNode:
 
 class Item:
     """Base class for non-string items within a message"""
+    __slots__ = ()
+
     @staticmethod
-    def from_json(json_obj):
+    def from_json(json_obj, tu=None):
         if isinstance(json_obj, str):
             return json_obj
         if 'expr' in json_obj:
-            return Expr(json_obj)
+            return Expr(json_obj, tu)
         elif 'stmt' in json_obj:
-            return Stmt(json_obj)
+            return Stmt(json_obj, tu)
         elif 'symtab_node' in json_obj:
-            return SymtabNode(json_obj)
+            return SymtabNode(json_obj, tu)
         else:
             raise ValueError('unrecognized item: %r' % json_obj)
 
 class Expr(Item):
     """An expression within a message"""
-    def __init__(self, json_obj):
+    __slots__ = ('expr', 'location')
+
+    def __init__(self, json_obj, tu=None):
         self.expr = json_obj['expr']
-        self.location = from_optional_json_field(Location, json_obj, 'location')
+        self.location = shared_optional_json_field(Location, json_obj,
+                                                   'location', tu)
 
     def __str__(self):
         return self.expr
@@ -194,9 +290,12 @@ class Expr(Item):
 
 class Stmt(Item):
     """A statement within a message"""
-    def __init__(self, json_obj):
+    __slots__ = ('stmt', 'location')
+
+    def __init__(self, json_obj, tu=None):
         self.stmt = json_obj['stmt']
-        self.location = from_optional_json_field(Location, json_obj, 'location')
+        self.location = shared_optional_json_field(Location, json_obj,
+                                                   'location', tu)
 
     def __str__(self):
         return self.stmt
@@ -206,9 +305,12 @@ class Stmt(Item):
 
 class SymtabNode(Item):
     """A symbol table node within a message"""
-    def __init__(self, json_obj):
+    __slots__ = ('node', 'location')
+
+    def __init__(self, json_obj, tu=None):
         self.node = json_obj['symtab_node']
-        self.location = from_optional_json_field(Location, json_obj, 'location')
+        self.location = shared_optional_json_field(Location, json_obj,
+                                                   'location', tu)
 
     def __str__(self):
         return self.node
@@ -216,3 +318,103 @@ class SymtabNode(Item):
     def __repr__(self):
         return 'SymtabNode(%r, %r)' % (self.node, self.location)
 
+
+class JSONStreamReader:
+    """
+    Incremental reader for JSON text arriving from a binary file object.
+
+    Only the outermost structure is tokenized here; each value is parsed
+    by json.JSONDecoder.raw_decode once enough of it has been buffered,
+    so memory use is bounded by the largest single value rather than by
+    the whole document.  A json.JSONDecoder other than the default can
+    be given to do that parsing.
+    """
+    CHUNK_SIZE = 1 << 16
+    WHITESPACE = ' \t\n\r'
+    DELIMITER = re.compile(r'[ \t\n\r,\]}]')
+
+    def __init__(self, f, json_decoder=None):
+        self.f = f
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json_decoder or json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.size = 0 # bytes read so far
+
+    def _fill(self, size):
+        """Read at least size more bytes (unless at EOF); return False at EOF."""
+        if self.eof:
+            return False
+        # Discard the consumed part of the buffer:
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(size, self.CHUNK_SIZE))
+        self.size += len(data)
+        if not data:
+            self.eof = True
+            self.buf += self.decoder.decode(b'', final=True)
+            return False
+        self.buf += self.decoder.decode(data)
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return
+            if not self._fill(self.CHUNK_SIZE):
+                return
+
+    def peek(self):
+        """Get the next non-whitespace character, or '' at EOF."""
+        self._skip_whitespace()
+        return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError('expected %r, got %r' % (ch, self.peek()))
+        self.pos += 1
+
+    def expect_end(self):
+        if self.peek():
+            raise ValueError('unexpected trailing data: %r' % self.peek())
+
+    def read_value(self):
+        """Parse and return the next JSON value."""
+        self._skip_whitespace()
+        while True:
+            try:
+                obj, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Possibly a truncated value; read more and retry,
+                # doubling the amount read so that a large value costs
+                # a logarithmic number of attempts:
+                if not self._fill(len(self.buf) - self.pos):
+                    raise
+                continue
+            # A number running up to the end of the buffer (possibly via
+            # a partial fraction or exponent) might continue in the next
+            # chunk:
+            if (not isinstance(obj, (dict, list, str)) and not self.eof
+                    and not self.DELIMITER.search(self.buf, end)):
+                self._fill(self.CHUNK_SIZE)
+                continue
+            self.pos = end
+            return obj
+
+    def iter_array(self):
+        """
+        Parse a JSON array, yielding its elements one at a time.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.peek() != ',':
+                break
+            self.pos += 1
+        self.expect(']')
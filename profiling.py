@@ -0,0 +1,260 @@
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import gzip
+import json
+import os
+import time
+import tracemalloc
+
+from optrecord import TranslationUnit
+
+# The phases of writing a static report that are timed
+PHASES = ('discovery', 'load', 'analyze_counts', 'index', 'triage',
+          'source_pages', 'outline', 'compress')
+
+# The ways in which a single phase can be captured in more detail:
+# 'cprofile' writes cProfile statistics to a .prof file alongside the
+# report, and 'tracemalloc' adds the lines that allocated the most
+# memory during the phase to the report.
+CAPTURE_MODES = ('cprofile', 'tracemalloc')
+
+# The number of allocation sites given in a tracemalloc capture
+TRACEMALLOC_TOP = 25
+
+# The Profiler collecting timings for this run, if any
+profiler = None
+
+class Profiler:
+    """
+    Timings and counters for the phases of a run, and for each
+    .opt-record.json.gz file loaded and each source page written,
+    for --profile.
+
+    If capture_phase is given, that phase is also run under cProfile
+    or tracemalloc, as given by capture (one of CAPTURE_MODES).  Only
+    this process is captured, not any worker processes.
+    """
+    def __init__(self, capture_phase=None, capture='cprofile'):
+        self.capture_phase = capture_phase
+        self.capture = capture
+        self.start_time = time.perf_counter()
+
+        # List of dicts describing each phase, in the order started
+        self.phases = []
+        self.stack = []
+        self.counters = Counter()
+        self.files = []
+        self.pages = []
+        self.captured = None
+
+    @contextmanager
+    def phase(self, name):
+        entry = {'name': name,
+                 'parent': self.stack[-1]['name'] if self.stack else None,
+                 'start': time.perf_counter() - self.start_time}
+        self.phases.append(entry)
+        self.stack.append(entry)
+        capturing = (name == self.capture_phase and not self.captured)
+        if capturing:
+            self.start_capture()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry['seconds'] = time.perf_counter() - start
+            entry['cpu_seconds'] = time.process_time() - cpu_start
+            if capturing:
+                self.captured = self.stop_capture()
+            self.stack.pop()
+
+    def start_capture(self):
+        if self.capture == 'tracemalloc':
+            tracemalloc.start()
+        else:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stop_capture(self):
+        if self.capture == 'tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return {'phase': self.capture_phase,
+                    'mode': 'tracemalloc',
+                    'peak_bytes': peak,
+                    'top': [{'location': str(stat.traceback),
+                             'bytes': stat.size,
+                             'count': stat.count}
+                            for stat in snapshot.statistics('lineno')
+                                                [:TRACEMALLOC_TOP]]}
+        self.cprofile.disable()
+        return {'phase': self.capture_phase,
+                'mode': 'cprofile',
+                'profile': self.cprofile}
+
+    def add_file(self, stats):
+        self.files.append(stats)
+        self.counters['files_loaded'] += 1
+        self.counters['bytes_read'] += stats['compressed_bytes']
+        self.counters['bytes_decompressed'] += stats['decompressed_bytes']
+        self.counters['records_built'] += stats['records']
+
+    def add_page(self, stats):
+        self.pages.append(stats)
+        self.counters['source_pages_written'] += 1
+        self.counters['lines_highlighted'] += stats['lines']
+
+    def get_report(self):
+        report = {'total_seconds': time.perf_counter() - self.start_time,
+                  'phases': self.phases,
+                  'counters': dict(self.counters),
+                  'files': self.files,
+                  'pages': self.pages}
+        if self.captured:
+            report['capture'] = {key: value
+                                 for key, value in self.captured.items()
+                                 if key != 'profile'}
+        return report
+
+    def write_report(self, path):
+        """
+        Write the report as JSON to path, and any cProfile capture to
+        path with '.prof' appended, for pstats or e.g. snakeviz.
+        """
+        report = self.get_report()
+        if self.captured and self.captured['mode'] == 'cprofile':
+            report['capture']['stats_file'] = path + '.prof'
+            self.captured['profile'].dump_stats(path + '.prof')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(tmp_path, path)
+        return report
+
+def enable(capture_phase=None, capture='cprofile'):
+    global profiler
+    profiler = Profiler(capture_phase, capture)
+    return profiler
+
+def is_enabled():
+    return profiler is not None
+
+def phase(name):
+    """
+    A context manager timing the phase called name, if profiling is
+    enabled.
+    """
+    if profiler:
+        return profiler.phase(name)
+    return _null_phase()
+
+@contextmanager
+def _null_phase():
+    yield
+
+def profiled(name):
+    """A decorator timing each call of a function as the phase called name"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_file(stats):
+    if profiler and stats:
+        profiler.add_file(stats)
+
+def add_page(stats):
+    if profiler and stats:
+        profiler.add_page(stats)
+
+############################################################################
+# Loading a file, timing its decompression and JSON parsing separately
+# from the building of the records.
+
+class TimedReader:
+    """Wraps a binary file object, timing its reads"""
+    def __init__(self, f):
+        self.f = f
+        self.seconds = 0.
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        try:
+            return self.f.read(size)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+class TimedDecoder(json.JSONDecoder):
+    """A JSONDecoder timing its calls of raw_decode"""
+    def __init__(self):
+        super().__init__()
+        self.seconds = 0.
+
+    def raw_decode(self, s, idx=0):
+        start = time.perf_counter()
+        try:
+            return super().raw_decode(s, idx)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+def load_timed(filename, record_filter=None):
+    """
+    Load filename as TranslationUnit.from_filename does, returning the
+    TranslationUnit and a dict of timings and sizes for Profiler.add_file.
+    """
+    start = time.perf_counter()
+    with gzip.open(filename) as f:
+        reader = TimedReader(f)
+        decoder = TimedDecoder()
+        tu = TranslationUnit.from_stream(filename, reader, decoder,
+                                         record_filter)
+    seconds = time.perf_counter() - start
+    return tu, {'file': filename,
+                'seconds': seconds,
+                'decompress_seconds': reader.seconds,
+                'json_seconds': decoder.seconds,
+                'build_seconds': seconds - reader.seconds - decoder.seconds,
+                'compressed_bytes': os.path.getsize(filename),
+                'decompressed_bytes': tu.size,
+                'records': tu.count_all_records()}
+
+############################################################################
+
+def format_summary(report, num_slowest=5):
+    """Get a summary of report (from Profiler.get_report) as lines of text"""
+    total = report['total_seconds']
+    lines = ['profile: %.2fs in all' % total]
+    for entry in report['phases']:
+        indent = '  ' if entry['parent'] else ''
+        lines.append(' %s%-24s %9.3fs %5.1f%%  (cpu %.3fs)'
+                     % (indent, entry['name'], entry['seconds'],
+                        100. * entry['seconds'] / total if total else 0,
+                        entry['cpu_seconds']))
+    files = report['files']
+    if files:
+        lines.append(' loading: decompression %.3fs, json %.3fs,'
+                     ' building records %.3fs (summed over files)'
+                     % (sum(f['decompress_seconds'] for f in files),
+                        sum(f['json_seconds'] for f in files),
+                        sum(f['build_seconds'] for f in files)))
+        for f in sorted(files, key=lambda f: f['seconds'],
+                        reverse=True)[:num_slowest]:
+            lines.append('  %8.3fs %r' % (f['seconds'], f['file']))
+    pages = report['pages']
+    if pages:
+        lines.append(' source pages: highlighting %.3fs of %.3fs'
+                     ' (summed over pages)'
+                     % (sum(p['highlight_seconds'] for p in pages),
+                        sum(p['seconds'] for p in pages)))
+        for p in sorted(pages, key=lambda p: p['seconds'],
+                        reverse=True)[:num_slowest]:
+            lines.append('  %8.3fs %r' % (p['seconds'], p['src_file']))
+    for name, value in sorted(report['counters'].items()):
+        lines.append(' %s: %i' % (name, value))
+    return lines
@@ -0,0 +1,685 @@
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+
+from optrecord import Generator, Pass, Record, Location, Expr, Stmt, SymtabNode
+from recordindex import Function
+from searchindex import SearchIndex
+from utils import find_record_files, load_translation_units, log
+
+SCHEMA_VERSION = 1
+
+# Passes are stored once per distinct (name, num, type, optgroups), rather
+# than once per TU, so the pass hierarchy of each TU isn't kept.  Record
+# ids follow a pre-order walk of each TU's records, so the descendants of
+# record r are exactly the records with ids r.id + 1 to r.last_id.
+SCHEMA = '''
+CREATE TABLE tus (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    generator TEXT NOT NULL,
+    num_toplevel INTEGER NOT NULL,
+    num_records INTEGER NOT NULL
+);
+CREATE TABLE passes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    optgroups TEXT NOT NULL,
+    UNIQUE (name, num, type, optgroups)
+);
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE functions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE records (
+    id INTEGER PRIMARY KEY,
+    tu_id INTEGER NOT NULL REFERENCES tus(id),
+    parent_id INTEGER REFERENCES records(id),
+    root_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    pass_id INTEGER REFERENCES passes(id),
+    function_id INTEGER REFERENCES functions(id),
+    file_id INTEGER REFERENCES files(id),
+    line INTEGER,
+    col INTEGER,
+    count INTEGER NOT NULL,
+    quality TEXT,
+    impl_file TEXT,
+    impl_line INTEGER,
+    impl_function TEXT,
+    message TEXT NOT NULL,
+    inlining_chain TEXT
+);
+'''
+
+# Created once the records are loaded, which is quicker than updating
+# them row by row.
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS records_tu ON records(tu_id);
+CREATE INDEX IF NOT EXISTS records_pass ON records(pass_id);
+CREATE INDEX IF NOT EXISTS records_function ON records(function_id);
+CREATE INDEX IF NOT EXISTS records_file_line ON records(file_id, line);
+CREATE INDEX IF NOT EXISTS records_kind ON records(kind);
+CREATE INDEX IF NOT EXISTS records_count ON records(count DESC);
+CREATE INDEX IF NOT EXISTS passes_name ON passes(name);
+'''
+
+# The columns from which _make_record builds a Record
+RECORD_COLUMNS = '''r.id, r.parent_id, r.root_id, r.last_id, r.depth, r.kind,
+    r.pass_id, fn.name, f.path, r.line, r.col, r.count, r.quality,
+    r.impl_file, r.impl_line, r.impl_function, r.message, r.inlining_chain'''
+RECORD_TABLES = '''records r
+    LEFT JOIN functions fn ON fn.id = r.function_id
+    LEFT JOIN files f ON f.id = r.file_id'''
+
+# The ORDER BY clause for each of recordindex.SORT_ORDERS; ties are
+# broken by id, i.e. in load order.
+ORDER_BY = {
+    'hotness': 'r.count DESC, r.id',
+    'location': 'f.path, r.line, r.col, r.count DESC, r.id',
+    'pass': 'p.name, r.count DESC, r.id',
+    'kind': 'r.kind, r.count DESC, r.id',
+}
+
+# The condition on records r that their top-level record has a precise
+# count (see Count.is_precise) or none, looked up by its primary key
+PRECISE_ROOT_CONDITION = '''IFNULL((SELECT root.quality IN ('precise', 'adjusted')
+    FROM records root WHERE root.id = r.root_id), 1)'''
+
+# The number of record files loaded and inserted per transaction
+IMPORT_BATCH_SIZE = 16
+
+def location_to_json(loc):
+    return {'file': loc.file, 'line': loc.line, 'column': loc.column}
+
+def item_to_json(item):
+    if isinstance(item, str):
+        return item
+    if isinstance(item, Expr):
+        json_obj = {'expr': item.expr}
+    elif isinstance(item, Stmt):
+        json_obj = {'stmt': item.stmt}
+    elif isinstance(item, SymtabNode):
+        json_obj = {'symtab_node': item.node}
+    else:
+        raise TypeError('unknown message item: %r' % item)
+    if item.location:
+        json_obj['location'] = location_to_json(item.location)
+    return json_obj
+
+def get_search_fields(kind, passname, function, path, message):
+    """
+    Get the (field, text) pairs for searchindex.SearchIndex.add of a
+    record stored with the given values, as get_record_fields does for
+    a Record.
+    """
+    fields = [('kind', kind)]
+    for item in json.loads(message):
+        if isinstance(item, str):
+            fields.append(('message', item))
+        elif 'expr' in item:
+            fields.append(('expr', item['expr']))
+        elif 'stmt' in item:
+            fields.append(('stmt', item['stmt']))
+        elif 'symtab_node' in item:
+            fields.append(('node', item['symtab_node']))
+    if function is not None:
+        fields.append(('function', function))
+    if passname is not None:
+        fields.append(('pass', passname))
+    if path is not None:
+        fields.append(('file', path))
+    return fields
+
+def inlining_node_to_json(node):
+    json_obj = {'fndecl': node.fndecl}
+    if node.site:
+        json_obj['site'] = location_to_json(node.site)
+    return json_obj
+
+class StoredTranslationUnit:
+    """The metadata of a TranslationUnit held in a RecordDatabase"""
+    def __init__(self, filename, size, format, generator):
+        self.filename = filename
+        self.size = size
+        self.format = format
+        self.generator = generator
+
+    def __repr__(self):
+        return ('StoredTranslationUnit(%r, %r)'
+                % (self.filename, self.generator))
+
+class PassTable:
+    """
+    The passes of a RecordDatabase, keyed by their ids there.  This
+    stands in for the TranslationUnit when building Records from rows.
+    """
+    def __init__(self, conn):
+        self.pass_by_id = {}
+        for id_, name, num, type_, optgroups in conn.execute(
+                'SELECT id, name, num, type, optgroups FROM passes'):
+            Pass({'id': id_, 'name': name, 'num': num, 'type': type_,
+                  'optgroups': json.loads(optgroups)}, self)
+
+    def get_shared(self, cls, json_obj):
+        return cls(json_obj)
+
+class RecordDatabase:
+    """
+    Optimization records held in an SQLite database, so that they can be
+    queried without parsing the .json.gz files, or holding all of the
+    records in memory.
+
+    Each thread gets its own connection, so one instance can be shared
+    by the threads of the server.
+    """
+    def __init__(self, filename, create=False):
+        if not create and not os.path.exists(filename):
+            raise OSError('no such database: %r' % filename)
+        self.filename = filename
+        self._local = threading.local()
+        self._passes = None
+
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0 and create:
+            with self.conn:
+                self.conn.executescript(SCHEMA)
+                self.conn.execute('PRAGMA user_version = %i' % SCHEMA_VERSION)
+        elif version != SCHEMA_VERSION:
+            raise ValueError('%r has schema version %i, expected %i'
+                             % (filename, version, SCHEMA_VERSION))
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.filename)
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    ########################################################################
+    # Loading
+
+    def add_translation_units(self, tus):
+        """
+        Store tus (TranslationUnit instances) in one transaction,
+        replacing any previously stored TUs with the same filenames.
+        """
+        conn = self.conn
+        with conn:
+            self._ids = {'files': {}, 'functions': {}, 'passes': {}}
+            next_id = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM records').fetchone()[0]
+            for tu in tus:
+                log(' importing: %r' % tu.filename)
+                self._delete_tu(tu.filename)
+                rows = []
+                pass_ids = {id_: self._get_pass_id(p)
+                            for id_, p in tu.pass_by_id.items()}
+                cursor = conn.execute(
+                    'INSERT INTO tus (filename, size, format, generator,'
+                    ' num_toplevel, num_records) VALUES (?, ?, ?, ?, ?, ?)',
+                    (tu.filename, tu.size, tu.format,
+                     json.dumps(vars(tu.generator)), len(tu.records), 0))
+                tu_id = cursor.lastrowid
+                for r in tu.records:
+                    next_id = self._add_record_rows(rows, r, tu_id, pass_ids,
+                                                    next_id, None, None)
+                conn.executemany(
+                    'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,'
+                    ' ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                conn.execute('UPDATE tus SET num_records = ? WHERE id = ?',
+                             (len(rows), tu_id))
+            self._ids = None
+        self._passes = None
+
+    def create_indexes(self):
+        with self.conn:
+            self.conn.executescript(INDEXES)
+            self.conn.execute('ANALYZE')
+
+    def _delete_tu(self, filename):
+        row = self.conn.execute('SELECT id FROM tus WHERE filename = ?',
+                                (filename,)).fetchone()
+        if row:
+            self.conn.execute('DELETE FROM records WHERE tu_id = ?', row)
+            self.conn.execute('DELETE FROM tus WHERE id = ?', row)
+
+    def _get_id(self, table, column, value):
+        """Get the id of the row of table (files or functions) for value"""
+        if value is None:
+            return None
+        ids = self._ids[table]
+        id_ = ids.get(value)
+        if id_ is None:
+            self.conn.execute('INSERT OR IGNORE INTO %s (%s) VALUES (?)'
+                              % (table, column), (value,))
+            id_ = ids[value] = self.conn.execute(
+                'SELECT id FROM %s WHERE %s = ?' % (table, column),
+                (value,)).fetchone()[0]
+        return id_
+
+    def _get_pass_id(self, pass_):
+        key = (pass_.name, pass_.num, pass_.type,
+               json.dumps(sorted(pass_.optgroups)))
+        ids = self._ids['passes']
+        id_ = ids.get(key)
+        if id_ is None:
+            self.conn.execute('INSERT OR IGNORE INTO passes'
+                              ' (name, num, type, optgroups)'
+                              ' VALUES (?, ?, ?, ?)', key)
+            id_ = ids[key] = self.conn.execute(
+                'SELECT id FROM passes WHERE name = ? AND num = ?'
+                ' AND type = ? AND optgroups = ?', key).fetchone()[0]
+        return id_
+
+    def _add_record_rows(self, rows, r, tu_id, pass_ids, id_, parent_id,
+                         root_id):
+        """
+        Append rows for r and its descendants, starting at id id_;
+        return the next unused id.
+        """
+        loc = r.location
+        impl = r.impl_location
+        row = [id_, tu_id, parent_id, root_id or id_, None, r.depth, r.kind,
+               pass_ids[r.pass_.id_] if r.pass_ else None,
+               self._get_id('functions', 'name', r.function),
+               self._get_id('files', 'path', loc.file) if loc else None,
+               loc.line if loc else None,
+               loc.column if loc else None,
+               r.count.value if r.count else 0,
+               r.count.quality if r.count else None,
+               impl.file if impl else None,
+               impl.line if impl else None,
+               impl.function if impl else None,
+               json.dumps([item_to_json(item) for item in r.message]),
+               json.dumps([inlining_node_to_json(node)
+                           for node in r.inlining_chain])
+               if r.inlining_chain is not None else None]
+        rows.append(row)
+        next_id = id_ + 1
+        for child in r.children:
+            next_id = self._add_record_rows(rows, child, tu_id, pass_ids,
+                                            next_id, id_, root_id or id_)
+        row[4] = next_id - 1
+        return next_id
+
+    ########################################################################
+    # Queries
+
+    @property
+    def passes(self):
+        if self._passes is None:
+            self._passes = PassTable(self.conn)
+        return self._passes
+
+    def _make_record(self, row):
+        (id_, parent_id, root_id, last_id, depth, kind, pass_id, function,
+         path, line, column, count, quality, impl_file, impl_line,
+         impl_function, message, inlining_chain) = row
+        json_obj = {'kind': kind, 'message': json.loads(message)}
+        if pass_id is not None:
+            json_obj['pass'] = pass_id
+        if function is not None:
+            json_obj['function'] = function
+        if impl_file is not None:
+            json_obj['impl_location'] = {'file': impl_file, 'line': impl_line,
+                                         'function': impl_function}
+        if quality is not None:
+            json_obj['count'] = {'quality': quality, 'value': count}
+        if path is not None:
+            json_obj['location'] = {'file': path, 'line': line,
+                                    'column': column}
+        if inlining_chain is not None:
+            json_obj['inlining_chain'] = json.loads(inlining_chain)
+        return Record(json_obj, self.passes, depth)
+
+    def _load_descendants(self, record, id_, last_id):
+        """Fill in the children of record (with the given ids) and below"""
+        if last_id == id_:
+            return
+        by_id = {id_: record}
+        for row in self.conn.execute(
+                'SELECT %s FROM %s WHERE r.id BETWEEN ? AND ? ORDER BY r.id'
+                % (RECORD_COLUMNS, RECORD_TABLES), (id_ + 1, last_id)):
+            child = by_id[row[0]] = self._make_record(row)
+            by_id[row[1]].children.append(child)
+
+    def iter_records(self, where='1', params=(), order='r.id',
+                     limit=None, offset=0, excluded_roots=None):
+        """
+        Yield the records (including nested ones, each with its
+        descendants) matching the SQL condition where, in the given
+        order.  Records whose top-level record's id is in the
+        excluded_roots set are skipped.
+        """
+        sql = ('SELECT %s FROM %s LEFT JOIN passes p ON p.id = r.pass_id'
+               ' WHERE %s ORDER BY %s' % (RECORD_COLUMNS, RECORD_TABLES,
+                                          where, order))
+        if limit is not None:
+            sql += ' LIMIT %i OFFSET %i' % (limit, offset)
+        for row in self.conn.execute(sql, params):
+            if excluded_roots and row[2] in excluded_roots:
+                continue
+            record = self._make_record(row)
+            self._load_descendants(record, row[0], row[3])
+            yield record
+
+    def iter_toplevel_records(self):
+        """
+        Yield (id, record) pairs for each top-level record, without its
+        descendants.
+        """
+        for row in self.conn.execute(
+                'SELECT %s FROM %s WHERE r.depth = 0 ORDER BY r.id'
+                % (RECORD_COLUMNS, RECORD_TABLES)):
+            yield row[0], self._make_record(row)
+
+    def get_translation_units(self, where='1'):
+        """
+        Get a list of (StoredTranslationUnit, num top-level records, num
+        overall records) triples, ordered by filename, counting only the
+        records r matching the SQL condition where.
+        """
+        if where == '1':
+            sql = ('SELECT filename, size, format, generator,'
+                   ' num_toplevel, num_records FROM tus ORDER BY filename')
+        else:
+            sql = ('SELECT filename, size, format, generator,'
+                   ' IFNULL(n.num_toplevel, 0), IFNULL(n.num_records, 0)'
+                   ' FROM tus LEFT JOIN'
+                   ' (SELECT r.tu_id, SUM(r.depth = 0) AS num_toplevel,'
+                   ' COUNT(*) AS num_records FROM records r WHERE %s'
+                   ' GROUP BY r.tu_id) n ON n.tu_id = tus.id'
+                   ' ORDER BY filename' % where)
+        return [(StoredTranslationUnit(filename, size, format_,
+                                       Generator(json.loads(generator))),
+                 num_toplevel, num_records)
+                for filename, size, format_, generator, num_toplevel,
+                    num_records
+                in self.conn.execute(sql)]
+
+    def get_tu_id(self, filename):
+        row = self.conn.execute('SELECT id FROM tus WHERE filename = ?',
+                                (filename,)).fetchone()
+        return row[0] if row else None
+
+    def count_by_pass(self, excluded_roots=None, where='1'):
+        """
+        Get a list of [pass name (or None), num top-level records, num
+        overall records], ordered by pass name, counting only the records
+        r matching the SQL condition where.
+        """
+        sql = ('SELECT p.name, SUM(r.depth = 0), COUNT(*) FROM records r'
+               ' LEFT JOIN passes p ON p.id = r.pass_id WHERE %s' % where)
+        if excluded_roots:
+            self._set_excluded_roots(excluded_roots)
+            sql += ' AND r.root_id NOT IN temp.excluded_roots'
+        sql += ' GROUP BY p.name ORDER BY p.name'
+        return [list(row) for row in self.conn.execute(sql)]
+
+    def _set_excluded_roots(self, excluded_roots):
+        conn = self.conn
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS excluded_roots'
+                     ' (id INTEGER PRIMARY KEY)')
+        conn.execute('DELETE FROM temp.excluded_roots')
+        conn.executemany('INSERT INTO temp.excluded_roots VALUES (?)',
+                         ((id_,) for id_ in excluded_roots))
+
+    def get_functions(self, where='1'):
+        """
+        Get a list of Function instances, from the hottest down, of the
+        records r matching the SQL condition where.  The peak location
+        is that of a record with the highest count.  As with
+        recordindex.merge_function, the TU is that of the function's
+        first record, and the source file that of its first record with
+        one.
+        """
+        # SQLite takes the bare columns from the row with the MIN() or
+        # MAX(); records are numbered in the order in which they were
+        # added, so the lowest id is the first seen
+        tus = {function_id: tu for function_id, tu, _ in self.conn.execute(
+            'SELECT r.function_id, t.filename, MIN(r.id) FROM records r'
+            ' JOIN tus t ON t.id = r.tu_id WHERE %s'
+            ' GROUP BY r.function_id' % where)}
+        sourcefiles = {function_id: path
+                       for function_id, path, _ in self.conn.execute(
+            'SELECT r.function_id, f.path, MIN(r.id) FROM records r'
+            ' JOIN files f ON f.id = r.file_id WHERE %s'
+            ' GROUP BY r.function_id' % where)}
+        functions = []
+        for function_id, name, hotness, path, line, column in self.conn.execute(
+                'SELECT r.function_id, fn.name, MAX(r.count), f.path, r.line,'
+                ' r.col FROM records r'
+                ' JOIN functions fn ON fn.id = r.function_id'
+                ' LEFT JOIN files f ON f.id = r.file_id WHERE %s'
+                ' GROUP BY r.function_id ORDER BY 3 DESC, r.function_id'
+                % where):
+            if path is not None:
+                peak_location = Location({'file': path, 'line': line,
+                                          'column': column})
+            else:
+                peak_location = None
+            functions.append(Function(name, sourcefiles.get(function_id),
+                                      hotness, tus[function_id],
+                                      peak_location))
+        return functions
+
+    def get_sourcefiles(self, where='1'):
+        """
+        Get a sorted list of (source file, Counter of record kinds) of
+        the records r matching the SQL condition where.
+        """
+        stats = {}
+        for path, kind, n in self.conn.execute(
+                'SELECT f.path, r.kind, COUNT(*) FROM records r'
+                ' JOIN files f ON f.id = r.file_id WHERE %s'
+                ' GROUP BY r.file_id, r.kind' % where):
+            stats.setdefault(path, Counter())[kind] = n
+        return sorted(stats.items())
+
+    def get_file_id(self, sourcefile):
+        row = self.conn.execute('SELECT id FROM files WHERE path = ?',
+                                (sourcefile,)).fetchone()
+        return row[0] if row else None
+
+    def has_precise_counts(self):
+        """Do any top-level records have precise counts?"""
+        return bool(self.conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM records WHERE depth = 0"
+            " AND quality IN ('precise', 'adjusted'))").fetchone()[0])
+
+    def max_count(self, excluded_roots=None, where='1'):
+        """
+        Get the highest count of any top-level record r matching the SQL
+        condition where, and not in excluded_roots
+        """
+        sql = ('SELECT MAX(r.count) FROM records r WHERE r.depth = 0'
+               ' AND %s' % where)
+        if excluded_roots:
+            self._set_excluded_roots(excluded_roots)
+            sql += ' AND r.id NOT IN temp.excluded_roots'
+        return self.conn.execute(sql).fetchone()[0] or 0
+
+class DatabaseIndex:
+    """
+    The interface of recordindex.RecordIndex, answered by queries on a
+    RecordDatabase rather than from records held in memory.  The
+    aggregates shown on the index page are computed once, up front.
+
+    As in the static report, if any top-level records have precise
+    counts, those with other counts (and their descendants) are left
+    out; see countstats.CountStats.
+    """
+    def __init__(self, db):
+        self.db = db
+        # The SQL condition on the records r that are served
+        self.where = PRECISE_ROOT_CONDITION if db.has_precise_counts() else '1'
+        self.tu_stats = db.get_translation_units(self.where)
+        self.tus = [tu for tu, _, _ in self.tu_stats]
+        self.functions = db.get_functions(self.where)
+        self.passes = db.count_by_pass(where=self.where)
+        self.sourcefiles = db.get_sourcefiles(self.where)
+        self.file_stats = dict(self.sourcefiles)
+        self.total_size = sum(tu.size for tu in self.tus)
+        self.count_top_level = sum(stats[1] for stats in self.tu_stats)
+        self.count_all = sum(stats[2] for stats in self.tu_stats)
+
+        # The SearchIndex of every record in hotness order, and the id of
+        # the record at each of its positions, built on first use
+        self._search_index = None
+        self._search_ids = None
+        self._search_lock = threading.Lock()
+
+        # Mapping of (top, coverage) to the triage.TriageReport of the
+        # records, filled in by the server
+        self.triage_reports = {}
+
+    def get_search_index(self):
+        """
+        Get the searchindex.SearchIndex of the records, in hotness order,
+        building it if necessary from the stored columns, without
+        building Records.
+        """
+        with self._search_lock:
+            if self._search_index is None:
+                log('building search index')
+                search_index = SearchIndex()
+                ids = array('q')
+                for (id_, kind, passname, function, path,
+                     message) in self.db.conn.execute(
+                        'SELECT r.id, r.kind, p.name, fn.name, f.path,'
+                        ' r.message FROM %s'
+                        ' LEFT JOIN passes p ON p.id = r.pass_id'
+                        ' WHERE %s ORDER BY %s'
+                        % (RECORD_TABLES, self.where, ORDER_BY['hotness'])):
+                    search_index.add(get_search_fields(kind, passname,
+                                                       function, path,
+                                                       message))
+                    ids.append(id_)
+                self._search_ids = ids
+                self._search_index = search_index
+            return self._search_index
+
+    def search(self, query, offset, limit):
+        """
+        Get a page of the records matching query (a
+        searchindex.SearchQuery), hottest first, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+        """
+        positions = self.get_search_index().search(query)
+        ids = [self._search_ids[pos]
+               for pos in positions[offset:offset + limit]]
+        if not ids:
+            return len(positions), []
+        records = self.db.iter_records('r.id IN (%s)'
+                                       % ', '.join(str(id_) for id_ in ids),
+                                       order=ORDER_BY['hotness'])
+        return len(positions), list(records)
+
+    def get_records_by_line(self, sourcefile):
+        """
+        Get a mapping of line number to list of records for sourcefile.
+        """
+        by_line = {}
+        file_id = self.db.get_file_id(sourcefile)
+        if file_id is None:
+            return by_line
+        for r in self.db.iter_records('r.file_id = ? AND %s' % self.where,
+                                      (file_id,)):
+            by_line.setdefault(r.location.line, []).append(r)
+        return by_line
+
+    def get_file_stats(self, sourcefile):
+        """
+        Get a Counter of the kinds of the records in sourcefile
+        (e.g. 'success', 'failure', 'note').
+        """
+        return self.file_stats.get(sourcefile, Counter())
+
+    def iter_toplevel_records(self):
+        """
+        Yield the top-level records (each with its descendants), in the
+        order in which they were imported.
+        """
+        return self.db.iter_records('r.depth = 0 AND %s' % self.where)
+
+    def query(self, query, offset, limit):
+        """
+        Get a page of records matching query, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+        """
+        conditions = [self.where]
+        params = []
+        if query.kind is not None:
+            conditions.append('r.kind = ?')
+            params.append(query.kind)
+        if query.passname is not None:
+            conditions.append('r.pass_id IN'
+                              ' (SELECT id FROM passes WHERE name = ?)')
+            params.append(query.passname)
+        if query.function is not None:
+            conditions.append('r.function_id ='
+                              ' (SELECT id FROM functions WHERE name = ?)')
+            params.append(query.function)
+        if query.sourcefile is not None:
+            conditions.append('r.file_id ='
+                              ' (SELECT id FROM files WHERE path = ?)')
+            params.append(query.sourcefile)
+        if query.precise_only:
+            # See Count.is_precise
+            conditions.append("r.quality IN ('precise', 'adjusted')")
+        where = ' AND '.join(conditions)
+
+        total = self.db.conn.execute('SELECT COUNT(*) FROM records r WHERE %s'
+                                     % where, params).fetchone()[0]
+        records = list(self.db.iter_records(where, params,
+                                            ORDER_BY[query.sort],
+                                            limit, offset))
+        return total, records
+
+def import_records(db, build_dir, jobs=1, cache=None):
+    """
+    Load the .json.gz files in build_dir and below into db (a
+    RecordDatabase), a batch of files at a time, so that only one batch
+    of TranslationUnits is held in memory at once.
+    """
+    log('import_records: %r' % build_dir)
+
+    filenames = find_record_files(build_dir)
+    executor = None
+    if jobs > 1 and len(filenames) > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        batch_size = max(IMPORT_BATCH_SIZE, jobs)
+        for start in range(0, len(filenames), batch_size):
+            tus = load_translation_units(filenames[start:start + batch_size],
+                                         cache, executor)
+            db.add_translation_units(tus)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    log(' creating indexes')
+    db.create_indexes()
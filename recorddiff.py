@@ -0,0 +1,322 @@
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+from itertools import repeat
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import zlib
+
+from utils import find_record_files, load_translation_unit, log
+
+# The number of files each build's records are spilled to, by the hash
+# of their keys.  Only one partition of each build is in memory at a
+# time, so this bounds memory use to about 1/DEFAULT_PARTITIONS of the
+# records of the larger build.
+DEFAULT_PARTITIONS = 64
+
+# The number of changes of each sort listed by format_report
+DEFAULT_TOP = 20
+
+# The ways in which the records with a key can change between builds,
+# regressions first
+CHANGE_KINDS = ('lost_successes', 'gained_failures',
+                'gained_successes', 'lost_failures')
+
+# The kinds of records that are compared
+DIFF_KINDS = ('success', 'failure')
+
+# SSA names, temporaries and addresses are renumbered from build to
+# build, e.g. "vect__5.6_23" or "D.1234"; digits following a letter, an
+# underscore or a dot are replaced by '#'
+NUMBERING_RE = re.compile(r'0x[0-9a-fA-F]+|(?<=[A-Za-z_.])\d+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_message(record):
+    """
+    Get the text of record's own message, with the parts of it that
+    vary between otherwise identical builds replaced.
+    """
+    text = ''.join(str(item) for item in record.message)
+    text = NUMBERING_RE.sub('#', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def get_record_key(record):
+    """
+    Get the key by which record is matched with records of another
+    build: (pass name, function, source file, line, normalized message).
+
+    The column is left out, as it's the most likely part of the location
+    to change when code is edited nearby.
+    """
+    loc = record.location
+    return (record.pass_.name if record.pass_ else '',
+            record.function or '',
+            loc.file if loc else '',
+            loc.line if loc else 0,
+            normalize_message(record))
+
+def get_partition(key, num_partitions):
+    # Not hash(), which differs between processes
+    return zlib.crc32(repr(key).encode('utf-8')) % num_partitions
+
+def partition_translation_unit(filename, num_partitions, cache=None):
+    """
+    Load filename, returning a (filename, partitions, error) triple,
+    where partitions is a list of num_partitions lists of
+    (key, kind, count value) rows, one for each success and failure
+    record (including nested ones), by the partition of their keys.
+
+    This is a module-level function so that it can be run in a worker
+    process; only the rows, not the records, are sent back.
+    """
+    tu = None
+    key = None
+    if cache:
+        key = cache.get_key(filename)
+        tu = cache.load(filename, key) if key else None
+    if not tu:
+        _, tu, error, _ = load_translation_unit(filename, cache, key)
+        if error:
+            return filename, None, error
+    partitions = [[] for _ in range(num_partitions)]
+    for record in tu.iter_all_records():
+        if record.kind not in DIFF_KINDS:
+            continue
+        key = get_record_key(record)
+        partitions[get_partition(key, num_partitions)].append(
+            (key, record.kind, record.count.value if record.count else 0))
+    return filename, partitions, None
+
+def partition_build(build_dir, work_dir, num_partitions, jobs=1, cache=None):
+    """
+    Spill the rows of partition_translation_unit for every file in
+    build_dir to num_partitions files in work_dir, as a series of
+    pickled lists of rows each.  Return the number of rows.
+    """
+    log('partition_build: %r' % build_dir)
+    os.makedirs(work_dir)
+    files = [open(os.path.join(work_dir, '%i.pickle' % i), 'wb')
+             for i in range(num_partitions)]
+    filenames = find_record_files(build_dir)
+    num_rows = 0
+    executor = None
+    if jobs > 1 and len(filenames) > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        # Submit a few files per worker at a time, so that the rows of
+        # at most that many files are waiting to be written
+        batch_size = max(jobs, 1) * 4
+        for start in range(0, len(filenames), batch_size):
+            args = (filenames[start:start + batch_size],
+                    repeat(num_partitions), repeat(cache))
+            if executor:
+                results = executor.map(partition_translation_unit, *args)
+            else:
+                results = map(partition_translation_unit, *args)
+            for filename, partitions, error in results:
+                if error:
+                    log(' error reading %r: %s' % (filename, error))
+                    continue
+                log(' reading: %r' % filename)
+                for f, rows in zip(files, partitions):
+                    if rows:
+                        pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+                        num_rows += len(rows)
+    finally:
+        if executor:
+            executor.shutdown()
+        for f in files:
+            f.close()
+    return num_rows
+
+def iter_partition(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                rows = pickle.load(f)
+            except EOFError:
+                return
+            yield from rows
+
+class KeyStats:
+    """The records with a given key in the old and new builds"""
+    __slots__ = ('old_successes', 'old_failures',
+                 'new_successes', 'new_failures', 'hotness')
+
+    def __init__(self):
+        self.old_successes = 0
+        self.old_failures = 0
+        self.new_successes = 0
+        self.new_failures = 0
+        # The highest count of any of the records, in either build
+        self.hotness = 0
+
+class Change:
+    """
+    A change in the number of records of a kind with a given key,
+    weighted by their hotness.
+    """
+    __slots__ = ('kind', 'key', 'old', 'new', 'hotness')
+
+    def __init__(self, kind, key, old, new, hotness):
+        self.kind = kind
+        self.key = key
+        self.old = old
+        self.new = new
+        self.hotness = hotness
+
+    @property
+    def delta(self):
+        return abs(self.new - self.old)
+
+    @property
+    def weight(self):
+        return self.hotness * self.delta
+
+    def to_json(self):
+        passname, function, sourcefile, line, message = self.key
+        return {'change': self.kind, 'pass': passname, 'function': function,
+                'file': sourcefile, 'line': line, 'message': message,
+                'old': self.old, 'new': self.new, 'hotness': self.hotness}
+
+def join_partition(old_path, new_path):
+    """
+    Join the rows of a partition of the old and new builds by key,
+    yielding a Change for each difference.
+    """
+    stats_by_key = {}
+    for is_new, path in ((False, old_path), (True, new_path)):
+        for key, kind, count in iter_partition(path):
+            stats = stats_by_key.get(key)
+            if stats is None:
+                stats = stats_by_key[key] = KeyStats()
+            if kind == 'success':
+                if is_new:
+                    stats.new_successes += 1
+                else:
+                    stats.old_successes += 1
+            else:
+                if is_new:
+                    stats.new_failures += 1
+                else:
+                    stats.old_failures += 1
+            if count > stats.hotness:
+                stats.hotness = count
+
+    for key, stats in stats_by_key.items():
+        if stats.new_successes < stats.old_successes:
+            yield Change('lost_successes', key, stats.old_successes,
+                         stats.new_successes, stats.hotness)
+        elif stats.new_successes > stats.old_successes:
+            yield Change('gained_successes', key, stats.old_successes,
+                         stats.new_successes, stats.hotness)
+        if stats.new_failures > stats.old_failures:
+            yield Change('gained_failures', key, stats.old_failures,
+                         stats.new_failures, stats.hotness)
+        elif stats.new_failures < stats.old_failures:
+            yield Change('lost_failures', key, stats.old_failures,
+                         stats.new_failures, stats.hotness)
+
+class DiffReport:
+    """
+    Totals of the Changes of each kind, and the top few of each by
+    weight.
+    """
+    def __init__(self, old_dir, new_dir, top=DEFAULT_TOP):
+        self.old_dir = old_dir
+        self.new_dir = new_dir
+        self.top = top
+        self.num_old_rows = 0
+        self.num_new_rows = 0
+        # Mapping of change kind to number of records, total weight,
+        # and heap of (weight, sequence number, Change) of the heaviest
+        self.num_records = {kind: 0 for kind in CHANGE_KINDS}
+        self.weight = {kind: 0 for kind in CHANGE_KINDS}
+        self.heaps = {kind: [] for kind in CHANGE_KINDS}
+        self.num_changes = 0
+
+    def add(self, change):
+        self.num_records[change.kind] += change.delta
+        self.weight[change.kind] += change.weight
+        # Ties go to the change seen first
+        item = (change.weight, -self.num_changes, change)
+        self.num_changes += 1
+        heap = self.heaps[change.kind]
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+    def get_top(self, kind):
+        """Get the heaviest Changes of the given kind, heaviest first"""
+        return [change for _, _, change
+                in sorted(self.heaps[kind], key=lambda item: item[:2],
+                          reverse=True)]
+
+def diff_builds(old_dir, new_dir, jobs=1, cache=None,
+                num_partitions=DEFAULT_PARTITIONS, top=DEFAULT_TOP,
+                output=None):
+    """
+    Compare the success and failure records of the builds in old_dir
+    and new_dir, matching them by get_record_key, and return a
+    DiffReport.
+
+    Each build's rows are first spilled to disk by the hash of their
+    keys; each pair of partitions is then joined in memory in turn.  If
+    output (a text file object) is given, every Change is written to it
+    as a line of JSON.
+    """
+    report = DiffReport(old_dir, new_dir, top)
+    work_dir = tempfile.mkdtemp(prefix='opt-viewer-diff-')
+    try:
+        report.num_old_rows = partition_build(
+            old_dir, os.path.join(work_dir, 'old'), num_partitions, jobs,
+            cache)
+        report.num_new_rows = partition_build(
+            new_dir, os.path.join(work_dir, 'new'), num_partitions, jobs,
+            cache)
+        log('joining %i partitions' % num_partitions)
+        for i in range(num_partitions):
+            filename = '%i.pickle' % i
+            for change in join_partition(
+                    os.path.join(work_dir, 'old', filename),
+                    os.path.join(work_dir, 'new', filename)):
+                report.add(change)
+                if output:
+                    json.dump(change.to_json(), output)
+                    output.write('\n')
+    finally:
+        shutil.rmtree(work_dir)
+    return report
+
+CHANGE_TITLES = {
+    'lost_successes': 'Lost successes',
+    'gained_failures': 'Gained failures',
+    'gained_successes': 'Gained successes',
+    'lost_failures': 'Lost failures',
+}
+
+def format_report(report):
+    """Get report (a DiffReport) as lines of text"""
+    lines = ['diff: %r -> %r' % (report.old_dir, report.new_dir),
+             ' %i successes and failures before, %i after'
+             % (report.num_old_rows, report.num_new_rows)]
+    for kind in CHANGE_KINDS:
+        lines.append(' %s: %i records (weight %i)'
+                     % (CHANGE_TITLES[kind].lower(), report.num_records[kind],
+                        report.weight[kind]))
+    for kind in CHANGE_KINDS:
+        changes = report.get_top(kind)
+        if not changes:
+            continue
+        lines.append('')
+        lines.append('%s (by hotness):' % CHANGE_TITLES[kind])
+        for change in changes:
+            passname, function, sourcefile, line, message = change.key
+            lines.append('  %12i  %i -> %i  %s:%i: %s [pass=%s]: %s'
+                         % (change.hotness, change.old, change.new,
+                            sourcefile, line, function, passname, message))
+    return lines
@@ -0,0 +1,227 @@
+import fnmatch
+import hashlib
+import json
+import re
+
+# The rules of the default filter of the static report: records in
+# pgen.c, and those of passes that are too noisy to be of interest
+DEFAULT_SPEC = {
+    'exclude': [
+        {'file': '*pgen.c*'},
+        {'pass': ['slp', 'fre', 'pre', 'profile', 'cunroll', 'cunrolli',
+                  'ivcanon']},
+    ],
+}
+
+# The fields of a rule, each of which takes a string or a list of them,
+# except for min_count, which takes a number
+RULE_FIELDS = ('file', 'pass', 'optgroup', 'kind', 'function', 'min_count')
+
+# The fields of a filter spec
+SPEC_FIELDS = ('include', 'exclude', 'max_depth')
+
+def get_strings(json_obj, field):
+    value = json_obj[field]
+    if isinstance(value, str):
+        return [value]
+    if (not isinstance(value, list) or not value
+            or not all(isinstance(item, str) for item in value)):
+        raise ValueError('%s: expected a string or a list of strings, got %r'
+                         % (field, value))
+    return value
+
+class Rule:
+    """
+    A rule of a RecordFilter, matching the records that satisfy each of
+    the fields it gives:
+
+      file: globs, one of which the record's source file must match
+      pass: names, one of which must be the record's pass's
+      optgroup: names, one of which must be among its pass's optgroups
+      kind: kinds ('success', 'failure', 'note' or 'scope')
+      function: regular expressions, one of which must be found in the
+        name of the record's function
+      min_count: the lowest count (0 for records without one)
+
+    Records without a source file, pass or function match no rule that
+    tests it.
+    """
+    __slots__ = ('file_re', 'pass_names', 'optgroups', 'kinds',
+                 'function_re', 'min_count')
+
+    def __init__(self, json_obj):
+        if not isinstance(json_obj, dict) or not json_obj:
+            raise ValueError('expected a rule, got %r' % json_obj)
+        for field in json_obj:
+            if field not in RULE_FIELDS:
+                raise ValueError('unknown field of rule: %r (expected one'
+                                 ' of %s)' % (field, ', '.join(RULE_FIELDS)))
+        self.file_re = self.pass_names = self.optgroups = None
+        self.kinds = self.function_re = self.min_count = None
+        # Each list of globs or regular expressions is combined into one
+        if 'file' in json_obj:
+            self.file_re = re.compile('|'.join(
+                fnmatch.translate(glob)
+                for glob in get_strings(json_obj, 'file')))
+        if 'pass' in json_obj:
+            self.pass_names = frozenset(get_strings(json_obj, 'pass'))
+        if 'optgroup' in json_obj:
+            self.optgroups = frozenset(get_strings(json_obj, 'optgroup'))
+        if 'kind' in json_obj:
+            self.kinds = frozenset(get_strings(json_obj, 'kind'))
+        if 'function' in json_obj:
+            try:
+                self.function_re = re.compile('|'.join(
+                    '(?:%s)' % pattern
+                    for pattern in get_strings(json_obj, 'function')))
+            except re.error as e:
+                raise ValueError('function: %s' % e)
+        if 'min_count' in json_obj:
+            self.min_count = json_obj['min_count']
+            if (not isinstance(self.min_count, int)
+                    or isinstance(self.min_count, bool)):
+                raise ValueError('min_count: expected an integer, got %r'
+                                 % self.min_count)
+
+    def matches(self, kind, pass_, function, sourcefile, count):
+        """
+        Does a record match?  pass_ is its Pass (or None) and count the
+        value of its count.
+        """
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if self.pass_names is not None:
+            if pass_ is None or pass_.name not in self.pass_names:
+                return False
+        if self.optgroups is not None:
+            if pass_ is None or self.optgroups.isdisjoint(pass_.optgroups):
+                return False
+        if self.min_count is not None and count < self.min_count:
+            return False
+        if self.file_re is not None:
+            if sourcefile is None or not self.file_re.match(sourcefile):
+                return False
+        if self.function_re is not None:
+            if function is None or not self.function_re.search(function):
+                return False
+        return True
+
+class RecordFilter:
+    """
+    Which top-level records to load, as given by a spec: a dict (as read
+    from a JSON file) of
+
+      include: a list of rules (see Rule), one of which each record
+        must match; if missing, all records are included
+      exclude: a list of rules, none of which each record may match
+      max_depth: if given, records nested deeper than this below the
+        top-level ones (which are at depth 0) are left out
+
+    The spec is compiled once, into Rules.  A RecordFilter is applied to
+    the JSON objects of the records as they are parsed (see
+    TranslationUnit.from_stream), so that those it rejects are never
+    built into Records.
+
+    Only the spec is pickled, so that a RecordFilter can be sent to
+    worker processes.
+    """
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError('expected an object, got %r' % spec)
+        for field in spec:
+            if field not in SPEC_FIELDS:
+                raise ValueError('unknown field: %r (expected one of %s)'
+                                 % (field, ', '.join(SPEC_FIELDS)))
+        self.spec = spec
+        self.include = self._compile_rules(spec, 'include')
+        self.exclude = self._compile_rules(spec, 'exclude')
+        self.max_depth = spec.get('max_depth')
+        if self.max_depth is not None and (
+                not isinstance(self.max_depth, int)
+                or isinstance(self.max_depth, bool) or self.max_depth < 0):
+            raise ValueError('max_depth: expected a non-negative integer,'
+                             ' got %r' % self.max_depth)
+        # For the keys of cached TranslationUnits, which depend on it
+        self.hash = hashlib.sha256(
+            json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _compile_rules(spec, field):
+        rules = spec.get(field, [])
+        if not isinstance(rules, list):
+            raise ValueError('%s: expected a list of rules, got %r'
+                             % (field, rules))
+        try:
+            return [Rule(rule) for rule in rules]
+        except ValueError as e:
+            raise ValueError('%s: %s' % (field, e))
+
+    @staticmethod
+    def from_file(path):
+        """Get the RecordFilter of the JSON spec in path"""
+        with open(path) as f:
+            return RecordFilter(json.load(f))
+
+    def __reduce__(self):
+        return (RecordFilter, (self.spec,))
+
+    def __repr__(self):
+        return 'RecordFilter(%r)' % self.spec
+
+    def is_empty(self):
+        """Does the filter keep every record?"""
+        return not self.include and not self.exclude and self.max_depth is None
+
+    def keeps(self, kind, pass_, function, sourcefile, count):
+        """Is a top-level record kept?  The arguments are as for Rule.matches."""
+        if self.include and not any(
+                rule.matches(kind, pass_, function, sourcefile, count)
+                for rule in self.include):
+            return False
+        for rule in self.exclude:
+            if rule.matches(kind, pass_, function, sourcefile, count):
+                return False
+        return True
+
+    def keeps_record(self, record):
+        """Is top-level Record record kept?"""
+        return self.keeps(record.kind, record.pass_, record.function,
+                          record.location.file if record.location else None,
+                          record.count.value if record.count else 0)
+
+    def iter_kept(self, json_objs, tu):
+        """
+        Yield the JSON objects of the top-level records in json_objs that
+        are kept, with the children beyond max_depth removed.  tu is the
+        TranslationUnit they are in, for its passes.
+        """
+        pass_by_id = tu.pass_by_id
+        max_depth = self.max_depth
+        for json_obj in json_objs:
+            if 'pass' in json_obj:
+                pass_ = pass_by_id[json_obj['pass']]
+            else:
+                pass_ = None
+            location = json_obj.get('location')
+            count = json_obj.get('count')
+            if not self.keeps(json_obj['kind'], pass_,
+                              json_obj.get('function'),
+                              location['file'] if location else None,
+                              int(count['value']) if count else 0):
+                continue
+            if max_depth is not None:
+                prune_children(json_obj, max_depth)
+            yield json_obj
+
+def prune_children(json_obj, depth):
+    """Remove the records more than depth levels below json_obj"""
+    children = json_obj.get('children')
+    if not children:
+        return
+    if depth == 0:
+        del json_obj['children']
+        return
+    for child in children:
+        prune_children(child, depth - 1)
+
+DEFAULT_FILTER = RecordFilter(DEFAULT_SPEC)
@@ -0,0 +1,292 @@
+from collections import Counter
+import threading
+
+from recordtable import RecordTable
+from searchindex import SearchIndex
+from utils import log
+
+def record_sort_key(record):
+    if not record.count:
+        return 0
+    return -record.count.value
+
+# The orders in which RecordIndex.query can return records.  All but
+# hotness break ties by hotness.
+SORT_ORDERS = ('hotness', 'location', 'pass', 'kind')
+
+class RecordQuery:
+    """
+    The sort order and filters for selecting a page of records.
+    Filters that are None match everything.
+    """
+    def __init__(self, sort='hotness', kind=None, passname=None,
+                 function=None, sourcefile=None, precise_only=False):
+        if sort not in SORT_ORDERS:
+            raise ValueError('unknown sort order: %r' % sort)
+        self.sort = sort
+        self.kind = kind
+        self.passname = passname
+        self.function = function
+        self.sourcefile = sourcefile
+        self.precise_only = precise_only
+
+    def has_filters(self):
+        """Are there any filters besides the pass name?"""
+        return (self.kind is not None
+                or self.function is not None
+                or self.sourcefile is not None
+                or self.precise_only)
+
+class Function:
+    def __init__(self, name, sourcefile, hotness, tu, peak_location):
+        self.name = name
+        self.sourcefile = sourcefile
+        self.hotness = hotness
+        self.tu = tu
+        self.peak_location = peak_location
+
+def merge_function(functions, name, sourcefile, hotness, tu, peak_location):
+    """
+    Update the Function for name in functions (a mapping of name to
+    Function, in the order in which they were first seen) with a record,
+    or another Function, with the given fields.  The TU is that of the
+    first record seen, and the source file that of the first one with a
+    source file; the peak location follows the hottest record.  (The
+    functions of a recorddb.DatabaseIndex are chosen the same way.)
+    """
+    f = functions.get(name)
+    if not f:
+        functions[name] = Function(name, sourcefile, hotness, tu,
+                                   peak_location)
+        return
+    if not f.sourcefile:
+        f.sourcefile = sourcefile
+    if peak_location:
+        if f.hotness < hotness or not f.peak_location:
+            f.peak_location = peak_location
+    if f.hotness < hotness:
+        f.hotness = hotness
+
+class RecordIndex:
+    """
+    Aggregates over a list of TranslationUnit instances, computed once
+    when they are loaded so that the server doesn't need to walk every
+    record on each request.  Sorting and filtering are done on a
+    RecordTable of all of the records.
+    """
+    def __init__(self, tus):
+        self.tus = tus
+        self.table = table = RecordTable(tus)
+
+        # Mapping of name to Function
+        functions = {}
+
+        # List of (tu, num top-level records, num overall records)
+        self.tu_stats = []
+
+        # Mapping of source file to mapping of line number to list of
+        # records (including nested ones) at that line
+        self.records_by_file = {}
+
+        # Mapping of source file to Counter of record kinds
+        self.file_stats = {}
+
+        num_records_by_tu = [0] * len(tus)
+        for row, r in enumerate(table.records):
+            tu_id = table.tu_id[row]
+            num_records_by_tu[tu_id] += 1
+            self._add_to_functions(functions, tus[tu_id], r)
+            self._add_to_files(r)
+        for tu, num_records in zip(tus, num_records_by_tu):
+            self.tu_stats.append((tu, len(tu.records), num_records))
+
+        self._finish(functions)
+
+    @classmethod
+    def merge(cls, indexes):
+        """
+        Build the RecordIndex of the TUs of each of indexes in turn,
+        combining their aggregates rather than walking their records.
+        """
+        self = cls.__new__(cls)
+        self.tus = [tu for index in indexes for tu in index.tus]
+        self.table = RecordTable.concat([index.table for index in indexes])
+        functions = {}
+        self.tu_stats = []
+        self.records_by_file = {}
+        self.file_stats = {}
+        for index in indexes:
+            self.tu_stats.extend(index.tu_stats)
+            for f in index.functions_by_name.values():
+                merge_function(functions, f.name, f.sourcefile, f.hotness,
+                               f.tu, f.peak_location)
+            for sourcefile, by_line in index.records_by_file.items():
+                merged = self.records_by_file.get(sourcefile)
+                if merged is None:
+                    merged = self.records_by_file[sourcefile] = {}
+                    self.file_stats[sourcefile] = Counter()
+                for line, records in by_line.items():
+                    merged.setdefault(line, []).extend(records)
+                self.file_stats[sourcefile].update(index.file_stats[sourcefile])
+        self._finish(functions)
+        return self
+
+    def _finish(self, functions):
+        table = self.table
+
+        # Sort by highest-count down to lowest-count
+        hotness_order = table.argsort_by_count()
+        self.records = table.take(hotness_order)
+
+        self.functions_by_name = functions
+        self.functions = sorted(functions.values(),
+                                key=lambda f: f.hotness,
+                                reverse=True)
+
+        # List of [passname, num top-level records, num overall records]
+        num_toplevel_by_pass = table.count_by_pass(toplevel_only=True)
+        self.passes = sorted([[passname,
+                               num_toplevel_by_pass.get(passname, 0),
+                               num_records]
+                              for passname, num_records
+                              in table.count_by_pass().items()],
+                             key=lambda p: p[0] or '')
+        self.sourcefiles = sorted(self.file_stats.items())
+
+        self.total_size = sum(tu.size for tu in self.tus)
+        self.count_top_level = sum(stats[1] for stats in self.tu_stats)
+        self.count_all = len(table)
+
+        # Mapping of sort name to row indices of all records in that
+        # order, and of (sort name, passname) to row indices of that
+        # pass's records, each built on first use.
+        self._orders = {'hotness': hotness_order}
+        self._orders_by_pass = {}
+
+        # The SearchIndex of self.records, built on first use
+        self._search_index = None
+        self._search_lock = threading.Lock()
+
+        # Mapping of (top, coverage) to the triage.TriageReport of the
+        # records, filled in by the server
+        self.triage_reports = {}
+
+    def get_records_by_line(self, sourcefile):
+        """
+        Get a mapping of line number to list of records for sourcefile.
+        """
+        return self.records_by_file.get(sourcefile, {})
+
+    def get_file_stats(self, sourcefile):
+        """
+        Get a Counter of the kinds of the records in sourcefile
+        (e.g. 'success', 'failure', 'note').
+        """
+        return self.file_stats.get(sourcefile, Counter())
+
+    def get_order(self, sort, passname=None):
+        """
+        Get the row indices of the records (optionally just those from
+        the pass named passname) in the order named by sort.
+        """
+        table = self.table
+        rows = self._orders.get(sort)
+        if rows is None:
+            hotness_order = self._orders['hotness']
+            if sort == 'location':
+                rows = table.argsort_by(hotness_order,
+                                        (table.file, table.files.get_ranks()),
+                                        table.line, table.column)
+            elif sort == 'pass':
+                rows = table.argsort_by(hotness_order,
+                                        (table.pass_id,
+                                         table.pass_names.get_ranks()))
+            elif sort == 'kind':
+                rows = table.argsort_by(hotness_order,
+                                        (table.kind, table.kinds.get_ranks()))
+            else:
+                raise ValueError('unknown sort order: %r' % sort)
+            self._orders[sort] = rows
+        if passname is None:
+            return rows
+
+        key = (sort, passname)
+        pass_rows = self._orders_by_pass.get(key)
+        if pass_rows is None:
+            pass_rows = table.filter_rows(rows,
+                                          table.select(passname=passname))
+            self._orders_by_pass[key] = pass_rows
+        return pass_rows
+
+    def get_search_index(self):
+        """
+        Get the searchindex.SearchIndex of the records, in hotness order,
+        building it if necessary.
+        """
+        with self._search_lock:
+            if self._search_index is None:
+                log('building search index of %i records' % len(self.records))
+                search_index = SearchIndex()
+                for r in self.records:
+                    search_index.add_record(r)
+                self._search_index = search_index
+            return self._search_index
+
+    def search(self, query, offset, limit):
+        """
+        Get a page of the records matching query (a
+        searchindex.SearchQuery), hottest first, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+        """
+        positions = self.get_search_index().search(query)
+        return len(positions), [self.records[pos]
+                                for pos in positions[offset:offset + limit]]
+
+    def iter_toplevel_records(self):
+        """Yield the top-level records of each TU in turn"""
+        for tu in self.tus:
+            yield from tu.records
+
+    def query(self, query, offset, limit):
+        """
+        Get a page of records matching query, as a (total number of
+        matching records, list of at most limit records starting at
+        offset) pair.
+        """
+        table = self.table
+        rows = self.get_order(query.sort, query.passname)
+        if query.has_filters():
+            mask = table.select(kind=query.kind,
+                                function=query.function,
+                                sourcefile=query.sourcefile,
+                                precise_only=query.precise_only)
+            rows = table.filter_rows(rows, mask)
+        return len(rows), table.take(rows[offset:offset + limit])
+
+    @staticmethod
+    def _add_to_functions(functions, tu, r):
+        funcname = r.function
+        if not funcname:
+            return
+        if r.count:
+            hotness = r.count.value
+        else:
+            hotness = 0
+        if r.location:
+            sourcefile = r.location.file
+        else:
+            sourcefile = None
+        merge_function(functions, funcname, sourcefile, hotness, tu.filename,
+                       r.location)
+
+    def _add_to_files(self, r):
+        if not r.location:
+            return
+        sourcefile = r.location.file
+        by_line = self.records_by_file.get(sourcefile)
+        if by_line is None:
+            by_line = self.records_by_file[sourcefile] = {}
+            self.file_stats[sourcefile] = Counter()
+        by_line.setdefault(r.location.line, []).append(r)
+        self.file_stats[sourcefile][r.kind] += 1
@@ -0,0 +1,303 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # The table still works without numpy, using pure Python loops
+    # over the array columns in place of the vectorized operations.
+    numpy = None
+
+class StringTable:
+    """A list of interned strings, each identified by its index"""
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def get_id(self, s):
+        """Get the id for s, adding it if necessary; None has id -1"""
+        if s is None:
+            return -1
+        id_ = self.ids.get(s)
+        if id_ is None:
+            id_ = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return id_
+
+    def find_id(self, s):
+        """Get the id for s, or None if it isn't in the table"""
+        return self.ids.get(s)
+
+    def get_ranks(self):
+        """
+        Get a list giving, for each id, the position of its string in
+        sorted order.
+        """
+        ranks = [0] * len(self.strings)
+        for rank, id_ in enumerate(sorted(range(len(self.strings)),
+                                          key=self.strings.__getitem__)):
+            ranks[id_] = rank
+        return ranks
+
+class RecordTable:
+    """
+    A columnar form of all of the records (including nested ones) of a
+    list of TranslationUnit instances, for sorting, grouping and
+    filtering them without a Python-level loop over Record objects.
+
+    Row i describes self.records[i]; rows are in the order of
+    tu.iter_all_records() for each TU in turn.  Each column is an
+    array.array; string values are held as ids into a StringTable, with
+    -1 for None.  A missing count is held as a value of 0 and a quality
+    of -1.
+    """
+    def __init__(self, tus):
+        self.tus = tus
+        self.records = []
+
+        self.pass_names = StringTable()
+        self.kinds = StringTable()
+        self.qualities = StringTable()
+        self.files = StringTable()
+        self.functions = StringTable()
+
+        self.tu_id = array('i')
+        self.pass_id = array('i')
+        self.kind = array('i')
+        self.count = array('q')
+        self.quality = array('i')
+        self.file = array('i')
+        self.function = array('i')
+        self.line = array('i')
+        self.column = array('i')
+        self.depth = array('i')
+        self.parent = array('i')
+
+        for tu_id, tu in enumerate(tus):
+            for r in tu.records:
+                self._add_record(tu_id, r, -1)
+
+        self._find_precise_qualities()
+
+    # The columns holding ids into the StringTable of the given name
+    STRING_COLUMNS = (('pass_id', 'pass_names'),
+                      ('kind', 'kinds'),
+                      ('quality', 'qualities'),
+                      ('file', 'files'),
+                      ('function', 'functions'))
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Build the table of the rows of each of tables in turn, by
+        concatenating their columns rather than walking their records.
+        """
+        self = cls([])
+        tu_base = 0
+        row_base = 0
+        for table in tables:
+            self.tus.extend(table.tus)
+            self.records.extend(table.records)
+            for col_name, strings_name in self.STRING_COLUMNS:
+                strings = getattr(self, strings_name)
+                remap = [strings.get_id(s)
+                         for s in getattr(table, strings_name).strings]
+                getattr(self, col_name).extend(
+                    self._remap(getattr(table, col_name), remap))
+            for col_name in ('count', 'line', 'column', 'depth'):
+                getattr(self, col_name).extend(getattr(table, col_name))
+            self.tu_id.extend(self._offset(table.tu_id, tu_base))
+            self.parent.extend(self._offset(table.parent, row_base))
+            tu_base += len(table.tus)
+            row_base += len(table)
+        self._find_precise_qualities()
+        return self
+
+    def _remap(self, col, remap):
+        """Get a copy of id column col with each id i >= 0 mapped to remap[i]"""
+        if numpy:
+            # Index -1 picks the extra -1 at the end
+            lookup = numpy.array(remap + [-1], dtype=col.typecode)
+            return array(col.typecode,
+                         lookup[self.column_as_numpy(col)].tobytes())
+        return array(col.typecode, (remap[id_] if id_ >= 0 else -1
+                                    for id_ in col))
+
+    def _offset(self, col, base):
+        """Get a copy of column col with base added to each value >= 0"""
+        if numpy:
+            values = self.column_as_numpy(col)
+            values = numpy.where(values >= 0, values + base, values)
+            return array(col.typecode, values.astype(col.typecode).tobytes())
+        return array(col.typecode, (value + base if value >= 0 else value
+                                    for value in col))
+
+    def _find_precise_qualities(self):
+        # Qualities counted as precise; see Count.is_precise
+        self.precise_quality_ids = [self.qualities.find_id(q)
+                                    for q in ('precise', 'adjusted')
+                                    if self.qualities.find_id(q) is not None]
+
+    def _add_record(self, tu_id, r, parent):
+        # Iterative pre-order walk, matching iter_all_records
+        stack = [(r, parent)]
+        while stack:
+            r, parent = stack.pop()
+            row = len(self.records)
+            self.records.append(r)
+            self.tu_id.append(tu_id)
+            self.pass_id.append(self.pass_names.get_id(
+                r.pass_.name if r.pass_ else None))
+            self.kind.append(self.kinds.get_id(r.kind))
+            if r.count:
+                self.count.append(r.count.value)
+                self.quality.append(self.qualities.get_id(r.count.quality))
+            else:
+                self.count.append(0)
+                self.quality.append(-1)
+            if r.location:
+                self.file.append(self.files.get_id(r.location.file))
+                self.line.append(r.location.line)
+                self.column.append(r.location.column)
+            else:
+                self.file.append(-1)
+                self.line.append(0)
+                self.column.append(0)
+            self.function.append(self.functions.get_id(r.function))
+            self.depth.append(r.depth)
+            self.parent.append(parent)
+            stack.extend((child, row) for child in reversed(r.children))
+
+    def __len__(self):
+        return len(self.records)
+
+    def column_as_numpy(self, col):
+        return numpy.frombuffer(col, dtype=col.typecode)
+
+    def take(self, rows):
+        """Get the Record objects for a sequence of row indices"""
+        records = self.records
+        return [records[row] for row in rows]
+
+    def argsort_by_count(self):
+        """
+        Get the row indices ordered from highest count to lowest (rows
+        without a count sorting as a count of 0), keeping ties in row
+        order.
+        """
+        if numpy:
+            count = self.column_as_numpy(self.count)
+            return numpy.argsort(-count, kind='stable')
+        count = self.count
+        return sorted(range(len(count)), key=lambda row: -count[row])
+
+    def argsort_by(self, rows, *columns):
+        """
+        Get rows reordered by the given columns (the first being the
+        primary key), keeping ties in their existing order.  Each column
+        is an array, or a (array, ranks) pair where ranks maps the
+        array's string ids to sort positions.
+        """
+        if numpy:
+            rows = numpy.asarray(rows)
+            keys = []
+            for col in columns:
+                if isinstance(col, tuple):
+                    col, ranks = col
+                    # Map id -1 (None) to rank -1, sorting first
+                    ranks = numpy.array(list(ranks) + [-1], dtype='i')
+                    keys.append(ranks[self.column_as_numpy(col)[rows]])
+                else:
+                    keys.append(self.column_as_numpy(col)[rows])
+            # lexsort takes the primary key last
+            return rows[numpy.lexsort(keys[::-1])]
+
+        def get_key(col):
+            if isinstance(col, tuple):
+                col, ranks = col
+                return lambda row: ranks[col[row]] if col[row] >= 0 else -1
+            return col.__getitem__
+        key_fns = [get_key(col) for col in columns]
+        return sorted(rows, key=lambda row: tuple(fn(row) for fn in key_fns))
+
+    def count_by_pass(self, toplevel_only=False):
+        """Get a mapping of pass name (or None) to number of records"""
+        if numpy:
+            pass_id = self.column_as_numpy(self.pass_id)
+            if toplevel_only:
+                pass_id = pass_id[self.column_as_numpy(self.depth) == 0]
+            # Shift by one so that -1 (no pass) gets its own bin
+            counts = numpy.bincount(pass_id + 1,
+                                    minlength=len(self.pass_names.strings) + 1)
+            counts = counts.tolist()
+        else:
+            counts = [0] * (len(self.pass_names.strings) + 1)
+            for row, id_ in enumerate(self.pass_id):
+                if not toplevel_only or self.depth[row] == 0:
+                    counts[id_ + 1] += 1
+        result = {}
+        for id_, n in enumerate(counts):
+            if n:
+                result[self.pass_names.strings[id_ - 1] if id_ else None] = n
+        return result
+
+    def select(self, kind=None, passname=None, function=None, sourcefile=None,
+               precise_only=False, toplevel_only=False):
+        """
+        Get a boolean mask (a numpy array, or a list without numpy) of
+        the rows matching all of the given filters; filters that are
+        None match everything.
+        """
+        tests = []
+        for col, table, value in ((self.kind, self.kinds, kind),
+                                  (self.pass_id, self.pass_names, passname),
+                                  (self.function, self.functions, function),
+                                  (self.file, self.files, sourcefile)):
+            if value is not None:
+                # A value not in the table matches nothing
+                id_ = table.find_id(value)
+                tests.append((col, -2 if id_ is None else id_))
+
+        if numpy:
+            mask = numpy.ones(len(self), dtype=bool)
+            for col, id_ in tests:
+                mask &= self.column_as_numpy(col) == id_
+            if precise_only:
+                mask &= numpy.isin(self.column_as_numpy(self.quality),
+                                   self.precise_quality_ids)
+            if toplevel_only:
+                mask &= self.column_as_numpy(self.depth) == 0
+            return mask
+
+        precise = set(self.precise_quality_ids)
+        mask = []
+        for row in range(len(self)):
+            matches = all(col[row] == id_ for col, id_ in tests)
+            if matches and precise_only:
+                matches = self.quality[row] in precise
+            if matches and toplevel_only:
+                matches = self.depth[row] == 0
+            mask.append(matches)
+        return mask
+
+    def filter_rows(self, rows, mask):
+        """Get the subsequence of rows for which mask is true"""
+        if numpy:
+            rows = numpy.asarray(rows)
+            return rows[mask[rows]]
+        return [row for row in rows if mask[row]]
+
+    def max_count(self, mask=None):
+        """Get the highest count among the rows selected by mask (or all)"""
+        if numpy:
+            count = self.column_as_numpy(self.count)
+            if mask is not None:
+                count = count[mask]
+            return int(count.max()) if len(count) else 0
+        if mask is None:
+            return max(self.count, default=0)
+        return max((value for value, selected in zip(self.count, mask)
+                    if selected), default=0)
+
+    def any(self, mask):
+        """Is any row selected by mask?"""
+        return bool(mask.any()) if numpy else any(mask)
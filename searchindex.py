@@ -0,0 +1,289 @@
+from array import array
+from bisect import bisect_left
+import re
+
+try:
+    import numpy
+except ImportError:
+    # Posting lists are then combined with sets and bisection instead
+    numpy = None
+
+from optrecord import Expr, Stmt, SymtabNode
+
+# The fields of a record that can be searched: the text of its own
+# message, the Expr, Stmt and SymtabNode items of the message, its
+# function, pass name, source file and kind
+FIELDS = ('message', 'expr', 'stmt', 'node', 'function', 'pass', 'file',
+          'kind')
+
+# The fields searched by a term without a field name
+TEXT_FIELDS = ('message', 'expr', 'stmt', 'node', 'function')
+
+WORD_RE = re.compile(r'\w+')
+
+# The number of (field, text) pairs whose words SearchIndex.add caches
+KEYS_CACHE_SIZE = 1 << 16
+
+# A term of a query: an optional '-', an optional field name and ':',
+# and either a quoted string or a run of non-space characters
+QUERY_TERM_RE = re.compile(r'\s*(-)?(?:([a-z]+):)?(?:"([^"]*)"?|(\S+))')
+
+def tokenize(text):
+    """Get the lowercase words of text"""
+    return WORD_RE.findall(text.lower())
+
+def get_record_fields(record):
+    """Get the (field, text) pairs of record to be indexed"""
+    fields = [('kind', record.kind)]
+    for item in record.message:
+        if isinstance(item, str):
+            fields.append(('message', item))
+        elif isinstance(item, Expr):
+            fields.append(('expr', item.expr))
+        elif isinstance(item, Stmt):
+            fields.append(('stmt', item.stmt))
+        elif isinstance(item, SymtabNode):
+            fields.append(('node', item.node))
+    if record.function:
+        fields.append(('function', record.function))
+    if record.pass_:
+        fields.append(('pass', record.pass_.name))
+    if record.location:
+        fields.append(('file', record.location.file))
+    return fields
+
+class Term:
+    """
+    A term of a SearchQuery: words each of which must appear in one of
+    fields, the last of them as a prefix if prefix is true.
+    """
+    def __init__(self, fields, words, prefix=False):
+        self.fields = fields
+        self.words = words
+        self.prefix = prefix
+
+    def __repr__(self):
+        return 'Term(%r, %r, %r)' % (self.fields, self.words, self.prefix)
+
+class SearchQuery:
+    """
+    A parsed search string.  Terms are separated by spaces and must all
+    match, unless joined by OR; a term preceded by '-' (or NOT) must not
+    match.  A term is a word, or a "quoted string" of words (all of which
+    must appear, in any order).  It matches any of TEXT_FIELDS unless
+    restricted to one of FIELDS, as in pass:vect or
+    message:"not vectorized".  A word ending in '*' matches any word it
+    starts.  Words are matched without regard to case.
+
+    clauses is a list of lists of Terms: each list must have a matching
+    term.  excluded is a list of Terms which must not match.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.clauses = []
+        self.excluded = []
+
+        join_next = False
+        negate_next = False
+        for match in QUERY_TERM_RE.finditer(text):
+            negated, field, quoted, word = match.groups()
+            if quoted is None and word is None:
+                continue
+            if quoted is None and not negated and not field:
+                if word == 'OR':
+                    join_next = bool(self.clauses)
+                    continue
+                if word == 'AND':
+                    continue
+                if word == 'NOT':
+                    negate_next = True
+                    continue
+            term = self._make_term(field, quoted if quoted is not None
+                                   else word)
+            # Terms without any words (e.g. punctuation) are ignored
+            if term is not None:
+                if negated or negate_next:
+                    self.excluded.append(term)
+                elif join_next:
+                    self.clauses[-1].append(term)
+                else:
+                    self.clauses.append([term])
+            join_next = False
+            negate_next = False
+        if not self.clauses:
+            raise ValueError('nothing to search for in %r' % text)
+
+    @staticmethod
+    def _make_term(field, text):
+        if field is not None and field not in FIELDS:
+            raise ValueError('unknown field: %r (expected one of %s)'
+                             % (field, ', '.join(FIELDS)))
+        prefix = text.endswith('*')
+        words = tokenize(text)
+        if not words:
+            return None
+        return Term((field,) if field else TEXT_FIELDS, words, prefix)
+
+class SearchIndex:
+    """
+    An inverted index over the fields of a sequence of records: for each
+    field and word, the positions of the records containing the word in
+    that field, in increasing order.
+
+    Records are added in the order in which results are to be returned
+    (for the server, from hottest down), so the matches of a query are
+    found in that order by merging posting lists, without sorting.
+    """
+    def __init__(self):
+        # Mapping of 'field:word' to array of positions
+        self.postings = {}
+        self.num_records = 0
+        # The sorted keys of self.postings, for prefix searches, built
+        # on first use
+        self._keys = None
+        # Mapping of (field, text) to its keys in self.postings, as most
+        # texts (pass names, functions, files and message fragments)
+        # recur from record to record
+        self._keys_cache = {}
+
+    def add(self, fields):
+        """
+        Add the next record, given by its (field, text) pairs, returning
+        its position.
+        """
+        pos = self.num_records
+        self.num_records += 1
+        postings = self.postings
+        keys_cache = self._keys_cache
+        for field_text in fields:
+            keys = keys_cache.get(field_text)
+            if keys is None:
+                if len(keys_cache) >= KEYS_CACHE_SIZE:
+                    keys_cache.clear()
+                field, text = field_text
+                keys = keys_cache[field_text] = [field + ':' + word
+                                                 for word in tokenize(text)]
+            for key in keys:
+                positions = postings.get(key)
+                if positions is None:
+                    postings[key] = array('I', (pos,))
+                elif positions[-1] != pos:
+                    positions.append(pos)
+        return pos
+
+    def add_record(self, record):
+        return self.add(get_record_fields(record))
+
+    def search(self, query):
+        """
+        Get the positions of the records matching query (a SearchQuery),
+        in increasing order.
+        """
+        result = None
+        # Intersect the smallest lists first
+        for positions in sorted((self._get_clause(clause)
+                                 for clause in query.clauses), key=len):
+            result = (positions if result is None
+                      else intersect(result, positions, self.num_records))
+            if not len(result):
+                break
+        for term in query.excluded:
+            if not len(result):
+                break
+            result = difference(result, self._get_term(term),
+                                self.num_records)
+        return result
+
+    def _get_clause(self, terms):
+        return union_all([self._get_term(term) for term in terms],
+                         self.num_records)
+
+    def _get_term(self, term):
+        """Get the positions of the records matching term"""
+        result = None
+        for i, word in enumerate(term.words):
+            if term.prefix and i == len(term.words) - 1:
+                lists = [self.postings[key]
+                         for field in term.fields
+                         for key in self._iter_prefixed(field + ':' + word)]
+            else:
+                lists = [self.postings[field + ':' + word]
+                         for field in term.fields
+                         if field + ':' + word in self.postings]
+            positions = union_all(lists, self.num_records)
+            result = (positions if result is None
+                      else intersect(result, positions, self.num_records))
+        return result
+
+    def _iter_prefixed(self, prefix):
+        if self._keys is None:
+            self._keys = sorted(self.postings)
+        keys = self._keys
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield keys[i]
+            i += 1
+
+############################################################################
+# Operations on sorted sequences of positions without duplicates, below
+# num_records.  With numpy, large ones are combined through a boolean
+# mask over all of the positions, which takes linear time rather than
+# the sorting of numpy's set operations.
+
+def as_numpy(positions):
+    if isinstance(positions, array):
+        return numpy.frombuffer(positions, dtype=numpy.uint32)
+    return positions
+
+def is_small(num_positions, num_records):
+    return num_positions * 32 < num_records
+
+def make_mask(lists, num_records):
+    mask = numpy.zeros(num_records, dtype=bool)
+    for positions in lists:
+        mask[as_numpy(positions)] = True
+    return mask
+
+def union_all(lists, num_records):
+    if not lists:
+        return array('I')
+    if len(lists) == 1:
+        return lists[0]
+    if numpy:
+        if is_small(sum(len(positions) for positions in lists), num_records):
+            return numpy.unique(numpy.concatenate([as_numpy(positions)
+                                                   for positions in lists]))
+        return numpy.flatnonzero(make_mask(lists, num_records)).astype(
+            numpy.uint32)
+    merged = set()
+    for positions in lists:
+        merged.update(positions)
+    return sorted(merged)
+
+def intersect(a, b, num_records):
+    if len(a) > len(b):
+        a, b = b, a
+    if numpy:
+        a = as_numpy(a)
+        if is_small(len(a) + len(b), num_records):
+            return numpy.intersect1d(a, as_numpy(b), assume_unique=True)
+        return a[make_mask([b], num_records)[a]]
+    # Look each of the smaller list's positions up in the larger one
+    result = []
+    lo = 0
+    for pos in a:
+        lo = bisect_left(b, pos, lo)
+        if lo == len(b):
+            break
+        if b[lo] == pos:
+            result.append(pos)
+    return result
+
+def difference(a, b, num_records):
+    if numpy:
+        a = as_numpy(a)
+        if is_small(len(a) + len(b), num_records):
+            return numpy.setdiff1d(a, as_numpy(b), assume_unique=True)
+        return a[~make_mask([b], num_records)[a]]
+    b = set(b)
+    return [pos for pos in a if pos not in b]
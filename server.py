@@ -1,26 +1,56 @@
 import html
+import math
 import os
 import urllib
 
-from flask import Flask, render_template, Markup
-import pygments.lexers
-import pygments.styles
+from flask import Flask, render_template, Markup, abort, jsonify, request, url_for
 import pygments.formatters
 
+from countstats import CountStats
+from highlight import HighlightCache
 from optrecord import TranslationUnit, Record, Expr, Stmt, SymtabNode
-from utils import get_effective_result
+from recorddb import DatabaseIndex
+from recordindex import RecordIndex, RecordQuery
+from searchindex import FIELDS, SearchQuery
+from triage import DEFAULT_COVERAGE, DEFAULT_TOP, Triage
+from utils import get_effective_result, render_message_html
 
 app = Flask(__name__)
 
-def record_sort_key(record):
-    if not record.count:
-        return 0
-    return -record.count.value
-
-def iter_all_records(app):
-    for tu in app.tus:
-        for r in tu.iter_all_records():
-            yield r
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 5000
+
+# The largest number of entries of each ranking of /triage
+MAX_TRIAGE_TOP = 1000
+
+# The number of TriageReports kept on each index
+TRIAGE_CACHE_SIZE = 8
+
+formatter = pygments.formatters.HtmlFormatter()
+highlight_cache = HighlightCache(formatter, make_line=Markup)
+
+def set_tus(tus):
+    """
+    Set the TranslationUnit instances to be served, building the
+    aggregates that the routes use.  As in the static report, if any
+    top-level records have precise counts, those with other counts are
+    left out (see countstats.CountStats).
+    """
+    app.index = RecordIndex(CountStats(tus).apply(tus))
+
+def set_index(index):
+    """
+    Serve the records of index: a RecordIndex, or anything with the same
+    interface (e.g. a recorddb.DatabaseIndex or lazyindex.LazyIndex).
+    """
+    app.index = index
+
+def set_database(db):
+    """
+    Serve the records in db (a RecordDatabase), querying it for each
+    request rather than holding the records in memory.
+    """
+    app.index = DatabaseIndex(db)
 
 def get_summary_text(record):
     '''
@@ -31,29 +61,7 @@ def get_summary_text(record):
     return get_html_for_message(record)
 
 def get_html_for_message(record):
-    html_for_message = ''
-    for item in record.message:
-        if isinstance(item, str):
-            html_for_message += html.escape(str(item))
-        else:
-            if isinstance(item, Expr):
-                html_for_item = '<code>%s</code>' % html.escape(item.expr)
-            elif isinstance(item, Stmt):
-                html_for_item = '<code>%s</code>' % html.escape(item.stmt)
-            elif isinstance(item, SymtabNode):
-                html_for_item = '<code>%s</code>' % html.escape(item.node)
-            else:
-                raise TypeError('unknown message item: %r' % item)
-            if item.location:
-                html_for_item = ('<a href="%s">%s</a>'
-                                 % (url_from_location (item.location), html_for_item))
-            html_for_message += html_for_item
-
-    if record.children:
-        for child in record.children:
-            for line in get_html_for_message(child).splitlines():
-                html_for_message += '\n  ' + line
-    return html_for_message
+    return render_message_html(record, url_from_location)
 
 def get_color_for_record(record):
     result = get_effective_result(record)
@@ -113,152 +121,245 @@ def utility_processor():
                 get_color_for_record=get_color_for_record,
                 get_markup_for_record=get_markup_for_record)
 
-class Function:
-    def __init__(self, name, sourcefile, hotness, tu, peak_location):
-        self.name = name
-        self.sourcefile = sourcefile
-        self.hotness = hotness
-        self.tu = tu
-        self.peak_location = peak_location
-
 @app.route("/")
 def index():
-    # Gather all records
-    records = list(iter_all_records(app))
-
-    # Sort by highest-count down to lowest-count
-    records = sorted(records, key=record_sort_key)
-
-    # Mapping of name to Function
-    functions = {}
-    for tu in app.tus:
-        for r in tu.iter_all_records():
-            if r.count:
-                hotness = r.count.value
-            else:
-                hotness = 0
-            funcname = r.function
-            if not funcname:
-                continue
-            if r.location:
-                sourcefile = r.location.file
-            else:
-                sourcefile = None
-            if funcname not in functions:
-                functions[funcname] = Function(funcname, sourcefile,
-                                               hotness, tu.filename, r.location)
-            else:
-                f = functions[funcname]
-                if not f.sourcefile:
-                    f.sourcefile = sourcefile
-                if f.hotness < hotness:
-                    f.hotness = hotness
-                if r.location:
-                    if f.hotness < hotness or not f.peak_location:
-                        f.peak_location = r.location
-
-    # Mapping of passname to [passname ,num top-level records, num overall records]
-    passes = {}
-    for tu in app.tus:
-        for r in tu.iter_all_records():
-            if r.pass_:
-                passname = r.pass_.name
-            else:
-                passname = None
-            if passname not in passes:
-                passes[passname] = [passname, 0, 0]
-            if r.is_toplevel():
-                passes[passname][1] += 1
-            passes[passname][2] += 1
-
+    index = app.index
     return render_template('index.html',
-                           records=records,
-                           functions=sorted(list(functions.values()),
-                                            key=lambda f: f.hotness,
-                                            reverse=True),
-                           tus = app.tus,
-                           total_size = sum([tu.size for tu in app.tus]),
-                           count_top_level = sum([len(tu.records) for tu in app.tus]),
-                           count_all  = sum([tu.count_all_records() for tu in app.tus]),
-                           passes=sorted(passes.values()))
+                           functions=index.functions,
+                           tu_stats=index.tu_stats,
+                           total_size=index.total_size,
+                           count_top_level=index.count_top_level,
+                           count_all=index.count_all,
+                           passes=index.passes,
+                           sourcefiles=index.sourcefiles)
 
 @app.route("/all-tus")
 def all_tus():
-    return "tus: %r" % app.tus
+    return "tus: %r" % app.index.tus
+
+class Page:
+    """A page of records selected by the arguments of the current request"""
+    def __init__(self, records, total, offset, limit):
+        self.records = records
+        self.total = total
+        self.offset = offset
+        self.limit = limit
+
+    def url_for_offset(self, offset):
+        args = request.args.to_dict()
+        args.update(request.view_args)
+        args['offset'] = offset
+        return url_for(request.endpoint, **args)
+
+    @property
+    def prev_url(self):
+        if self.offset <= 0:
+            return None
+        return self.url_for_offset(max(self.offset - self.limit, 0))
+
+    @property
+    def next_url(self):
+        if self.offset + self.limit >= self.total:
+            return None
+        return self.url_for_offset(self.offset + self.limit)
+
+def get_page(passname=None):
+    """
+    Get the Page of records selected by the request's arguments:
+      offset, limit: the slice of matching records to return
+      sort: one of recordindex.SORT_ORDERS (default: hotness)
+      kind, pass, function, file: only return records with these
+        values; pass is ignored if passname (from the route) is given
+      precise: if non-empty, only return records with precise counts
+    """
+    args = request.args
+    try:
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        query = RecordQuery(sort=args.get('sort', 'hotness'),
+                            kind=args.get('kind') or None,
+                            passname=passname or args.get('pass') or None,
+                            function=args.get('function') or None,
+                            sourcefile=args.get('file') or None,
+                            precise_only=bool(args.get('precise')))
+    except ValueError as e:
+        abort(400, str(e))
+    total, records = app.index.query(query, offset, limit)
+    return Page(records, total, offset, limit)
+
+def get_search_page():
+    """
+    Get the Page of records matching the request's search, hottest first:
+      q: the search (see searchindex.SearchQuery)
+      offset, limit: the slice of matching records to return
+    Return None if there is no search.
+    """
+    args = request.args
+    text = args.get('q', '').strip()
+    if not text:
+        return None
+    try:
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        query = SearchQuery(text)
+    except ValueError as e:
+        abort(400, str(e))
+    total, records = app.index.search(query, offset, limit)
+    return Page(records, total, offset, limit)
+
+def location_to_json(loc):
+    if not loc:
+        return None
+    return {'file': loc.file, 'line': loc.line, 'column': loc.column,
+            'url': url_from_location(loc)}
+
+def record_to_json(record):
+    if record.count:
+        count = {'quality': record.count.quality,
+                 'value': record.count.value}
+    else:
+        count = None
+    if record.inlining_chain:
+        inlining_chain = [{'fndecl': inline.fndecl,
+                           'site': location_to_json(inline.site)}
+                          for inline in record.inlining_chain]
+    else:
+        inlining_chain = None
+    return {'kind': record.kind,
+            'result': get_effective_result(record),
+            'pass': record.pass_.name if record.pass_ else None,
+            'function': record.function,
+            'location': location_to_json(record.location),
+            'count': count,
+            'message': get_html_for_message(record),
+            'inlining_chain': inlining_chain}
+
+def page_to_json(page):
+    return jsonify(total=page.total,
+                   offset=page.offset,
+                   limit=page.limit,
+                   next=page.next_url,
+                   records=[record_to_json(r) for r in page.records])
 
 @app.route("/pass/<passname>")
 def pass_(passname):
-    # Gather records from the given pass
-    records = [r for r in iter_all_records(app)
-               if r.pass_.name == passname]
-
-    # Sort by highest-count down to lowest-count
-    records = sorted(records, key=record_sort_key)
-
     return render_template('pass.html',
-                           records=records,
+                           page=get_page(passname),
                            passname=passname)
 
-@app.route("/sourcefile/<sourcefile>")
+@app.route("/api/pass/<passname>")
+def api_pass(passname):
+    return page_to_json(get_page(passname))
+
+@app.route("/sourcefile/<path:sourcefile>")
 def sourcefile(sourcefile):
     # FIXME: this allows arbitrary reading of files on this machine:
-    with open(os.path.join(app.build_dir, sourcefile)) as f:
-        code = f.read()
-
-    style = pygments.styles.get_style_by_name('default')
-    formatter = pygments.formatters.HtmlFormatter()
-    lexer = pygments.lexers.guess_lexer_for_filename(sourcefile, code)
-
-    # Use pygments to convert it all to HTML:
-    code_as_html = pygments.highlight(code, lexer, formatter)
-
-    if 0:
-        print(code_as_html)
-        print('*' * 76)
-        print(repr(code_as_html))
-        print('*' * 76)
-
-    EXPECTED_START = '<div class="highlight"><pre>'
-    assert code_as_html.startswith(EXPECTED_START)
-    code_as_html = code_as_html[len(EXPECTED_START):-1]
-
-    EXPECTED_END = '</pre></div>'
-    assert code_as_html.endswith(EXPECTED_END)
-    code_as_html = code_as_html[0:-len(EXPECTED_END)]
-
-    html_lines = [Markup(line) for line in code_as_html.splitlines()]
-
-    # Gather top-level records affecting this source file:
-    records = []
-    for tu in app.tus:
-        for r in tu.records:
-            if not r.location:
-                continue
-            if r.location.file != sourcefile:
-                continue
-            records.append(r)
-
-    # Group by line num
-    by_line_num = {}
-    for record in records:
-        line_num = record.location.line
-        if line_num not in by_line_num:
-            by_line_num[line_num] = []
-        by_line_num[line_num].append(record)
+    html_lines = highlight_cache.get_lines(os.path.join(app.build_dir, sourcefile),
+                                           sourcefile)
 
+    # Use the same index throughout, in case --watch replaces it
+    index = app.index
     return render_template('sourcefile.html',
                            sourcefile=sourcefile,
                            lines=html_lines,
-                           records_by_line_num=by_line_num,
+                           records_by_line_num=index.get_records_by_line(sourcefile),
+                           stats=index.get_file_stats(sourcefile),
                            css = formatter.get_style_defs())
 
+@app.route("/cache-stats")
+def cache_stats():
+    stats = {'highlight': highlight_cache.get_stats()}
+    if hasattr(app.index, 'get_stats'):
+        stats['records'] = app.index.get_stats()
+    return jsonify(**stats)
+
+@app.route("/search")
+def search():
+    return render_template('search.html',
+                           page=get_search_page(),
+                           fields=FIELDS)
+
+@app.route("/api/search")
+def api_search():
+    page = get_search_page()
+    if page is None:
+        abort(400, 'no search given')
+    return page_to_json(page)
+
 @app.route("/records")
 def records():
-    # Gather all records
-    records = list(iter_all_records(app))
-
-    # Sort by highest-count down to lowest-count
-    records = sorted(records, key=record_sort_key)
-
     return render_template('records.html',
-                           records=records)
+                           page=get_page())
+
+@app.route("/api/records")
+def api_records():
+    return page_to_json(get_page())
+
+def get_triage(index, top, coverage):
+    """
+    Get the TriageReport of the records of index, computing it once.
+    The reports are kept in index.triage_reports (at most
+    TRIAGE_CACHE_SIZE of them), so that they are freed along with index
+    when it is replaced.
+    """
+    reports = index.triage_reports
+    report = reports.get((top, coverage))
+    if report is None:
+        triage = Triage(top)
+        triage.add_records(index.iter_toplevel_records())
+        report = triage.get_report(coverage)
+        if len(reports) >= TRIAGE_CACHE_SIZE:
+            reports.clear()
+        reports[(top, coverage)] = report
+    return report
+
+def get_triage_report():
+    """
+    Get the TriageReport selected by the request's arguments:
+      top: the number of entries of each ranking
+      coverage: the share (from 0 to 1) of the total weight of the
+        failures at which to cut each ranking off
+    """
+    args = request.args
+    try:
+        top = int(args.get('top', DEFAULT_TOP))
+        coverage = float(args.get('coverage', DEFAULT_COVERAGE))
+    except ValueError as e:
+        abort(400, str(e))
+    if not math.isfinite(coverage):
+        abort(400, 'coverage must be a finite number')
+    top = min(max(top, 1), MAX_TRIAGE_TOP)
+    coverage = min(max(coverage, 0.), 1.)
+    return get_triage(app.index, top, coverage)
+
+def group_to_json(group):
+    return {'function': group.function,
+            'location': location_to_json(group.location),
+            'weight': group.weight,
+            'failures': group.num_failures,
+            'share': group.share,
+            'cumulative_share': group.cumulative_share,
+            'hottest': record_to_json(group.hottest)}
+
+@app.route("/triage")
+def triage():
+    return render_template('triage.html',
+                           report=get_triage_report())
+
+@app.route("/api/triage")
+def api_triage():
+    report = get_triage_report()
+    return jsonify(total_weight=report.total_weight,
+                   failures=report.num_failures,
+                   hot_failures=report.num_hot_failures,
+                   top=report.top,
+                   coverage=report.coverage,
+                   hottest=[dict(record_to_json(f.record),
+                                 weight=f.weight,
+                                 share=f.share,
+                                 cumulative_share=f.cumulative_share)
+                            for f in report.failures],
+                   loops=[group_to_json(g) for g in report.loops],
+                   functions=[group_to_json(g) for g in report.functions])
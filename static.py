@@ -1,37 +1,78 @@
 import argparse
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import heapq
 import html
+from itertools import islice, repeat
+import json
 import os
 from pprint import pprint
-from pathlib import Path
+import re
+import shutil
 import sys
 import time
 
-import pygments.lexers
-import pygments.styles
 import pygments.formatters
 
+from countstats import CountStats, has_imprecise_count
+from compress import (compress_output, get_page_paths, remove_page,
+                      remove_stale_compressed)
+from highlight import get_lexer, highlight_lines
+from manifest import Manifest
 from optrecord import TranslationUnit, Record, Expr, Stmt, SymtabNode
-from utils import find_records, log, get_effective_result
+from profiling import add_page, phase, profiled
+from recordfilter import DEFAULT_FILTER
+from recordtable import RecordTable
+from triage import DEFAULT_COVERAGE, DEFAULT_TOP, triage_records, triage_tus
+from utils import find_records, log, get_effective_result, render_message_html
+
+# The number of records listed on each page of the index
+INDEX_PAGE_SIZE = 5000
+
+# The size of the buffer through which pages are written
+WRITE_BUFFER_SIZE = 1 << 20
+
+# The directory holding the scripts and styles of source pages written
+# by write_virtual_source_file_html, which are copied to each report
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+SOURCEVIEW_ASSETS = ('sourceview.js', 'sourceview.css')
+
+TAG_RE = re.compile('<[^>]*>')
+
+# The button which expands the messages of a record with many lines of
+# them, within its <pre>; spelled out line by line, as the whitespace
+# is part of the page
+TOGGLE_BUTTON_HTML = (
+    '<button class="btn btn-primary" type="button" data-toggle="collapse"'
+    ' data-target="#collapse-%i" aria-expanded="false"'
+    ' aria-controls="collapse-%i">\n'
+    '    Toggle messages <span class="badge badge-light">%i</span>\n'
+    '  </button>\n'
+    '                        ')
 
 class Location:
     def __init__(self, file, line):
         self.file = file
         self.line = line
 
-def srcfile_to_html(file_name):
-    return html.escape("%s.html" % file_name.replace('/', '|'))
+def srcfile_to_html(src_file):
+    """
+    Generate a .html filename for src_file.
 
-def url_from_location(loc):
-    return '%s#line-%i' % (srcfile_to_html(loc.file), loc.line)
+    The name depends only on src_file, and includes a digest of its full
+    path so that source files with the same basename in different
+    directories get different pages.
+    """
+    digest = hashlib.sha1(src_file.encode('utf-8')).hexdigest()[:16]
+    return '%s.%s.html' % (os.path.basename(src_file), digest)
 
-def srcfile_to_html(src_file):
+def srcfile_to_data(src_file):
     """
-    Generate a .html filename for src_file
+    Generate the filename of the .js file of the source and records of
+    src_file, for its page as written by write_virtual_source_file_html.
     """
-    file_name = os.path.basename(src_file)
-    html_file_name = html.escape(file_name)
-    return html_file_name
+    return srcfile_to_html(src_file)[:-len('.html')] + '.js'
 
 def function_to_html(function):
     """
@@ -60,7 +101,7 @@ def write_td_with_color(f, record, html_text):
         bgcolor = ''
     f.write('    <td bgcolor="%s">%s</td>\n' % (bgcolor, html_text))
 
-def write_td_pass(f, record):
+def get_pass_html(record):
     html_text = ''
     impl_url = None
     impl_file = record.impl_location.file
@@ -80,47 +121,53 @@ def write_td_pass(f, record):
 
     if impl_url:
         html_text += '</a>'
+    return html_text
 
-    write_td_with_color(f, record, html_text)
+def write_td_pass(f, record):
+    write_td_with_color(f, record, get_pass_html(record))
+
+def get_hotness_text(record, highest_count):
+    """
+    Get the count of record as a percentage of highest_count, or '' if
+    it has no count.
+    """
+    if not record.count:
+        return ''
+    if highest_count == 0:
+        highest_count = 1
+    hotness = 100. * record.count.value / highest_count
+    return '%.2f' % hotness
 
 def write_td_count(f, record, highest_count):
     f.write('    <td style="text-align:right">\n')
-    if record.count:
-        if 1:
-            if highest_count == 0:
-                highest_count = 1
-            hotness = 100. * record.count.value / highest_count
-            f.write(html.escape('%.2f' % hotness))
-        else:
-            f.write(html.escape(str(int(record.count.value))))
-        if 0:
-            f.write(html.escape(' (%s)' % record.count.quality))
+    f.write(html.escape(get_hotness_text(record, highest_count)))
     f.write('    </td>\n')
 
-def write_inlining_chain(f, record):
-    f.write('    <td><ul class="list-group">\n')
-    first = True
+def get_inlining_chain_html(record):
+    """Get the HTML of each entry of the inlining chain of record"""
+    items = []
     if record.inlining_chain:
         for inline in record.inlining_chain:
-            f.write('  <li class="list-group-item">')
-            if not first:
-                f.write ('inlined from ')
-            f.write('<code>%s</code>' % html.escape(inline.fndecl))
+            item = ''
+            if items:
+                item += 'inlined from '
+            item += '<code>%s</code>' % html.escape(inline.fndecl)
             site = inline.site
             if site:
-                f.write(' at <a href="%s">%s</a>'
-                        % (url_from_location(site),
-                           html.escape(str(site))))
-            f.write('</li>\n')
-            first = False
-    f.write('    </ul></td>\n')
+                item += (' at <a href="%s">%s</a>'
+                         % (url_from_location(site),
+                            html.escape(str(site))))
+            items.append(item)
+    return items
 
-def remove_file_extension(filename):
-    base_name = os.path.splitext(filename)[0]
-    return base_name
+def write_inlining_chain(f, record):
+    f.write('    <td><ul class="list-group">\n')
+    for item in get_inlining_chain_html(record):
+        f.write('  <li class="list-group-item">%s</li>\n' % item)
+    f.write('    </ul></td>\n')
 
 def url_from_location(loc):
-    return '%s.html#line-%i' % (srcfile_to_html(remove_file_extension(loc.file)), loc.line)
+    return '%s#line-%i' % (html.escape(srcfile_to_html(loc.file)), loc.line)
 
 def write_html_header(f, title, head_content):
     """
@@ -156,20 +203,110 @@ def write_html_footer(f):
     
     f.close()
 
-def make_index_html(out_dir, tus, highest_count):
+def check_page(manifest, page, inputs):
+    """
+    Record in manifest (if any) that page is generated from inputs.
+    Return True if the page from a previous run can be kept as it is.
+    """
+    if not manifest:
+        return False
+    manifest.add_page(page, inputs)
+    if manifest.is_up_to_date(page, inputs):
+        log('  %s is up to date' % page)
+        return True
+    return False
+
+@profiled('index')
+def make_index_html(out_dir, tus, highest_count, manifest=None):
     log(' make_index_html')
 
-    # Gather all records
-    records = []
-    for tu in tus:
-        records += tu.iter_all_records()
+    num_records = sum(tu.count_all_records() for tu in tus)
+    if manifest:
+        inputs = manifest.get_inputs([tu.filename for tu in tus],
+                                     highest_count=highest_count,
+                                     page_size=INDEX_PAGE_SIZE)
+        pages = [index_page_filename(page_num)
+                 for page_num in range(count_index_pages(num_records))]
+        # All of the pages depend on all of the records
+        for page in pages:
+            manifest.add_page(page, inputs)
+        if all(manifest.is_up_to_date(page, inputs) for page in pages):
+            if len(pages) == 1:
+                log('  %s is up to date' % pages[0])
+            else:
+                log('  %s are up to date' % ', '.join(pages))
+            return
+
+    write_index_pages(out_dir, iter_records_by_count(tus), num_records,
+                      highest_count)
 
-    # Sort by highest-count down to lowest-count
-    records = sorted(records, key=record_sort_key)
+def iter_records_by_count(tus):
+    """
+    Yield all of the records of tus (including nested ones), from
+    highest count down to lowest, with ties in the order of
+    tu.iter_all_records() for each TU in turn.
+
+    Each TU's records are sorted separately, and the sorted streams are
+    merged, so no list of every record is built.
+    """
+    def iter_sorted(tu):
+        return iter(sorted(tu.iter_all_records(), key=record_sort_key))
+    # heapq.merge keeps ties in the order of its inputs
+    return heapq.merge(*[iter_sorted(tu) for tu in tus], key=record_sort_key)
+
+def count_index_pages(num_records):
+    return max((num_records + INDEX_PAGE_SIZE - 1) // INDEX_PAGE_SIZE, 1)
+
+def index_page_filename(page_num):
+    """Get the filename of the page_num'th (from 0) page of the index"""
+    if page_num == 0:
+        return 'index.html'
+    return 'index-%i.html' % (page_num + 1)
+
+def write_index_nav(f, page_num, num_pages):
+    if num_pages == 1:
+        return
+    f.write('<nav><ul class="pagination">\n')
+    if page_num > 0:
+        f.write('  <li class="page-item"><a class="page-link" href="%s">Previous</a></li>\n'
+                % index_page_filename(page_num - 1))
+    else:
+        f.write('  <li class="page-item disabled"><span class="page-link">Previous</span></li>\n')
+    f.write('  <li class="page-item active"><span class="page-link">Page %i of %i</span></li>\n'
+            % (page_num + 1, num_pages))
+    if page_num + 1 < num_pages:
+        f.write('  <li class="page-item"><a class="page-link" href="%s">Next</a></li>\n'
+                % index_page_filename(page_num + 1))
+    else:
+        f.write('  <li class="page-item disabled"><span class="page-link">Next</span></li>\n')
+    f.write('</ul></nav>\n')
 
-    filename = os.path.join(out_dir, "index.html")
-    with open(filename, "w") as f:
+def write_index_pages(out_dir, records, num_records, highest_count):
+    """
+    Write the index, listing the num_records records from the iterable
+    records in the order given, INDEX_PAGE_SIZE to a page.
+    """
+    records = iter(records)
+    num_pages = count_index_pages(num_records)
+    for page_num in range(num_pages):
+        write_index_page(out_dir, islice(records, INDEX_PAGE_SIZE),
+                         highest_count, page_num, num_pages)
+
+    # Remove any further pages from a previous run
+    page_num = num_pages
+    while True:
+        path = os.path.join(out_dir, index_page_filename(page_num))
+        if not any(os.path.exists(p) for p in get_page_paths(path)):
+            break
+        remove_page(path)
+        page_num += 1
+
+def write_index_page(out_dir, records, highest_count, page_num, num_pages):
+    filename = os.path.join(out_dir, index_page_filename(page_num))
+    with open(filename, "w", buffering=WRITE_BUFFER_SIZE) as f:
         write_html_header(f, 'Optimizations', '')
+        f.write('<p><a href="triage.html">Triage the hottest failures</a></p>\n')
+        write_index_nav(f, page_num, num_pages)
         f.write('<table class="table table-striped table-bordered table-sm">\n')
         f.write('  <tr>\n')
         f.write('    <th>Summary</th>\n')
@@ -204,226 +341,311 @@ def make_index_html(out_dir, tus, highest_count):
 
             f.write('  </tr>\n')
         f.write('</table>\n')
+        write_index_nav(f, page_num, num_pages)
         write_html_footer(f)
 
 def get_html_for_message(record):
-    html_for_message = ''
-    for item in record.message:
-        if isinstance(item, str):
-            html_for_message += html.escape(str(item))
-        else:
-            if isinstance(item, Expr):
-                html_for_item = '<code>%s</code>' % html.escape(item.expr)
-            elif isinstance(item, Stmt):
-                html_for_item = '<code>%s</code>' % html.escape(item.stmt)
-            elif isinstance(item, SymtabNode):
-                html_for_item = '<code>%s</code>' % html.escape(item.node)
-            else:
-                raise TypeError('unknown message item: %r' % item)
-            if item.location:
-                html_for_item = ('<a href="%s">%s</a>'
-                                 % (url_from_location (item.location), html_for_item))
-            html_for_message += html_for_item
-
-    if record.children:
-        for child in record.children:
-            for line in get_html_for_message(child).splitlines():
-                html_for_message += '\n  ' + line
-    return html_for_message
-
-def make_per_source_file_html(build_dir, out_dir, tus, highest_count):
+    return render_message_html(record, url_from_location)
+
+def get_source_file_pages(src_file, virtual=False):
+    """Get the filenames of the files written for src_file's page"""
+    if virtual:
+        return [srcfile_to_html(src_file), srcfile_to_data(src_file)]
+    return [srcfile_to_html(src_file)]
+
+@profiled('source_pages')
+def make_per_source_file_html(build_dir, out_dir, tus, highest_count, jobs=1,
+                              manifest=None, virtual=False):
+    """
+    Write a page for each source file with records, as written by
+    write_virtual_source_file_html if virtual, and otherwise by
+    write_source_file_html.
+    """
     log(' make_per_source_file_html')
 
-    # Gather all records
-    records = []
+    # Dict of list of record, grouping by source file, and dict of set
+    # of filenames of the TUs those records came from
+    by_src_file = {}
+    record_files_by_src_file = {}
     for tu in tus:
-        records += tu.iter_all_records()
+        for record in tu.iter_all_records():
+            if not record.location:
+                continue
+            src_file = record.location.file
+            if src_file not in by_src_file:
+                by_src_file[src_file] = []
+                record_files_by_src_file[src_file] = set()
+            by_src_file[src_file].append(record)
+            record_files_by_src_file[src_file].add(tu.filename)
+
+    write_style_css(out_dir)
+    if virtual:
+        write_sourceview_assets(out_dir)
+
+    # Each page is written to its own srcfile_to_html name, so the pages
+    # can be generated in any order, by any number of processes.
+    src_files = []
+    inputs_by_src_file = {}
+    for src_file in sorted(by_src_file):
+        if manifest:
+            inputs = manifest.get_inputs(record_files_by_src_file[src_file],
+                                         [os.path.join(build_dir, src_file)],
+                                         highest_count=highest_count,
+                                         virtual=virtual)
+            pages = get_source_file_pages(src_file, virtual)
+            if all(manifest.is_up_to_date(page, inputs) for page in pages):
+                for page in pages:
+                    manifest.add_page(page, inputs)
+                continue
+            inputs_by_src_file[src_file] = inputs
+        src_files.append(src_file)
+    if manifest:
+        log('  %i of %i pages are up to date'
+            % (len(by_src_file) - len(src_files), len(by_src_file)))
+
+    if virtual:
+        write_page = write_virtual_source_file_html
+    else:
+        write_page = write_source_file_html
+    args = (repeat(build_dir), repeat(out_dir), src_files,
+            [by_src_file[src_file] for src_file in src_files],
+            repeat(highest_count))
+    if jobs > 1 and len(src_files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(write_page, *args))
+    else:
+        results = list(map(write_page, *args))
 
-    # Dict of list of record, grouping by source file
-    by_src_file = {}
-    for record in records:
-        if not record.location:
-            continue
-        src_file = record.location.file
-        if src_file not in by_src_file:
-            by_src_file[src_file] = []
-        by_src_file[src_file].append(record)
+    for src_file, error, stats in results:
+        add_page(stats)
+        if error:
+            log('  skipped %r: %s' % (src_file, error))
+        elif manifest:
+            for page in get_source_file_pages(src_file, virtual):
+                manifest.add_page(page, inputs_by_src_file[src_file])
 
-    style = pygments.styles.get_style_by_name('default')
+def write_style_css(out_dir):
     formatter = pygments.formatters.HtmlFormatter()
-
-    # Write style.css
     with open(os.path.join(out_dir, "style.css"), "w") as f:
         f.write(formatter.get_style_defs())
 
-    for src_file in by_src_file:
-        log('  generating HTML for %r\n' % src_file)
-
-        if 0:
-            print(src_file)
-            print('*' * 76)
-        with open(os.path.join(build_dir, src_file)) as f:
-            code = f.read()
-        if 0:
-            print(code)
-            print('*' * 76)
-
-        try:
-            lexer = pygments.lexers.guess_lexer_for_filename(src_file, code)
-        except Exception as e:
-            print(f"Skipped unparsed file {src_file} because exception throw is: {e}\n")
-
-        # Use pygments to convert it all to HTML:
-        code_as_html = pygments.highlight(code, lexer, formatter)
-
-        if 0:
-            print(code_as_html)
-            print('*' * 76)
-            print(repr(code_as_html))
-            print('*' * 76)
-
-        EXPECTED_START = '<div class="highlight"><pre>'
-        assert code_as_html.startswith(EXPECTED_START)
-        code_as_html = code_as_html[len(EXPECTED_START):-1]
-
-        EXPECTED_END = '</pre></div>'
-        assert code_as_html.endswith(EXPECTED_END)
-        code_as_html = code_as_html[0:-len(EXPECTED_END)]
-
-        html_lines = code_as_html.splitlines()
-        if 0:
-            for html_line in html_lines:
-                print(repr(html_line))
-            print('*' * 76)
-
-        # Group by line num
-        by_line_num = {}
-        for record in by_src_file[src_file]:
-            line_num = record.location.line
-            if line_num not in by_line_num:
-                by_line_num[line_num] = []
-            by_line_num[line_num].append(record)
-
-        next_id = 0
-
-        with open(os.path.join(out_dir, srcfile_to_html(src_file)), "w") as f:
-            write_html_header(f, html.escape(src_file),
-                              '<link rel="stylesheet" href="style.css" type="text/css" />\n')
-            f.write('<h1>%s</h1>' % html.escape(src_file))
-            f.write('<table class="table table-striped table-bordered table-sm">\n')
+def write_source_file_html(build_dir, out_dir, src_file, records, highest_count):
+    """
+    Write the page for src_file, showing records (the records located
+    within it) against its source code.
+
+    Return a (src_file, error, stats) triple, where error is None on
+    success, and stats is a dict of timings for profiling.add_page (or
+    None on failure).  This is a module-level function so that it can be
+    run in a worker process.
+    """
+    log('  generating HTML for %r' % src_file)
+
+    start = time.perf_counter()
+    try:
+        html_lines = highlight_source_file(build_dir, src_file)
+    except (OSError, UnicodeDecodeError) as e:
+        return src_file, '%s: %s' % (type(e).__name__, e), None
+    highlight_seconds = time.perf_counter() - start
+
+    # Group by line num
+    by_line_num = {}
+    for record in records:
+        line_num = record.location.line
+        if line_num not in by_line_num:
+            by_line_num[line_num] = []
+        by_line_num[line_num].append(record)
+
+    next_id = 0
+
+    with open(os.path.join(out_dir, srcfile_to_html(src_file)), "w",
+              buffering=WRITE_BUFFER_SIZE) as f:
+        write_html_header(f, html.escape(src_file),
+                          '<link rel="stylesheet" href="style.css" type="text/css" />\n')
+        f.write('<h1>%s</h1>' % html.escape(src_file))
+        f.write('<table class="table table-striped table-bordered table-sm">\n')
+        f.write('  <tr>\n')
+        f.write('    <th>Line</th>\n')
+        f.write('    <th>Hotness</th>\n')
+        f.write('    <th>Pass</th>\n')
+        f.write('    <th>Source</th>\n')
+        f.write('    <th>Function / Inlining Chain</th>\n')
+        f.write('  </tr>\n')
+        for line_num, html_line in enumerate(html_lines, start=1):
+            # Add row for the source line itself.
+
             f.write('  <tr>\n')
-            f.write('    <th>Line</th>\n')
-            f.write('    <th>Hotness</th>\n')
-            f.write('    <th>Pass</th>\n')
-            f.write('    <th>Source</th>\n')
-            f.write('    <th>Function / Inlining Chain</th>\n')
+
+            # Line:
+            f.write('    <td id="line-%i">%i</td>\n' % (line_num, line_num))
+
+            # Hotness:
+            f.write('    <td></td>\n')
+
+            # Pass:
+            f.write('    <td></td>\n')
+
+            # Source
+            f.write('    <td><div class="highlight"><pre style="margin: 0 0;">')
+            f.write(html_line)
+            f.write('</pre></div></td>\n')
+
+            # Inlining Chain:
+            f.write('    <td></td>\n')
+
             f.write('  </tr>\n')
-            for line_num, html_line in enumerate(html_lines, start=1):
-                # Add row for the source line itself.
 
+            # Add extra rows for any optimization records that apply to
+            # this line.
+            for record in by_line_num.get(line_num, []):
                 f.write('  <tr>\n')
 
-                # Line:
-                f.write('    <td id="line-%i">%i</td>\n' % (line_num, line_num))
-
-                # Hotness:
+                # Line (blank)
                 f.write('    <td></td>\n')
 
-                # Pass:
-                f.write('    <td></td>\n')
+                # Hotness
+                write_td_count(f, record, highest_count)
 
-                # Source
-                f.write('    <td><div class="highlight"><pre style="margin: 0 0;">')
-                f.write(html_line)
-                f.write('</pre></div></td>\n')
+                # Pass:
+                write_td_pass(f, record)
+
+                # Text
+                column = record.location.column
+                html_for_message = get_html_for_message(record)
+                # Column number is 1-based:
+                indent = ' ' * (column - 1)
+                lines = indent + '<span style="color:green;">^</span>'
+                for line in html_for_message.splitlines():
+                    lines += line + '\n' + indent
+                f.write('    <td><pre style="margin: 0 0;">')
+                num_lines = lines.count('\n')
+                collapsed =  num_lines > 7
+                if collapsed:
+                    f.write(TOGGLE_BUTTON_HTML % (next_id, next_id, num_lines))
+                    f.write('<div class="collapse" id="collapse-%i">' % next_id)
+                    next_id += 1
+                f.write(lines)
+                if collapsed:
+                    f.write('</div">')
+                f.write('</pre></td>\n')
 
                 # Inlining Chain:
-                f.write('    <td></td>\n')
+                write_inlining_chain(f, record)
 
                 f.write('  </tr>\n')
 
-                # Add extra rows for any optimization records that apply to
-                # this line.
-                for record in by_line_num.get(line_num, []):
-                    f.write('  <tr>\n')
-
-                    # Line (blank)
-                    f.write('    <td></td>\n')
-
-                    # Hotness
-                    write_td_count(f, record, highest_count)
-
-                    # Pass:
-                    write_td_pass(f, record)
-
-                    # Text
-                    column = record.location.column
-                    html_for_message = get_html_for_message(record)
-                    # Column number is 1-based:
-                    indent = ' ' * (column - 1)
-                    lines = indent + '<span style="color:green;">^</span>'
-                    for line in html_for_message.splitlines():
-                        lines += line + '\n' + indent
-                    f.write('    <td><pre style="margin: 0 0;">')
-                    num_lines = lines.count('\n')
-                    collapsed =  num_lines > 7
-                    if collapsed:
-                        f.write('''<button class="btn btn-primary" type="button" data-toggle="collapse" data-target="#collapse-%i" aria-expanded="false" aria-controls="collapse-%i">
-    Toggle messages <span class="badge badge-light">%i</span>
-  </button>
-                        ''' % (next_id, next_id, num_lines))
-                        f.write('<div class="collapse" id="collapse-%i">' % next_id)
-                        next_id += 1
-                    f.write(lines)
-                    if collapsed:
-                        f.write('</div">')
-                    f.write('</pre></td>\n')
-
-                    # Inlining Chain:
-                    write_inlining_chain(f, record)
-
-                    f.write('  </tr>\n')
-
-            f.write('</table>\n')
-            write_html_footer(f)
-
-            time.sleep(1.0)
-
-            """
-            Because all of file are generated as HTML and the file are actually
-            contains HTML contents, so that we need to rename file to HTML
-            so that the browser can be displayed
-            """
-            filename = os.path.basename(src_file)
-            print(filename)
-            print(src_file)
-            currentWorkingDir = out_dir
-            print(f"Filename {filename} that skipped are already in HTML and can be renamed to .html, but")
-            print("some features will not work!")
-            fileInWorkingDir = currentWorkingDir + "\\" + filename
-            fs_path = Path(filename)
-            if fs_path.suffix:
-                # File has an extension
-                base_name = fs_path.stem
-            else:
-                # File does not have an extension
-                base_name = fs_path.name
-
-            print(f"File generated to {out_dir} as {fileInWorkingDir}")
-            print(currentWorkingDir + "\\" + base_name)
-
-            counter: int = 1
-            if os.path.exists(currentWorkingDir + "\\" + base_name + ".html"):
-                renamed_based_name = f"{base_name}_{counter}"
-                if os.path.exists(currentWorkingDir + "\\" + base_name + "_" + str(counter) + ".html"):
-                    counter += 1
-                    renamed_based_name = f"{base_name}_{counter}"
-                
-                os.rename(fileInWorkingDir, currentWorkingDir + "\\" + renamed_based_name + ".html")
-                print(f"Renamed from {fileInWorkingDir} to {currentWorkingDir}\\{renamed_based_name}.html\n")
-            else:
-                os.rename(fileInWorkingDir, currentWorkingDir + "\\" + base_name + ".html")
-                print(f"Renamed from {fileInWorkingDir} to {currentWorkingDir}\\{base_name}.html\n")
+        f.write('</table>\n')
+        write_html_footer(f)
+
+    return src_file, None, get_page_stats(src_file, start, highlight_seconds,
+                                          len(html_lines), len(records))
+
+def highlight_source_file(build_dir, src_file):
+    """
+    Read src_file (relative to build_dir), and use pygments to convert
+    it to HTML, returning a list with one string of HTML per line.
+    """
+    with open(os.path.join(build_dir, src_file)) as f:
+        code = f.read()
+    formatter = pygments.formatters.HtmlFormatter()
+    return highlight_lines(code, get_lexer(src_file, code), formatter)
+
+def get_page_stats(src_file, start, highlight_seconds, num_lines,
+                   num_records):
+    return {'src_file': src_file,
+            'seconds': time.perf_counter() - start,
+            'highlight_seconds': highlight_seconds,
+            'lines': num_lines,
+            'records': num_records}
+
+def write_sourceview_assets(out_dir):
+    for filename in SOURCEVIEW_ASSETS:
+        shutil.copyfile(os.path.join(ASSETS_DIR, filename),
+                        os.path.join(out_dir, filename))
+
+def get_text_width(html_text):
+    """Get the width in characters of html_text as shown in a <pre>"""
+    return len(html.unescape(TAG_RE.sub('', html_text)).expandtabs())
+
+def write_virtual_source_file_html(build_dir, out_dir, src_file, records,
+                                   highest_count):
+    """
+    Write the page for src_file like write_source_file_html, but as a
+    small page whose rows are rendered by sourceview.js as they are
+    scrolled into view, from the source and records written to
+    srcfile_to_data(src_file).  The browser then only ever holds a
+    screenful or so of rows, however long the file.
+
+    The HTML of the passes, messages and inlining chains is kept in a
+    table of strings, as the same ones recur throughout a file.
+
+    Return a (src_file, error, stats) triple, like write_source_file_html.
+    """
+    log('  generating HTML for %r' % src_file)
+
+    start = time.perf_counter()
+    try:
+        html_lines = highlight_source_file(build_dir, src_file)
+    except (OSError, UnicodeDecodeError) as e:
+        return src_file, '%s: %s' % (type(e).__name__, e), None
+    highlight_seconds = time.perf_counter() - start
+
+    strings = []
+    string_ids = {}
+    def get_string_id(text):
+        string_id = string_ids.get(text)
+        if string_id is None:
+            string_id = string_ids[text] = len(strings)
+            strings.append(text)
+        return string_id
+
+    # The width of the widest row of the source column, in characters
+    width = max(map(get_text_width, html_lines), default=0)
+
+    rows = []
+    for record in records:
+        loc = record.location
+        # As with write_source_file_html, records can only be shown on
+        # lines of the file
+        if not 1 <= loc.line <= len(html_lines):
+            continue
+        message_lines = get_html_for_message(record).splitlines()
+        width = max([width] + [loc.column + get_text_width(line)
+                               for line in message_lines])
+        rows.append([loc.line,
+                     loc.column,
+                     get_hotness_text(record, highest_count),
+                     get_effective_result(record),
+                     get_string_id(get_pass_html(record)),
+                     get_string_id('\n'.join(message_lines)),
+                     [get_string_id(item)
+                      for item in get_inlining_chain_html(record)]])
+
+    # A script rather than a .json file, so that pages opened straight
+    # from the filesystem can load it
+    with open(os.path.join(out_dir, srcfile_to_data(src_file)), 'w',
+              buffering=WRITE_BUFFER_SIZE) as f:
+        f.write('loadSourceData(')
+        json.dump({'width': width,
+                   'lines': html_lines,
+                   'strings': strings,
+                   'records': rows},
+                  f, separators=(',', ':'))
+        f.write(');\n')
+
+    with open(os.path.join(out_dir, srcfile_to_html(src_file)), "w") as f:
+        write_html_header(f, html.escape(src_file),
+                          '<link rel="stylesheet" href="style.css" type="text/css" />\n'
+                          '<link rel="stylesheet" href="sourceview.css" type="text/css" />\n')
+        f.write('<h1>%s</h1>\n' % html.escape(src_file))
+        f.write('<div id="source-view"></div>\n')
+        f.write('<script src="sourceview.js"></script>\n')
+        f.write('<script src="%s"></script>\n'
+                % html.escape(srcfile_to_data(src_file)))
+        write_html_footer(f)
+
+    return src_file, None, get_page_stats(src_file, start, highlight_seconds,
+                                          len(html_lines), len(records))
 
 def write_cfg_view(f, view_id, cfg):
     # see http://visjs.org/docs/network/
@@ -475,60 +697,131 @@ def write_cfg_view(f, view_id, cfg):
 </script>
 """)
 
-def have_any_precise_counts(tus):
-    for tu in tus:
-        for record in tu.records:
-            if isinstance(record, Record):
-                if record.count:
-                    if record.count.is_precise():
-                        return True
-
-def filter_non_precise_counts(tus):
-    precise_records = []
-    num_filtered = 0
-    for tu in tus:
-        for record in tu.records:
-            if isinstance(record, Record):
-                if record.count:
-                    if not record.count.is_precise():
-                        num_filtered += 1
-                        continue
-            precise_records.append(record)
-    log('  purged %i non-precise records' % num_filtered)
-    return precise_records
-
+@profiled('analyze_counts')
 def analyze_counts(tus):
     """
-    Get the highest count, purging any non-precise counts
-    if we have any precise counts.
+    Get the CountStats of tus, in one pass over their records.  If any
+    top-level records have precise counts, CountStats.apply leaves out
+    those with other counts.
     """
     log(' analyze_counts')
-
-    if have_any_precise_counts(tus):
-        records = filter_non_precise_counts(tus)
-
-    highest_count = 0
-    for tu in tus:
-        for record in tu.records:
-            if isinstance(record, Record):
-                if record.count:
-                    value = record.count.value
-                    if value > highest_count:
-                        highest_count = value
-
-    return highest_count
-
-def make_html(build_dir, out_dir, tus):
+    stats = CountStats(tus)
+    for line in stats.format_summary():
+        log(line)
+    return stats
+
+def make_html(build_dir, out_dir, tus, highest_count, jobs=1, manifest=None,
+              virtual=False, triage_top=DEFAULT_TOP,
+              triage_coverage=DEFAULT_COVERAGE):
     log('make_html')
 
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    highest_count = analyze_counts(tus)
     log(' highest_count=%r' % highest_count)
 
-    make_index_html(out_dir, tus, highest_count)
-    make_per_source_file_html(build_dir, out_dir, tus, highest_count)
+    make_index_html(out_dir, tus, highest_count, manifest)
+    make_triage_html(out_dir, tus, triage_top, triage_coverage, manifest)
+    make_per_source_file_html(build_dir, out_dir, tus, highest_count, jobs,
+                              manifest, virtual)
+
+############################################################################
+
+@profiled('triage')
+def make_triage_html(out_dir, tus, top=DEFAULT_TOP, coverage=DEFAULT_COVERAGE,
+                     manifest=None):
+    log(' make_triage_html')
+
+    if manifest:
+        inputs = manifest.get_inputs([tu.filename for tu in tus],
+                                     top=top, coverage=coverage)
+        if check_page(manifest, 'triage.html', inputs):
+            return
+
+    write_triage_html(out_dir, triage_tus(tus, top, coverage))
+
+def write_td_share(f, share):
+    f.write('    <td style="text-align:right">%.2f%%</td>\n' % (100. * share))
+
+def write_td_location(f, loc, text=None):
+    f.write('    <td>\n')
+    if loc:
+        f.write('<a href="%s">' % url_from_location(loc))
+        f.write(text or html.escape(str(loc)))
+        f.write('</a>')
+    elif text:
+        f.write(text)
+    f.write('    </td>\n')
+
+def write_triage_groups(f, title, groups, with_location):
+    f.write('<h4>%s</h4>\n' % title)
+    f.write('<table class="table table-striped table-bordered table-sm">\n')
+    f.write('  <tr>\n')
+    if with_location:
+        f.write('    <th>Source Location</th>\n')
+    f.write('    <th>Function</th>\n')
+    f.write('    <th style="text-align:right">Failures</th>\n')
+    f.write('    <th style="text-align:right">Weight</th>\n')
+    f.write('    <th style="text-align:right">Share</th>\n')
+    f.write('    <th style="text-align:right">Cumulative</th>\n')
+    f.write('    <th>Hottest Failure</th>\n')
+    f.write('  </tr>\n')
+    for group in groups:
+        function_html = '<code>%s</code>' % html.escape(group.function or '')
+        f.write('  <tr>\n')
+        if with_location:
+            write_td_location(f, group.location)
+            f.write('    <td>%s</td>\n' % function_html)
+        else:
+            write_td_location(f, group.hottest.location, function_html)
+        f.write('    <td style="text-align:right">%i</td>\n'
+                % group.num_failures)
+        f.write('    <td style="text-align:right">%i</td>\n' % group.weight)
+        write_td_share(f, group.share)
+        write_td_share(f, group.cumulative_share)
+        write_td_with_color(f, group.hottest,
+                            get_summary_text(group.hottest))
+        f.write('  </tr>\n')
+    f.write('</table>\n')
+
+def write_triage_html(out_dir, report):
+    """Write report (a triage.TriageReport) to triage.html"""
+    filename = os.path.join(out_dir, 'triage.html')
+    with open(filename, "w", buffering=WRITE_BUFFER_SIZE) as f:
+        write_html_header(f, 'Triage', '')
+        f.write('<p><a href="index.html">All optimizations</a></p>\n')
+        f.write('<p>%i failures, of which %i have counts, totalling %i.'
+                ' Each table lists up to %i entries, stopping at %.0f%% of'
+                ' the total.</p>\n'
+                % (report.num_failures, report.num_hot_failures,
+                   report.total_weight, report.top, 100. * report.coverage))
+
+        write_triage_groups(f, 'Hottest loops', report.loops, True)
+        write_triage_groups(f, 'Hottest functions', report.functions, False)
+
+        f.write('<h4>Hottest failures</h4>\n')
+        f.write('<table class="table table-striped table-bordered table-sm">\n')
+        f.write('  <tr>\n')
+        f.write('    <th>Summary</th>\n')
+        f.write('    <th>Source Location</th>\n')
+        f.write('    <th style="text-align:right">Count</th>\n')
+        f.write('    <th style="text-align:right">Cumulative</th>\n')
+        f.write('    <th>Function / Inlining Chain</th>\n')
+        f.write('    <th>Pass</th>\n')
+        f.write('  </tr>\n')
+        for failure in report.failures:
+            record = failure.record
+            f.write('  <tr>\n')
+            write_td_with_color(f, record, get_summary_text(record))
+            write_td_location(f, record.location)
+            f.write('    <td style="text-align:right">%i</td>\n'
+                    % failure.weight)
+            write_td_share(f, failure.cumulative_share)
+            write_inlining_chain(f, record)
+            write_td_pass(f, record)
+            f.write('  </tr>\n')
+        f.write('</table>\n')
+        write_html_footer(f)
 
 ############################################################################
 
@@ -553,19 +846,29 @@ def write_record_to_outline(f, record, level):
     for child in record.children:
         write_record_to_outline(f, child, level + 1)
 
-def make_outline(build_dir, out_dir, tus):
+@profiled('outline')
+def make_outline(build_dir, out_dir, tus, manifest=None):
     log('make_outline')
 
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    with open(os.path.join(out_dir, 'outline.txt'), 'w') as f:
+    if manifest:
+        inputs = manifest.get_inputs([tu.filename for tu in tus])
+        if check_page(manifest, 'outline.txt', inputs):
+            return
+
+    with open(os.path.join(out_dir, 'outline.txt'), 'w',
+              buffering=WRITE_BUFFER_SIZE) as f:
         for tu in tus:
-            f.write('* %s\n' % tu.filename)
-            # FIXME: metadata?
-            for record in tu.iter_all_records():
-                write_record_to_outline(f, record, 2)
-            # FIXME: show passes?
+            write_tu_to_outline(f, tu.filename, tu.iter_all_records())
+
+def write_tu_to_outline(f, filename, records):
+    f.write('* %s\n' % filename)
+    # FIXME: metadata?
+    for record in records:
+        write_record_to_outline(f, record, 2)
+    # FIXME: show passes?
 
 ############################################################################
 
@@ -621,40 +924,47 @@ def print_as_remark(record):
 
 ############################################################################
 
-def filter_records(tus):
-    def criteria(record):
-        # Hack to filter things a bit:
-        if record.location:
-            src_file = record.location.file
-            if 'pgen.c' in src_file:
-                return False
-        if record.pass_:
-            if record.pass_.name in ('slp', 'fre', 'pre', 'profile',
-                                     'cunroll', 'cunrolli', 'ivcanon'):
-                return False
-        return True
-    for tu in tus:
-        tu.records = list(filter(criteria, tu.records))
+def summarize_records(table):
+    log_records_by_pass(table.count_by_pass())
 
-def summarize_records(tus):
+def log_records_by_pass(num_records_by_pass):
     log('records by pass:')
-    num_records_by_pass = Counter()
-    for tu in tus:
-        for record in tu.iter_all_records():
-            #print(record)
-            if record.pass_:
-                num_records_by_pass[record.pass_.name] += 1
+    num_records_by_pass = Counter(num_records_by_pass)
+    num_records_by_pass.pop(None, None)
     for pass_,count in num_records_by_pass.most_common():
         log(' %s: %i' % (pass_, count))
 
-def generate_static_report(build_dir, out_dir):
-    tus = find_records(build_dir)
+def generate_static_report(build_dir, out_dir, jobs=1, cache=None,
+                           incremental=False, compress=None, virtual=False,
+                           triage_top=DEFAULT_TOP,
+                           triage_coverage=DEFAULT_COVERAGE,
+                           record_filter=DEFAULT_FILTER):
+    """
+    Write a static HTML report on the records in build_dir to out_dir,
+    loading only those kept by record_filter (a RecordFilter).
+
+    If incremental is true, a manifest of the inputs of each page is
+    kept in out_dir, and pages whose inputs haven't changed since the
+    previous incremental run are left as they are.
+
+    compress is None, or one of compress.COMPRESS_MODES to also (or
+    only) write precompressed .gz and .br forms of each page, for a web
+    server to serve directly.
 
-    summarize_records(tus)
+    If virtual is true, the source pages are written by
+    write_virtual_source_file_html.
 
-    filter_records(tus)
+    triage.html ranks the hottest failures, and the loops and functions
+    with the most failure weight, triage_top of each, cut off once they
+    cover the triage_coverage share of the total (see triage.Triage).
+    """
+    tus = find_records(build_dir, jobs, cache, record_filter)
 
-    summarize_records(tus)
+    # Every later stage sees the records through the same view
+    count_stats = analyze_counts(tus)
+    tus = count_stats.apply(tus)
+
+    summarize_records(RecordTable(tus))
     if 0:
         for tu in tus:
             for record in tu.records:
@@ -663,5 +973,146 @@ def generate_static_report(build_dir, out_dir):
         for tu in tus:
             for record in tu.records:
                 print(record)
-    make_html(build_dir, out_dir, tus)
-    make_outline(build_dir, out_dir, tus)
+    if incremental:
+        if not os.path.exists(out_dir):
+            os.mkdir(out_dir)
+        manifest = Manifest(out_dir, compress, record_filter)
+    else:
+        manifest = None
+    make_html(build_dir, out_dir, tus, count_stats.highest_count, jobs,
+              manifest, virtual, triage_top, triage_coverage)
+    make_outline(build_dir, out_dir, tus, manifest)
+    if manifest:
+        manifest.save()
+    finish_output(out_dir, compress, jobs)
+
+def finish_output(out_dir, compress, jobs=1):
+    if compress:
+        compress_output(out_dir, compress, jobs)
+    else:
+        remove_stale_compressed(out_dir)
+
+############################################################################
+
+@profiled('source_pages')
+def make_per_source_file_html_from_db(db, build_dir, out_dir, highest_count,
+                                      jobs=1, excluded_roots=None,
+                                      virtual=False):
+    log(' make_per_source_file_html')
+
+    write_style_css(out_dir)
+    if virtual:
+        write_sourceview_assets(out_dir)
+        write_page = write_virtual_source_file_html
+    else:
+        write_page = write_source_file_html
+
+    # Query a few pages' worth of records at a time, rather than
+    # grouping every record by source file up front
+    batch_size = max(jobs, 1) * 4
+    src_files = [src_file for src_file, _ in db.get_sourcefiles()]
+    executor = None
+    if jobs > 1 and len(src_files) > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        for start in range(0, len(src_files), batch_size):
+            batch = []
+            for src_file in src_files[start:start + batch_size]:
+                records = list(db.iter_records('r.file_id = ?',
+                                               (db.get_file_id(src_file),),
+                                               excluded_roots=excluded_roots))
+                if records:
+                    batch.append((src_file, records))
+            args = (repeat(build_dir), repeat(out_dir),
+                    [src_file for src_file, _ in batch],
+                    [records for _, records in batch],
+                    repeat(highest_count))
+            if executor:
+                results = executor.map(write_page, *args)
+            else:
+                results = map(write_page, *args)
+            for src_file, error, stats in results:
+                add_page(stats)
+                if error:
+                    log('  skipped %r: %s' % (src_file, error))
+    finally:
+        if executor:
+            executor.shutdown()
+
+def generate_static_report_from_db(db, build_dir, out_dir, jobs=1,
+                                   compress=None, virtual=False,
+                                   triage_top=DEFAULT_TOP,
+                                   triage_coverage=DEFAULT_COVERAGE,
+                                   record_filter=DEFAULT_FILTER):
+    """
+    Write a static HTML report on the records in db (a RecordDatabase) to
+    out_dir, reading source files from build_dir, with the remaining
+    arguments as for generate_static_report.
+
+    The records are read from db as each page is written, so at most a
+    few pages' worth of them are held in memory at a time.  The rules of
+    record_filter are applied to the top-level records as they are read;
+    its max_depth is not supported.
+    """
+    log_records_by_pass({passname: num_records
+                         for passname, _, num_records in db.count_by_pass()})
+
+    # Apply record_filter to the top-level records, skipping the
+    # excluded ones (and their descendants) in the queries below; as
+    # with CountStats, those with imprecise counts are also skipped if
+    # any have precise counts.  This is the only pass over all of the
+    # records, so it is timed as the load
+    with phase('load'):
+        excluded_roots = set()
+        imprecise_roots = set()
+        any_precise = False
+        for id_, record in db.iter_toplevel_records():
+            if not record_filter.keeps_record(record):
+                excluded_roots.add(id_)
+            elif has_imprecise_count(record):
+                imprecise_roots.add(id_)
+            elif record.count:
+                any_precise = True
+    if any_precise and imprecise_roots:
+        log('  purged %i non-precise records' % len(imprecise_roots))
+        excluded_roots |= imprecise_roots
+    num_records_by_pass = {passname: num_records
+                           for passname, _, num_records
+                           in db.count_by_pass(excluded_roots)}
+    log_records_by_pass(num_records_by_pass)
+
+    log('make_html')
+    if not os.path.exists(out_dir):
+        os.mkdir(out_dir)
+
+    with phase('analyze_counts'):
+        highest_count = db.max_count(excluded_roots)
+    log(' highest_count=%r' % highest_count)
+
+    log(' make_index_html')
+    with phase('index'):
+        write_index_pages(out_dir,
+                          db.iter_records(order='r.count DESC, r.id',
+                                          excluded_roots=excluded_roots),
+                          sum(num_records_by_pass.values()), highest_count)
+
+    log(' make_triage_html')
+    with phase('triage'):
+        write_triage_html(out_dir,
+                          triage_records(db.iter_records(
+                                             'r.depth = 0',
+                                             excluded_roots=excluded_roots),
+                                         triage_top, triage_coverage))
+    make_per_source_file_html_from_db(db, build_dir, out_dir, highest_count,
+                                      jobs, excluded_roots, virtual)
+
+    log('make_outline')
+    with phase('outline'), open(os.path.join(out_dir, 'outline.txt'), 'w',
+                                buffering=WRITE_BUFFER_SIZE) as f:
+        for tu, _, _ in db.get_translation_units():
+            records = db.iter_records('r.tu_id = ?',
+                                      (db.get_tu_id(tu.filename),),
+                                      excluded_roots=excluded_roots)
+            write_tu_to_outline(f, tu.filename, records)
+
+    finish_output(out_dir, compress, jobs)
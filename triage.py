@@ -0,0 +1,194 @@
+import heapq
+
+from utils import get_effective_result
+
+# The number of entries in each ranking of a TriageReport
+DEFAULT_TOP = 50
+
+# The share of the total weight of the failures that each ranking of a
+# TriageReport covers, at most; 1.0 for no cutoff
+DEFAULT_COVERAGE = 1.0
+
+def get_weight(record):
+    """Get the profile weight of record: its count, or 0 if it has none"""
+    if not record.count:
+        return 0
+    return record.count.value
+
+def get_function(record):
+    """
+    Get the name of the function that record is in, falling back to the
+    innermost function of its inlining chain.
+    """
+    if record.function:
+        return record.function
+    if record.inlining_chain:
+        return record.inlining_chain[0].fndecl
+    return None
+
+def get_location_key(loc):
+    if not loc:
+        return None
+    return (loc.file, loc.line)
+
+class Group:
+    """The failures rolled up by a function, or a loop within one"""
+    __slots__ = ('function', 'location', 'weight', 'num_failures',
+                 'hottest', 'share', 'cumulative_share')
+
+    def __init__(self, function, location):
+        self.function = function
+        # The location of the loop, or None for a whole function
+        self.location = location
+        self.weight = 0
+        self.num_failures = 0
+        # The hottest of the failures, for its message and inlining chain
+        self.hottest = None
+        self.share = 0.
+        self.cumulative_share = 0.
+
+    def add(self, record, weight):
+        self.weight += weight
+        self.num_failures += 1
+        if self.hottest is None or weight > get_weight(self.hottest):
+            self.hottest = record
+
+class RankedFailure:
+    """A failure record, with its place in the ranking of failures"""
+    __slots__ = ('record', 'weight', 'share', 'cumulative_share')
+
+    def __init__(self, record, weight, share, cumulative_share):
+        self.record = record
+        self.weight = weight
+        self.share = share
+        self.cumulative_share = cumulative_share
+
+class TriageReport:
+    """
+    The hottest failures, and the hottest loops and functions by the
+    total weight of their failures, each ranked from hottest down.
+    """
+    def __init__(self, total_weight, num_failures, num_hot_failures,
+                 failures, loops, functions, top, coverage):
+        self.total_weight = total_weight
+        self.num_failures = num_failures
+        self.num_hot_failures = num_hot_failures
+        self.failures = failures
+        self.loops = loops
+        self.functions = functions
+        self.top = top
+        self.coverage = coverage
+
+class Triage:
+    """
+    Accumulates the failures of a stream of top-level records (those
+    whose effective result is 'failure', as given by
+    get_effective_result) for a TriageReport, in a single pass.
+
+    Only the top heaviest failures are kept, in a heap; the loops and
+    functions are aggregated in full, as a failure anywhere can move
+    any of them into the ranking.  Loops are identified by the location
+    of their failure record.
+    """
+    def __init__(self, top=DEFAULT_TOP):
+        self.top = top
+        self.total_weight = 0
+        self.num_failures = 0
+        self.num_hot_failures = 0
+        # Heap of (weight, -sequence number, record) of the heaviest
+        self.heap = []
+        # Mapping of (function, (file, line)) to Group, and of function
+        # to Group
+        self.loops = {}
+        self.functions = {}
+
+    def add_records(self, records):
+        for record in records:
+            self.add_record(record)
+
+    def add_record(self, record):
+        """
+        Add record if its effective result is a failure, and otherwise
+        any failures among its descendants.
+        """
+        if get_effective_result(record) != 'failure':
+            for child in record.children:
+                self.add_record(child)
+            return
+        self.num_failures += 1
+        weight = get_weight(record)
+        if not weight:
+            return
+        self.num_hot_failures += 1
+        self.total_weight += weight
+
+        item = (weight, -self.num_hot_failures, record)
+        if len(self.heap) < self.top:
+            heapq.heappush(self.heap, item)
+        elif item[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, item)
+
+        function = get_function(record)
+        loop_key = (function, get_location_key(record.location))
+        loop = self.loops.get(loop_key)
+        if loop is None:
+            loop = self.loops[loop_key] = Group(function, record.location)
+        loop.add(record, weight)
+        group = self.functions.get(function)
+        if group is None:
+            group = self.functions[function] = Group(function, None)
+        group.add(record, weight)
+
+    def get_report(self, coverage=DEFAULT_COVERAGE):
+        """
+        Get the TriageReport of the failures added so far, cutting each
+        ranking off once it covers the coverage share (from 0 to 1) of
+        their total weight.
+        """
+        heaviest = sorted(self.heap, key=lambda item: item[:2], reverse=True)
+        ranks = self._rank([weight for weight, _, _ in heaviest], coverage)
+        failures = [RankedFailure(record, weight, share, cumulative_share)
+                    for (_, _, record), (weight, share, cumulative_share)
+                    in zip(heaviest, ranks)]
+        return TriageReport(self.total_weight, self.num_failures,
+                            self.num_hot_failures, failures,
+                            self._rank_groups(self.loops, coverage),
+                            self._rank_groups(self.functions, coverage),
+                            self.top, coverage)
+
+    def _rank_groups(self, groups, coverage):
+        ranked = heapq.nlargest(self.top, groups.values(),
+                                key=lambda group: group.weight)
+        ranks = self._rank([group.weight for group in ranked], coverage)
+        result = []
+        for group, (_, share, cumulative_share) in zip(ranked, ranks):
+            group.share = share
+            group.cumulative_share = cumulative_share
+            result.append(group)
+        return result
+
+    def _rank(self, weights, coverage):
+        """
+        Yield (weight, share, cumulative share) for each of weights (from
+        heaviest down), stopping after the one that reaches coverage.
+        """
+        cumulative = 0
+        for weight in weights:
+            cumulative += weight
+            yield (weight, weight / self.total_weight,
+                   cumulative / self.total_weight)
+            if cumulative >= coverage * self.total_weight:
+                return
+
+def triage_records(records, top=DEFAULT_TOP, coverage=DEFAULT_COVERAGE):
+    """Get the TriageReport of an iterable of top-level records"""
+    triage = Triage(top)
+    triage.add_records(records)
+    return triage.get_report(coverage)
+
+def triage_tus(tus, top=DEFAULT_TOP, coverage=DEFAULT_COVERAGE):
+    """Get the TriageReport of the records of a list of TranslationUnits"""
+    triage = Triage(top)
+    for tu in tus:
+        triage.add_records(tu.records)
+    return triage.get_report(coverage)
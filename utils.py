@@ -1,31 +1,199 @@
+from concurrent.futures import ProcessPoolExecutor
+import html
+from itertools import repeat
 import os
 
 from optrecord import TranslationUnit, Record, Expr, Stmt, SymtabNode
+import profiling
 
 def log(*args):
     print(*args)
 
-def find_records(build_dir):
+def find_record_files(build_dir):
     """
-    Scan build_dir and below, looking for "*.opt-record.json".
-    Return a list of TranslationUnit instances.
+    Scan build_dir and below, looking for "*.opt-record.json.gz".
+    Return a sorted list of filenames, so that callers see the files
+    in the same order regardless of directory enumeration order.
     """
-    log('find_records: %r' % build_dir)
-
-    tus = []
+    filenames = []
 
     # (os.scandir is Python 3.5 onwards)
     for root, dirs, files in os.walk(build_dir):
         for file_ in files:
             if file_.endswith('.opt-record.json.gz'):
-                filename = os.path.join(root, file_)
-                log(' reading: %r' % filename)
-                tus.append(TranslationUnit.from_filename(filename))
+                filenames.append(os.path.join(root, file_))
+
+    return sorted(filenames)
+
+def load_translation_unit(filename, cache=None, key=None, profile=False,
+                          record_filter=None):
+    """
+    Load filename, returning a (filename, TranslationUnit, error, stats)
+    tuple.  Exactly one of the TranslationUnit and the error message is
+    None.  If cache is given, the TranslationUnit is stored in it under
+    key.  If profile is true, stats is a dict of timings for
+    profiling.add_file, and otherwise None.  If record_filter (a
+    recordfilter.RecordFilter) is given, only the records it keeps are
+    loaded.
+
+    This is a module-level function so that it can be run in a worker
+    process.
+    """
+    stats = None
+    try:
+        if profile:
+            tu, stats = profiling.load_timed(filename, record_filter)
+        else:
+            tu = TranslationUnit.from_filename(filename, record_filter)
+    except (OSError, EOFError, UnicodeDecodeError, ValueError,
+            KeyError, TypeError) as e:
+        return filename, None, '%s: %s' % (type(e).__name__, e), None
+    if cache and key:
+        cache.store(filename, key, tu)
+    return filename, tu, None, stats
+
+def find_records(build_dir, jobs=1, cache=None, record_filter=None):
+    """
+    Scan build_dir and below, looking for "*.opt-record.json.gz".
+    Return a list of TranslationUnit instances, with only the records
+    kept by record_filter (a recordfilter.RecordFilter) if it is given.
+
+    If jobs is greater than 1, the files are decompressed and parsed
+    by a pool of that many worker processes.  Either way the result is
+    in the order of find_record_files; files that can't be read are
+    reported and skipped.
+
+    If cache (a RecordCache) is given, files that are unchanged since
+    they were cached are loaded from it, and only the rest are parsed.
+    """
+    log('find_records: %r' % build_dir)
+
+    with profiling.phase('discovery'):
+        filenames = find_record_files(build_dir)
+
+    with profiling.phase('load'):
+        if jobs > 1 and len(filenames) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                return load_translation_units(filenames, cache, executor,
+                                              record_filter)
+        return load_translation_units(filenames, cache,
+                                      record_filter=record_filter)
+
+def load_translation_units(filenames, cache=None, executor=None,
+                           record_filter=None):
+    """
+    Load the given .json.gz files, returning a list of TranslationUnit
+    instances in the same order; files that can't be read are reported
+    and skipped.
+
+    Files not found in cache (a RecordCache, if any) are parsed by
+    executor if given, and otherwise in this process, keeping only the
+    records kept by record_filter (if any).
+    """
+    tu_by_filename = {}
+    to_parse = []
+    keys = []
+    for filename in filenames:
+        key = None
+        if cache:
+            key = cache.get_key(filename, record_filter)
+            tu = cache.load(filename, key) if key else None
+            if tu:
+                log(' reading from cache: %r' % filename)
+                tu_by_filename[filename] = tu
+                continue
+        to_parse.append(filename)
+        keys.append(key)
+
+    if cache:
+        log(' %i of %i files loaded from cache'
+            % (len(tu_by_filename), len(filenames)))
 
-    return tus
+    args = (to_parse, repeat(cache), keys, repeat(profiling.is_enabled()),
+            repeat(record_filter))
+    if executor and len(to_parse) > 1:
+        collect_translation_units(
+            executor.map(load_translation_unit, *args), tu_by_filename)
+    else:
+        collect_translation_units(
+            map(load_translation_unit, *args), tu_by_filename)
+
+    return [tu_by_filename[filename] for filename in filenames
+            if filename in tu_by_filename]
+
+def collect_translation_units(results, tu_by_filename):
+    for filename, tu, error, stats in results:
+        if error:
+            log(' error reading %r: %s' % (filename, error))
+            continue
+        log(' reading: %r' % filename)
+        tu_by_filename[filename] = tu
+        profiling.add_file(stats)
 
 def get_effective_result(record):
     if record.kind == 'scope':
         if record.children:
             return get_effective_result(record.children[-1])
     return record.kind
+
+def get_html_for_items(record, url_from_location):
+    """
+    Get the HTML for record's own message (without its children's),
+    linking items with locations using url_from_location.
+    """
+    parts = []
+    for item in record.message:
+        if isinstance(item, str):
+            parts.append(html.escape(str(item)))
+        else:
+            if isinstance(item, Expr):
+                html_for_item = '<code>%s</code>' % html.escape(item.expr)
+            elif isinstance(item, Stmt):
+                html_for_item = '<code>%s</code>' % html.escape(item.stmt)
+            elif isinstance(item, SymtabNode):
+                html_for_item = '<code>%s</code>' % html.escape(item.node)
+            else:
+                raise TypeError('unknown message item: %r' % item)
+            if item.location:
+                html_for_item = ('<a href="%s">%s</a>'
+                                 % (url_from_location(item.location),
+                                    html_for_item))
+            parts.append(html_for_item)
+    return ''.join(parts)
+
+def render_message_html(record, url_from_location):
+    """
+    Get the HTML for record's message, followed by the lines of those of
+    its descendants, each indented by two spaces per level of nesting.
+
+    This is equivalent to appending each line of each child's rendering,
+    indented, to the parent's, but works in a single pass over the
+    records with the output collected in a list, rather than re-splitting
+    and re-indenting the text at every level.
+    """
+    out = [get_html_for_items(record, url_from_location)]
+    _render_descendants(record, '\n  ', out, url_from_location)
+    return ''.join(out)
+
+def _render_descendants(record, prefix, out, url_from_location):
+    """
+    Append the lines of record's descendants to out, each following
+    prefix (a newline and the indentation); return True if any were.
+    """
+    any_lines = False
+    for child in record.children:
+        text = get_html_for_items(child, url_from_location)
+        # The child's own lines are only known once it is known whether
+        # any of its descendants have lines, so leave a slot for them
+        slot = len(out)
+        out.append(None)
+        if _render_descendants(child, prefix + '  ', out, url_from_location):
+            # Lines following the child's text start a new line even if
+            # the text ends with a line break of its own (or is empty)
+            lines = (text + '\n').splitlines()
+        else:
+            lines = text.splitlines()
+        out[slot] = ''.join(prefix + line for line in lines)
+        if lines:
+            any_lines = True
+    return any_lines
@@ -0,0 +1,203 @@
+from concurrent.futures import ProcessPoolExecutor
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+
+from countstats import CountStats
+from recordindex import RecordIndex
+from utils import find_record_files, load_translation_units, log
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE)
+
+class Inotify:
+    """
+    A minimal inotify(7) binding, only reporting that something changed
+    in one of the watched directories.
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds for events, discarding them; return
+        True if there were any.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 1 << 16):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """
+    A thread which watches build_dir and below for .opt-record.json.gz
+    files being added, changed or removed, calling
+    on_change(changed, removed) with lists of their filenames.
+
+    inotify is used where it's available, and otherwise build_dir is
+    rescanned every interval seconds.  Changes are reported once no
+    more have arrived for settle seconds, so that a file is picked up
+    once it has been completely written.
+    """
+    def __init__(self, build_dir, on_change, interval=2.0, settle=0.5):
+        self.build_dir = build_dir
+        self.on_change = on_change
+        self.interval = interval
+        self.settle = settle
+        self.state = self.scan()
+        self.inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify()
+                self.add_watches()
+            except (OSError, AttributeError) as e:
+                # e.g. no inotify in libc, or out of watches
+                log('watch: falling back to polling: %s' % e)
+                if self.inotify:
+                    self.inotify.close()
+                    self.inotify = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def scan(self):
+        """Get a mapping of record filename to (size, mtime)"""
+        state = {}
+        for filename in find_record_files(self.build_dir):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            state[filename] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    def add_watches(self):
+        # Watching a directory again is harmless, so just (re)watch
+        # everything, picking up any new directories
+        for root, dirs, files in os.walk(self.build_dir):
+            self.inotify.add_watch(root)
+
+    def wait_for_change(self):
+        if not self.inotify:
+            time.sleep(self.interval)
+            return
+        self.inotify.wait()
+        while self.inotify.wait(self.settle):
+            pass
+        try:
+            self.add_watches()
+        except OSError as e:
+            log('watch: %s' % e)
+
+    def run(self):
+        while True:
+            self.wait_for_change()
+            state = self.scan()
+            changed = [filename for filename, key in state.items()
+                       if self.state.get(filename) != key]
+            removed = [filename for filename in self.state
+                       if filename not in state]
+            self.state = state
+            if changed or removed:
+                log('watch: %i changed, %i removed'
+                    % (len(changed), len(removed)))
+                try:
+                    self.on_change(sorted(changed), sorted(removed))
+                except Exception as e:
+                    # Keep watching; the next change will retry
+                    log('watch: reload failed: %s: %s'
+                        % (type(e).__name__, e))
+
+class IndexReloader:
+    """
+    Keeps a RecordIndex of the TUs of a build up to date as their files
+    change, for use as a Watcher's on_change.
+
+    A RecordIndex of each TU is kept, so that only the TUs that changed
+    need to be reparsed; the new combined index is built by
+    RecordIndex.merge and passed to set_index, which should install it
+    with a single assignment so that each request sees either the old
+    index or the new one.  Changed files are loaded with record_filter
+    (if any), as tus should have been.
+
+    As in set_tus, if any top-level records of the build have precise
+    counts, those with other counts are left out.  The CountStats of
+    each TU are kept too, so that this can be decided for the whole
+    build without walking the records of the TUs that didn't change.
+    """
+    def __init__(self, tus, set_index, jobs=1, cache=None,
+                 record_filter=None):
+        self.set_index = set_index
+        self.jobs = jobs
+        self.cache = cache
+        self.record_filter = record_filter
+        # Mapping of filename to (TranslationUnit, CountStats), and of
+        # filename to (whether imprecise counts were left out, RecordIndex)
+        self.tus = {}
+        self.indexes = {}
+        for tu in tus:
+            self.tus[tu.filename] = (tu, CountStats([tu]))
+        self.publish()
+
+    def publish(self):
+        any_precise = CountStats.merge(
+            stats for _, stats in self.tus.values()).any_precise
+        indexes = []
+        for filename in sorted(self.tus):
+            tu, stats = self.tus[filename]
+            excluding = any_precise and stats.num_imprecise_toplevel > 0
+            entry = self.indexes.get(filename)
+            if entry is None or entry[0] != excluding:
+                entry = self.indexes[filename] = (
+                    excluding, RecordIndex(stats.apply([tu], any_precise)))
+            indexes.append(entry[1])
+        self.set_index(RecordIndex.merge(indexes))
+
+    def on_change(self, changed, removed):
+        if self.jobs > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                tus = load_translation_units(changed, self.cache, executor,
+                                             self.record_filter)
+        else:
+            tus = load_translation_units(changed, self.cache,
+                                         record_filter=self.record_filter)
+        # Files that can't be read (e.g. still being written) keep their
+        # previous records until they change again
+        for tu in tus:
+            self.tus[tu.filename] = (tu, CountStats([tu]))
+            self.indexes.pop(tu.filename, None)
+        for filename in removed:
+            self.tus.pop(filename, None)
+            self.indexes.pop(filename, None)
+        self.publish()